@@ -4,7 +4,7 @@ Help for all functionality of this script is available in the documentation
 """
 
 import argparse
-import logging
+import asyncio
 import sys
 
 from wssb import config
@@ -12,8 +12,12 @@ from wssb import files
 from wssb import core
 from wssb import users
 from wssb import plugins
-
-logging.basicConfig(filename="server.log", level=logging.INFO, format='%(asctime)s %(levelname)s: %(message)s')
+from wssb import workers
+from wssb import backplane
+from wssb import log
+from wssb import storage
+from wssb import bench
+from wssb import microbench
 
 parser = argparse.ArgumentParser()
 
@@ -24,6 +28,11 @@ action_choices = [
     "groups",
     "users",
     "plugins",
+    "broker",
+    "import",
+    "migrate",
+    "bench",
+    "microbench",
 ]
 
 parser.add_argument("action", help="The WebSocketServer manager action to run", choices=action_choices)
@@ -36,11 +45,123 @@ parser.add_argument("-e", "--edit", help="Object editing mode", nargs="*")
 parser.add_argument("-g", "--group", help="Identifies the name of a group", nargs=1)
 parser.add_argument("-u", "--user", help="Identifies the name of a user", nargs=1)
 parser.add_argument("-p", "--permplug", help="Identifies a permissions string or a plugin name", nargs=1)
+parser.add_argument("-f", "--file", help="Identifies a CSV or JSON file to import", nargs=1)
+parser.add_argument("-w", "--workers", help="Number of server worker processes sharing the listening port", type=int, default=1)
+parser.add_argument("-s", "--scenario", help="Benchmark scenarios to run, all by default", nargs="+", choices=list(bench.SCENARIOS.keys()))
+parser.add_argument("-c", "--clients", help="Number of simulated benchmark clients", type=int, default=50)
+parser.add_argument("-d", "--duration", help="Seconds each benchmark scenario runs for", type=float, default=10)
+parser.add_argument("-o", "--output", help="Identifies the JSON file benchmark results are written to", default="bench-results.json")
+parser.add_argument("--groups", help="Number of groups benchmark users are spread over", type=int, default=10)
+parser.add_argument("--batch-size", help="Number of requests in each batched benchmark packet", type=int, default=10)
+parser.add_argument("--sizes", help="Registry sizes micro-benchmarks run against", nargs="+", type=int, default=microbench.SIZES)
+parser.add_argument("--only", help="Only runs micro-benchmarks whose names start with one of the given prefixes", nargs="+")
+parser.add_argument("--baseline", help="Identifies the JSON file micro-benchmark results are compared with, created on each machine with --save-baseline", default="microbench-baseline.json")
+parser.add_argument("--save-baseline", help="Stores the micro-benchmark results as the new baseline", action="store_true")
+parser.add_argument("--threshold", help="Percentage a micro-benchmark may be slower than its baseline before it is flagged", type=float, default=50)
+parser.add_argument("--min-difference", help="Nanoseconds a micro-benchmark must be slower than its baseline by before it is flagged", type=float, default=microbench.MIN_DIFFERENCE)
+parser.add_argument("--profile-startup", help="Reports the time taken by every server startup phase, plugin import and start handler", action="store_true")
+parser.add_argument("--profile-file", help="Writes a cProfile of the server startup to a file")
+parser.add_argument("--worker-id", help=argparse.SUPPRESS, type=int)
+parser.add_argument("--ipc", help=argparse.SUPPRESS)
 
 args = parser.parse_args()
 
+log.setup(args.quiet)
+
 if args.action == "runserver":
-    core.start(args.quiet)
+    if args.workers > 1 and args.worker_id == None:
+        workers.supervise(args.workers, args.quiet, args.profile_startup, args.profile_file)
+    else:
+        sys.exit(core.start(args.quiet, args.worker_id, args.ipc, args.profile_startup, args.profile_file, args.workers))
+
+elif args.action == "broker":
+    config.load_global_config()
+    backplane_url = config.global_config()["GENERAL"]["backplane"]
+    if not (backplane_url.startswith("tcp://") or backplane_url.startswith("unix://")):
+        if not args.quiet:
+            print("[BROKER] A tcp:// or unix:// backplane must be set in server.ini to run a broker")
+        sys.exit(1)
+    try:
+        asyncio.run(backplane.run_broker(backplane_url, args.quiet))
+    except KeyboardInterrupt:
+        pass
+
+elif args.action == "import":
+    if args.file == None:
+        if not args.quiet:
+            print("[SERVER] Import file not specified")
+        sys.exit(1)
+    try:
+        import_groups, import_users = files.read_import_file(args.file[0])
+    except (OSError, ValueError) as e:
+        if not args.quiet:
+            print("[SERVER] Could not read import file: " + str(e))
+        sys.exit(1)
+    config.load_global_config()
+    users.load_store()
+    try:
+        group_count, user_count, skipped = users.import_all(import_groups, import_users)
+    except ValueError as e:
+        if not args.quiet:
+            print("[SERVER] Could not import: " + str(e))
+        sys.exit(1)
+    if not args.quiet:
+        for reason in skipped:
+            print("[SERVER] Skipped " + reason)
+        print("[SERVER] Imported " + str(group_count) + " group(s) and " + str(user_count) + " user(s)")
+
+elif args.action == "migrate":
+    config.load_global_config()
+    destination = storage.configured()
+    if type(destination) == storage.INIStore:
+        if not args.quiet:
+            print("[SERVER] Set user_store in server.ini to the store to migrate to")
+        sys.exit(1)
+    source = storage.INIStore()
+    source.open()
+    destination.open()
+    group_count, user_count = storage.migrate(source, destination)
+    destination.close()
+    if not args.quiet:
+        print("[SERVER] Migrated " + str(group_count) + " group(s) and " + str(user_count) + " user(s) from users.ini and groups.ini")
+
+elif args.action == "bench":
+    options = bench.Options(args.clients, args.duration, args.groups, args.batch_size, args.workers)
+    scenarios = args.scenario if args.scenario != None else list(bench.SCENARIOS.keys())
+    on_result = None
+    if not args.quiet:
+        on_result = lambda result: print("[BENCH] " + bench.describe(result))
+    try:
+        results = asyncio.run(bench.run_all(scenarios, options, on_result))
+    except (OSError, RuntimeError) as e:
+        if not args.quiet:
+            print("[BENCH] Benchmark failed: " + str(e))
+        sys.exit(1)
+    bench.write_results(args.output, results, options)
+    if not args.quiet:
+        print("[BENCH] Results written to " + args.output)
+
+elif args.action == "microbench":
+    on_result = None
+    if not args.quiet:
+        on_result = lambda key, result: print("[MICROBENCH] " + key + ": " + str(result) + " ns")
+    results = microbench.run_all(args.sizes, args.only, on_result)
+    if args.save_baseline:
+        microbench.write_baseline(args.baseline, results)
+        if not args.quiet:
+            print("[MICROBENCH] Baseline written to " + args.baseline)
+        sys.exit(0)
+    baseline = microbench.read_baseline(args.baseline)
+    if baseline == None:
+        if not args.quiet:
+            print("[MICROBENCH] No baseline found at " + args.baseline + ", run with --save-baseline on this machine to create one")
+        sys.exit(0)
+    regressions = microbench.recheck(results, baseline, args.threshold / 100, args.min_difference)
+    if not args.quiet:
+        for key, expected, result, ratio in regressions:
+            print("[MICROBENCH] Regression in " + key + ": " + str(result) + " ns, baseline " + str(expected) + " ns (" + str(round((ratio - 1) * 100)) + "% slower)")
+        print("[MICROBENCH] " + str(len(regressions)) + " regression(s) above " + str(args.threshold) + "%")
+    sys.exit(1 if len(regressions) > 0 else 0)
 
 elif args.action == "resetlog":
     files.reset_log_file(args.quiet)
@@ -55,36 +176,39 @@ elif args.action == "resetcfg":
             print("[SERVER] Failed to reset server configuration file")
 
 elif args.action == "plugins":
-    if not plugins.load_all(args.quiet):
-        sys.exit(0)
-    config.load_groups_config()
-    config.load_users_config()
-    users.reload_all()
     if args.list:
         if not args.quiet:
-            for plugin in plugins.plugins:
-                print(plugin.name, end=" ")
+            for plugin in plugins.describe_all(args.quiet):
+                print(plugin["name"], end=" ")
             print()
+    elif args.permplug != None and args.edit == None:
+        described = [plugin for plugin in plugins.describe_all(args.quiet) if plugin["name"] == args.permplug[0]]
+        if len(described) == 0:
+            if not args.quiet:
+                print("[SERVER] Plugin '" + args.permplug[0] + "' does not exist")
+        elif not args.quiet:
+            print(described[0]["name"])
+            print("Version " + described[0]["version"])
+            print("By " + described[0]["author"])
     elif args.permplug != None:
+        if not plugins.load_all(args.quiet):
+            sys.exit(0)
+        config.load_global_config()
+        users.load_store()
+        users.reload_all()
         active_plugin = plugins.find(args.permplug[0])
-        if args.edit == None:
-            if not args.quiet:
-                print(active_plugin.name)
-                print("Version " + active_plugin.version_str)
-                print("By " + active_plugin.author)
-        else:
-            active_plugin.process_command(args.edit)
+        active_plugin.process_command(args.edit)
     else:
         if not args.quiet:
             print("[SERVER] Plugin name not specified")
 
 elif args.action == "groups":
 
-    config.load_groups_config()
-    config.load_users_config()
+    config.load_global_config()
+    users.load_store()
 
     if args.list and not args.quiet:
-        for group in config.groups_config().sections():
+        for group, record in users.store.groups():
             print(group, end=" ")
         print()
 
@@ -182,20 +306,22 @@ elif args.action == "groups":
                     print("[SERVER] Group '" + group_name + "' does not exist")
 
     else:
-        groups_config = config.groups_config()
-        if groups_config.has_section(args.group[0]) and not args.quiet:
-            print("\tPermissions(s): " + groups_config[args.group[0]]["permissions"])
+        record = users.store.get_group(args.group[0])
+        if record != None and not args.quiet:
+            print("\tPermissions(s): " + config.list_to_csv(record["permissions"]))
+            for key, value in record["limits"].items():
+                print("\t" + key + ": " + value)
         else:
             if not args.quiet:
                 print("[SERVER] Group '" + args.group[0] + "' does not exist")
 
 elif args.action == "users":
 
-    config.load_groups_config()
-    config.load_users_config()
+    config.load_global_config()
+    users.load_store()
 
     if args.list and not args.quiet:
-        for user in config.users_config().sections():
+        for user, record in users.store.users():
             print(user, end=" ")
         print()
 
@@ -266,10 +392,10 @@ elif args.action == "users":
                     print("[SERVER] User '" + user_name + "' does not exist")
 
     else:
-        users_config = config.users_config()
-        if users_config.has_section(args.user[0]) and not args.quiet:
-            print("\tGroup(s): " + users_config[args.user[0]]["groups"])
-            print("\tPermissions(s): " + users_config[args.user[0]]["permissions"])
+        record = users.store.get_user(args.user[0])
+        if record != None and not args.quiet:
+            print("\tGroup(s): " + config.list_to_csv(record["groups"]))
+            print("\tPermissions(s): " + config.list_to_csv(record["permissions"]))
         else:
             if not args.quiet:
                 print("[SERVER] User '" + args.user[0] + "' does not exist")
@@ -6,6 +6,12 @@ from wssb.events import Events
 from wssb.events import EventHandler
 from wssb import config
 from wssb import users
+from wssb import hashing
+from wssb import workers
+
+import asyncio
+import concurrent.futures
+import os
 
 class PasswordsPlugin(plugins.WSSBPlugin):
 
@@ -18,11 +24,15 @@ class PasswordsPlugin(plugins.WSSBPlugin):
 
         super().__init__(PLUGIN_NAME, PLUGIN_VERSION, PLUGIN_AUTHOR, DEPENDENCIES, quiet)
 
+        self.pool = None
+        self.pending = 0
+
         self.setup_handlers()
 
     def setup_handlers(self):
         event_handlers = [
             EventHandler(Events.SERVER_START, self.on_start),
+            EventHandler(Events.SERVER_STOP, self.on_stop),
             EventHandler(Events.USER_AUTH_ATTEMPT, self.on_auth_attempt)
         ]
         self.register_handlers(event_handlers)
@@ -54,7 +64,7 @@ class PasswordsPlugin(plugins.WSSBPlugin):
         elif args[0] == "set":
             if len(args) == 3:
                 if users.exists(args[1]):
-                    self.passwords_config.set(args[1], "password", args[2])
+                    self.passwords_config.set(args[1], "password", hashing.hash_password(args[2], n=int(self.options_config["Options"]["scrypt_n"])))
                     self.passwords_config.save()
                     self.info("Password set successully for user \'" + args[1] + "\'")
                 else:
@@ -77,12 +87,46 @@ class PasswordsPlugin(plugins.WSSBPlugin):
         self.passwords_config = config.Config(self.path + "passwords.ini", {})
         self.passwords_config.autogen()
 
+        default_options = {
+            "Options": {
+                "scrypt_n": "16384",
+                "verify_workers": "0",
+                "verify_queue_size": "64",
+            }
+        }
+        self.options_config = config.Config(self.path + "options.ini", default_options)
+        self.options_config.autogen()
+
         if context != None:
             self.info("Passwords loaded successully")
 
         return True
 
-    def on_auth_attempt(self, context):
+    def on_stop(self, context):
+        if self.pool != None:
+            self.pool.shutdown(wait=False, cancel_futures=True)
+            self.pool = None
+        return None
+
+    async def verify(self, password, stored):
+        # Password hashing is CPU bound, so verification runs in a process pool
+        # Attempts beyond the bounded queue are rejected rather than stalling the server
+        if self.pending >= int(self.options_config["Options"]["verify_queue_size"]):
+            self.warning("Password verification queue is full, rejecting authentication attempt")
+            return False
+        if self.pool == None:
+            # By default the CPU cores are divided between the server workers so they don't oversubscribe the host
+            max_workers = int(self.options_config["Options"]["verify_workers"])
+            if max_workers <= 0:
+                max_workers = max(1, (os.cpu_count() or 1) // workers.count)
+            self.pool = concurrent.futures.ProcessPoolExecutor(max_workers=max_workers)
+        self.pending += 1
+        try:
+            return await asyncio.get_running_loop().run_in_executor(self.pool, hashing.verify_password, password, stored)
+        finally:
+            self.pending -= 1
+
+    async def on_auth_attempt(self, context):
         user = context["user"]
         request = context["request"]
 
@@ -90,7 +134,7 @@ class PasswordsPlugin(plugins.WSSBPlugin):
         sessions_instance = plugins.find("sessions")
         if sessions_instance != None:
             if "session_id" in request:
-                return sessions_instance.is_valid(request["session_id"])
+                return sessions_instance.is_valid(request["session_id"], user)
 
         needs_auth = False
         for group in user.groups:
@@ -98,9 +142,8 @@ class PasswordsPlugin(plugins.WSSBPlugin):
                 needs_auth = True
         if needs_auth:
             if self.passwords_config.has_section(user.name):
-                if "password" in request:
-                    if request["password"] == self.passwords_config[user.name]["password"]:
-                        return True
+                if "password" in request and type(request["password"]) == str:
+                    return await self.verify(request["password"], self.passwords_config[user.name]["password"])
             return False
 
         return True
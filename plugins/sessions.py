@@ -10,6 +10,8 @@ from wssb.views import Target
 
 import uuid
 import asyncio
+import heapq
+import time
 
 class Session():
     def __init__(self, user, keep_alive, socket=None):
@@ -17,6 +19,10 @@ class Session():
         self.id = str(uuid.uuid4())
         self.keep_alive = keep_alive
         self.socket = socket
+        self.touch()
+
+    def touch(self):
+        self.expires_at = time.monotonic() + self.keep_alive
 
 class SessionsPlugin(plugins.WSSBPlugin):
     def __init__(self, quiet):
@@ -28,32 +34,75 @@ class SessionsPlugin(plugins.WSSBPlugin):
 
         super().__init__(PLUGIN_NAME, PLUGIN_VERSION, PLUGIN_AUTHOR, DEPENDENCIES, quiet)
 
+        self.sessions = {}
+        self.socket_sessions = {}
+        self.expiry = []
+        self.reaper = None
+
         self.setup_handlers()
 
-    async def clean_expired(self, session):
-        await asyncio.sleep(session.keep_alive)
-        self.sessions.remove(session)
+    def schedule(self, session):
+        heapq.heappush(self.expiry, (session.expires_at, session.id))
+        if self.reaper == None or self.reaper.done():
+            self.wakeup = asyncio.Event()
+            self.reaper = asyncio.create_task(self.reap_expired())
+        elif self.expiry[0][1] == session.id:
+            self.wakeup.set()
+
+    async def reap_expired(self):
+        # A single task expires every session, sleeping until the earliest expiry is due
+        while True:
+            self.wakeup.clear()
+            delay = max(0, self.expiry[0][0] - time.monotonic()) if len(self.expiry) > 0 else None
+            try:
+                await asyncio.wait_for(self.wakeup.wait(), delay)
+            except asyncio.TimeoutError:
+                pass
+            self.clean_expired()
+
+    def clean_expired(self):
+        now = time.monotonic()
+        expired = 0
+        while len(self.expiry) > 0 and self.expiry[0][0] <= now:
+            expires_at, session_id = heapq.heappop(self.expiry)
+            session = self.sessions.get(session_id)
+            if session == None or session.expires_at != expires_at:
+                continue # Stale entry left behind by a session that was touched since
+            if session.socket != None and self.sliding:
+                session.touch()
+                heapq.heappush(self.expiry, (session.expires_at, session.id))
+                continue
+            self.remove(session)
+            expired += 1
+        return expired
 
     def new(self, user, keep_alive, socket=None):
         return Session(user, keep_alive, socket)
 
+    def remove(self, session):
+        del self.sessions[session.id]
+        if session.socket != None and self.socket_sessions.get(session.socket) is session:
+            del self.socket_sessions[session.socket]
+
     def exists(self, session_id):
         return self.find(session_id) != None
 
-    def is_valid(self, session_id):
-        return self.exists(session_id)
+    def is_valid(self, session_id, user=None):
+        session = self.find(session_id)
+        if session == None or session.expires_at <= time.monotonic():
+            return False
+        return user == None or session.user.name == user.name
 
     def find(self, session_id):
-        for session in self.sessions:
-            if session.id == session_id:
-                return session
-        return None
+        return self.sessions.get(session_id)
 
     def setup_handlers(self):
         event_handlers = [
             EventHandler(Events.SERVER_START, self.on_start),
+            EventHandler(Events.SERVER_STOP, self.on_stop),
             EventHandler(Events.USER_AUTH_ATTEMPT, self.on_auth_attempt),
             EventHandler(Events.USER_AUTHENTICATED, self.on_auth),
+            EventHandler(Events.USER_DISCONNECT, self.on_disconnect),
         ]
         self.register_handlers(event_handlers)
 
@@ -64,44 +113,60 @@ class SessionsPlugin(plugins.WSSBPlugin):
         default_config = {
             "Options": {
                 "session_timeout": "300",
+                "sliding_expiry": "True",
             }
         }
 
         self.config = config.Config(self.path + "sessions.ini", default_config)
         self.config.autogen()
 
-        self.sessions = set()
-        self.not_new = set()
+        self.timeout = int(self.config["Options"]["session_timeout"])
+        self.sliding = self.config["Options"]["sliding_expiry"] == "True"
 
         return True
 
+    def on_stop(self, context):
+        if self.reaper != None:
+            self.reaper.cancel()
+            self.reaper = None
+        return None
+
     def on_auth_attempt(self, context):
         user = context["user"]
         request = context["request"]
-        socket = context["socket"]
 
         if "session_id" in request:
-            session = self.find(request["session_id"])
-            if session != None and self.is_valid(session.id):
-                self.not_new.add(socket)
-                return True
-            return False
+            return self.is_valid(request["session_id"], user)
         return True
 
     def on_auth(self, context):
         user = context["user"]
         socket = context["socket"]
+        request = context.get("request", {})
 
-        if socket not in self.not_new:
-            new_session = self.new(user, int(self.config["Options"]["session_timeout"]), socket)
-            self.sessions.add(new_session)
-            asyncio.create_task(self.clean_expired(new_session))
-            return self.resp({ "type": "response", "status": "info", "code": "SESSIONS_NEW", "session_id": new_session.id, "user_name": user.name }, Target.source())
-        return None
+        # The session is only resumed once every auth attempt handler has accepted the attempt
+        if "session_id" in request and self.is_valid(request["session_id"], user):
+            session = self.find(request["session_id"])
+            session.socket = socket
+            self.socket_sessions[socket] = session
+            if self.sliding:
+                session.touch()
+                self.schedule(session)
+            return None
+
+        new_session = self.new(user, self.timeout, socket)
+        self.sessions[new_session.id] = new_session
+        self.socket_sessions[socket] = new_session
+        self.schedule(new_session)
+        return self.resp({ "type": "response", "status": "info", "code": "SESSIONS_NEW", "session_id": new_session.id, "user_name": user.name }, Target.source())
 
     def on_disconnect(self, context):
-        user = context["user"]
         socket = context["socket"]
-        for session in self.sessions:
-            if session.socket == socket:
-                session.socket = None
+        session = self.socket_sessions.pop(socket, None)
+        # A session resumed on another socket keeps that socket when this one closes
+        if session != None and session.socket is socket:
+            session.socket = None
+            if self.sliding:
+                session.touch()
+                self.schedule(session)
+        return None
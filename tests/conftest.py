@@ -0,0 +1,31 @@
+"""
+Shared fixtures for the WSSB tests
+"""
+
+import pathlib
+import shutil
+import subprocess
+import sys
+
+import pytest
+
+ROOT = pathlib.Path(__file__).parent.parent.absolute()
+
+@pytest.fixture
+def server_root(tmp_path):
+    """
+    Returns a copy of the server root so commands can change its config files freely
+    """
+    shutil.copytree(ROOT / "wssb", tmp_path / "wssb", ignore=shutil.ignore_patterns("__pycache__"))
+    for name in ("manage.py", "server.ini", "users.ini", "groups.ini"):
+        shutil.copy(ROOT / name, tmp_path / name)
+    return tmp_path
+
+@pytest.fixture
+def manage(server_root):
+    """
+    Returns a function running manage.py in the copied server root
+    """
+    def run(*args):
+        return subprocess.run([sys.executable, "manage.py"] + list(args), cwd=server_root, capture_output=True, text=True, timeout=60)
+    return run
@@ -0,0 +1,72 @@
+"""
+Tests of the broker backplane connection handling
+"""
+
+import asyncio
+
+from wssb import backplane
+from wssb import users
+
+async def wait_for(condition, timeout=5):
+    """
+    Waits until a condition holds
+    """
+    deadline = asyncio.get_running_loop().time() + timeout
+    while not condition():
+        assert asyncio.get_running_loop().time() < deadline, "timed out"
+        await asyncio.sleep(0.01)
+
+async def exchange(url):
+    received = { "a": [], "b": [] }
+    presences = { "a": backplane.Presence(), "b": backplane.Presence() }
+    broker = backplane.Broker(url)
+    await broker.start()
+    nodes = {}
+    for node_id in ("a", "b"):
+        nodes[node_id] = backplane.BrokerBackplane(node_id, url)
+        async def on_message(from_id, message, node_id=node_id):
+            received[node_id].append(message)
+            if message["type"] == "presence_sync":
+                presences[node_id].sync(from_id, message["users"])
+            elif message["type"] == "node_down":
+                presences[node_id].drop(message["node"])
+        await nodes[node_id].connect(on_message)
+    await wait_for(lambda: len(broker.nodes) == 2)
+
+    # An oversized line drops the connection instead of silently stopping the read loop
+    broker.nodes["a"].write(b"[" + b"0," * backplane.MAX_LINE + b"0]\n")
+    await wait_for(lambda: any([message["type"] == "hello" for message in received["b"]]))
+
+    # The other nodes learn the users online on the reconnected node again
+    assert presences["b"].nodes_for_user("joe") == { "a" }
+
+    nodes["b"].publish({ "type": "ping" })
+    await wait_for(lambda: { "type": "ping" } in received["a"])
+    for node in nodes.values():
+        await node.close()
+    broker.close()
+
+def test_node_reconnects_after_oversized_line(tmp_path, monkeypatch):
+    monkeypatch.setattr(users, "connected", lambda: [users.User("joe")])
+    monkeypatch.setattr(backplane, "MAX_LINE", 1024)
+    monkeypatch.setattr(backplane, "RECONNECT_DELAY", 0.01)
+    asyncio.run(exchange("unix://" + str(tmp_path / "broker.sock")))
+
+async def send_malformed(url, line):
+    errors = []
+    asyncio.get_running_loop().set_exception_handler(lambda loop, context: errors.append(context))
+    broker = backplane.Broker(url)
+    await broker.start()
+    reader, writer = await backplane.open_stream(url, backplane.MAX_LINE)
+    writer.write(backplane.encode({ "register": "bad" }))
+    await wait_for(lambda: "bad" in broker.nodes)
+    writer.write(line)
+    await wait_for(lambda: "bad" not in broker.nodes)
+    assert await reader.read() == b""
+    writer.close()
+    broker.close()
+    return errors
+
+def test_broker_disconnects_nodes_sending_malformed_envelopes(tmp_path):
+    for line in (b"{\"from\": \"bad\"}\n", b"[1, 2]\n", b"{\"to\": 5}\n"):
+        assert asyncio.run(send_malformed("unix://" + str(tmp_path / "broker.sock"), line)) == []
@@ -0,0 +1,77 @@
+"""
+Tests of reading and applying bulk import files
+"""
+
+import json
+
+import pytest
+
+from wssb import files
+from wssb import storage
+from wssb import users
+
+def write(path, content):
+    path.write_text(content)
+    return str(path)
+
+@pytest.fixture
+def store(tmp_path, monkeypatch):
+    """
+    Returns an empty SQLite store installed as the user store
+    """
+    sqlite_store = storage.SQLiteStore(str(tmp_path / "users.db"))
+    sqlite_store.open()
+    monkeypatch.setattr(users, "store", sqlite_store)
+    yield sqlite_store
+    sqlite_store.close()
+
+def test_read_valid_files(tmp_path):
+    groups, imported = files.read_import_file(write(tmp_path / "import.json", json.dumps({
+        "groups": { "staff": { "permissions": ["a.b", "c"] } },
+        "users": { "ann": { "groups": "staff", "permissions": [] } },
+    })))
+    assert groups == { "staff": { "permissions": ["a.b", "c"] } }
+    assert imported == { "ann": { "groups": ["staff"], "permissions": [] } }
+    groups, imported = files.read_import_file(write(tmp_path / "import.csv", "type,name,groups,permissions\ngroup,staff,,a.b\nuser,ann,staff,\n"))
+    assert groups == { "staff": { "permissions": ["a.b"] } }
+    assert imported == { "ann": { "groups": ["staff"], "permissions": [] } }
+
+@pytest.mark.parametrize("data, entry", [
+    ({ "users": { "": {} } }, "Empty user name"),
+    ({ "groups": { " ": {} } }, "Empty group name"),
+    ({ "users": { "ann": "staff" } }, "user 'ann'"),
+    ({ "groups": ["staff"] }, "\"groups\""),
+    ({ "users": { "ann": { "permissions": ["a", 1] } } }, "user 'ann'"),
+    ({ "groups": { "staff": { "permissions": { "a": True } } } }, "group 'staff'"),
+])
+def test_read_malformed_json(tmp_path, data, entry):
+    with pytest.raises(ValueError, match=entry):
+        files.read_import_file(write(tmp_path / "import.json", json.dumps(data)))
+
+def test_read_csv_with_empty_name(tmp_path):
+    with pytest.raises(ValueError, match="line 3"):
+        files.read_import_file(write(tmp_path / "import.csv", "type,name,groups,permissions\ngroup,staff,,\nuser,,staff,\n"))
+
+@pytest.mark.parametrize("groups, imported, entry", [
+    ({ "": { "permissions": [] } }, {}, "group name"),
+    ({}, { "": { "groups": [] } }, "user name"),
+    ({ "staff": ["a"] }, {}, "group 'staff'"),
+    ({}, { "ann": { "permissions": [None] } }, "user 'ann'"),
+    ({}, { "ann": { "groups": "staff" } }, "user 'ann'"),
+])
+def test_import_malformed_entries_writes_nothing(store, groups, imported, entry):
+    valid_groups = dict({ "staff": { "permissions": ["a"] } }, **groups)
+    with pytest.raises(ValueError, match=entry):
+        users.import_all(valid_groups, imported)
+    assert list(store.groups()) == [] and list(store.users()) == []
+
+def test_import_entries(store):
+    assert users.import_all({ "staff": { "permissions": ["a"] } }, { "ann": { "groups": ["staff"], "permissions": [] } }) == (1, 1, [])
+    assert store.get_user("ann")["groups"] == ["staff"]
+
+def test_import_command_reports_malformed_file(manage, server_root):
+    write(server_root / "import.json", json.dumps({ "users": { "": {} } }))
+    result = manage("import", "-f", "import.json")
+    assert result.returncode == 1
+    assert "Could not read import file: Empty user name" in result.stdout
+    assert "Traceback" not in result.stderr
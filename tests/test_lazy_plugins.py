@@ -0,0 +1,52 @@
+"""
+Tests of deferring plugin imports with the plugin manifest
+"""
+
+import subprocess
+import sys
+
+LAZY_PLUGIN = '''
+from wssb import plugins
+from wssb import views
+from wssb.views import Target
+
+IMPORTS = open("imports.log", "a")
+IMPORTS.write("imported\\n")
+IMPORTS.close()
+
+class LazyPlugin(plugins.WSSBPlugin):
+    def __init__(self, quiet):
+        super().__init__("lazy", "1.0.0", "WSSB", [], quiet)
+        self.add_route("lazy_ping", self.view_ping)
+
+    def view_ping(self, context):
+        return self.resp(views.success("LAZY_PONG", "pong"), Target.source())
+'''
+
+START = '''
+import asyncio
+from wssb import plugins
+plugins.load_all(True, lazy=True)
+print(sorted([pl.name for pl in plugins.plugins]), sorted(plugins.deferred_routes))
+plugins.update_manifest()
+responses = asyncio.run(plugins.handle({ "type": "request", "code": "lazy_ping" }, None))
+print([response["response"]["code"] for response in responses], sorted([pl.name for pl in plugins.plugins]))
+'''
+
+def start(server_root):
+    result = subprocess.run([sys.executable, "start.py"], cwd=server_root, capture_output=True, text=True, timeout=60)
+    assert result.returncode == 0, result.stderr
+    return result.stdout.splitlines()
+
+def test_plugin_is_deferred_until_first_use(server_root):
+    (server_root / "plugins").mkdir()
+    (server_root / "plugins" / "lazy.py").write_text(LAZY_PLUGIN)
+    (server_root / "start.py").write_text(START)
+
+    # Without a manifest the plugin is imported at startup and described in the manifest
+    assert start(server_root) == ["['lazy'] []", "['LAZY_PONG'] ['lazy']"]
+    assert (server_root / "imports.log").read_text() == "imported\n"
+
+    # Once described, the import waits until its request code is first used
+    assert start(server_root) == ["[] ['lazy_ping']", "['LAZY_PONG'] ['lazy']"]
+    assert (server_root / "imports.log").read_text() == "imported\nimported\n"
@@ -0,0 +1,21 @@
+"""
+Tests of the manage.py user and group commands
+"""
+
+def test_user_info(manage):
+    result = manage("users", "-u", "joe")
+    assert result.returncode == 0, result.stderr
+    assert "Group(s): dev,usr,obs" in result.stdout
+    assert "Permissions(s):" in result.stdout
+
+def test_missing_user_info(manage):
+    result = manage("users", "-u", "nobody")
+    assert result.returncode == 0, result.stderr
+    assert "User 'nobody' does not exist" in result.stdout
+
+def test_group_info_shows_rate_limits(manage, server_root):
+    with open(server_root / "groups.ini", "a") as f:
+        f.write("rate_limit_user_messages = 5:10\n")
+    result = manage("groups", "-g", "usr")
+    assert result.returncode == 0, result.stderr
+    assert "rate_limit_user_messages: 5:10" in result.stdout
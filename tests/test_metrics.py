@@ -0,0 +1,37 @@
+"""
+Tests of the metrics HTTP page
+"""
+
+import asyncio
+
+from wssb import metrics
+
+async def fetch(request):
+    """
+    Sends a raw request to a metrics server and returns the raw response and any unhandled loop errors
+    """
+    errors = []
+    asyncio.get_running_loop().set_exception_handler(lambda loop, context: errors.append(context))
+    server = await metrics.serve("127.0.0.1", 0)
+    port = server.sockets[0].getsockname()[1]
+    reader, writer = await asyncio.open_connection("127.0.0.1", port)
+    writer.write(request)
+    await writer.drain()
+    response = await reader.read()
+    writer.close()
+    server.close()
+    await server.wait_closed()
+    await asyncio.sleep(0.05)
+    return response, errors
+
+def test_metrics_page():
+    response, errors = asyncio.run(fetch(b"GET /metrics HTTP/1.1\r\nHost: localhost\r\n\r\n"))
+    assert response.startswith(b"HTTP/1.1 200 OK")
+    assert b"# TYPE wssb_request_seconds histogram" in response
+    assert errors == []
+
+def test_over_long_lines_are_dropped():
+    for request in (b"GET /" + b"a" * 100000 + b" HTTP/1.1\r\n\r\n", b"GET / HTTP/1.1\r\nX-Long: " + b"a" * 100000 + b"\r\n\r\n"):
+        response, errors = asyncio.run(fetch(request))
+        assert response == b""
+        assert errors == []
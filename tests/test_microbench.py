@@ -0,0 +1,37 @@
+"""
+Tests of the micro-benchmark baseline comparison
+"""
+
+import json
+
+from wssb import microbench
+
+def test_compare_ignores_small_differences():
+    baseline = { "a[10]": 50, "b[10]": 1000 }
+    assert microbench.compare({ "a[10]": 90, "b[10]": 1100 }, baseline, 0.5) == []
+    assert microbench.compare({ "a[10]": 300, "b[10]": 2000 }, baseline, 0.5) == [("a[10]", 50, 300, 6), ("b[10]", 1000, 2000, 2)]
+
+def test_recheck_drops_noise(monkeypatch):
+    calls = []
+    def run_all(sizes, only=None, on_result=None, keys=None):
+        calls.append((sizes, keys))
+        return dict([(key, 1000) for key in keys])
+    monkeypatch.setattr(microbench, "run_all", run_all)
+    results = { "a[10]": 5000, "b[1000]": 1000 }
+    assert microbench.recheck(results, { "a[10]": 1000, "b[1000]": 1000 }, 0.5) == []
+    assert calls == [([10], { "a[10]" })]
+    assert results["a[10]"] == 1000
+
+def test_recheck_keeps_repeated_regressions(monkeypatch):
+    monkeypatch.setattr(microbench, "run_all", lambda sizes, only=None, on_result=None, keys=None: dict([(key, 4000) for key in keys]))
+    regressions = microbench.recheck({ "a[10]": 5000 }, { "a[10]": 1000 }, 0.5)
+    assert regressions == [("a[10]", 1000, 4000, 4)]
+
+def test_baselines_round_trip(tmp_path):
+    path = str(tmp_path / "baseline.json")
+    microbench.write_baseline(path, { "a[10]": 1.5 })
+    assert microbench.read_baseline(path) == { "a[10]": 1.5 }
+    with open(path, "w") as f:
+        json.dump({ "results": { "a[10]": 1.5 } }, f)
+    assert microbench.read_baseline(path) == None
+    assert microbench.read_baseline(str(tmp_path / "missing.json")) == None
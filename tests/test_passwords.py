@@ -0,0 +1,37 @@
+"""
+Tests of password verification with the bundled passwords plugin
+"""
+
+import shutil
+import subprocess
+import sys
+
+from conftest import ROOT
+
+AUTH = '''
+import asyncio
+import os
+from wssb import config, plugins, users, views, workers
+
+os.cpu_count = lambda: 8
+workers.count = 4
+
+async def main():
+    config.load_global_config()
+    plugins.load_all(True)
+    users.load_store()
+    users.reload_all()
+    await plugins.trigger_conditional_handlers(plugins.Events.SERVER_START, None)
+    result = await views.view_auth(None, { "user_name": "joe", "password": "password" }, "socket", True)
+    print(result["wssb_authenticated"], plugins.find_loaded("passwords").pool._max_workers)
+    await plugins.trigger_handlers(plugins.Events.SERVER_STOP, None)
+
+asyncio.run(main())
+'''
+
+def test_pool_divides_cores_between_workers(server_root):
+    shutil.copytree(ROOT / "plugins", server_root / "plugins", ignore=shutil.ignore_patterns("__pycache__", ".manifest.json"))
+    (server_root / "auth.py").write_text(AUTH)
+    result = subprocess.run([sys.executable, "auth.py"], cwd=server_root, capture_output=True, text=True, timeout=60)
+    assert result.returncode == 0, result.stderr
+    assert result.stdout.splitlines() == ["True 2"]
@@ -0,0 +1,53 @@
+"""
+Tests of plugin view and event handler dispatch
+"""
+
+import asyncio
+
+from wssb import plugins
+from wssb.events import Events
+from wssb.events import EventHandler
+
+class HandlerOwner():
+    """
+    Defines a stand-in for a plugin that only holds event handlers
+    """
+    def __init__(self, actions):
+        self.handlers = [EventHandler(Events.USER_AUTHENTICATED, action) for action in actions]
+
+def test_sync_handlers_finish_inline():
+    owner = HandlerOwner([lambda context, i=i: i for i in range(10)])
+    coroutine = plugins.trigger_handlers(Events.USER_AUTHENTICATED, None, [owner])
+    try:
+        coroutine.send(None)
+        assert False, "synchronous handlers suspended the caller"
+    except StopIteration as e:
+        assert e.value == list(range(10))
+
+def test_mixed_handlers_keep_order():
+    async def later(context):
+        await asyncio.sleep(0.01)
+        return "later"
+    async def sooner(context):
+        return "sooner"
+    owner = HandlerOwner([later, lambda context: "sync", sooner, lambda context: None])
+    assert asyncio.run(plugins.trigger_handlers(Events.USER_AUTHENTICATED, None, [owner])) == ["later", "sync", "sooner"]
+
+def test_failing_handler_lets_started_handlers_finish():
+    finished = []
+    async def slow(context):
+        await asyncio.sleep(0.01)
+        finished.append(True)
+    def fail(context):
+        raise RuntimeError("handler failed")
+    owner = HandlerOwner([slow, fail])
+    try:
+        asyncio.run(plugins.trigger_handlers(Events.USER_AUTHENTICATED, None, [owner]))
+        assert False, "the handler error was not raised"
+    except RuntimeError:
+        pass
+    assert finished == [True]
+
+def test_conditional_handlers():
+    owner = HandlerOwner([lambda context: True, lambda context: False])
+    assert not asyncio.run(plugins.trigger_conditional_handlers(Events.USER_AUTHENTICATED, None, [owner]))
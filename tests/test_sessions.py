@@ -0,0 +1,61 @@
+"""
+Tests of resuming sessions with the bundled sessions plugin
+"""
+
+import shutil
+import subprocess
+import sys
+
+from conftest import ROOT
+
+GATE_PLUGIN = '''
+from wssb import plugins
+from wssb.events import Events
+from wssb.events import EventHandler
+
+class GatePlugin(plugins.WSSBPlugin):
+    def __init__(self, quiet):
+        super().__init__("gate", "1.0.0", "WSSB", [], quiet)
+        self.register_handler(EventHandler(Events.USER_AUTH_ATTEMPT, self.on_auth_attempt))
+
+    def on_auth_attempt(self, context):
+        return context["request"].get("deny") != True
+'''
+
+AUTH = '''
+import asyncio
+from wssb import config, plugins, users, views
+
+async def main():
+    config.load_global_config()
+    plugins.load_all(True)
+    users.load_store()
+    users.reload_all()
+    await plugins.trigger_conditional_handlers(plugins.Events.SERVER_START, None)
+    sessions = plugins.find_loaded("sessions")
+
+    first = await views.view_auth(None, { "user_name": "joe", "password": "password" }, "first", True)
+    session_id = first["plugin_responses"][0]["response"]["session_id"]
+    print("new", first["plugin_responses"][0]["response"]["code"])
+
+    rejected = await views.view_auth(None, { "user_name": "joe", "session_id": session_id, "deny": True }, "rejected", True)
+    print("rejected", rejected["code"], "rejected" in sessions.socket_sessions, len(vars(sessions).get("resumed", {})))
+
+    resumed = await views.view_auth(None, { "user_name": "joe", "password": "password", "session_id": session_id }, "resumed", True)
+    print("resumed", len(resumed["plugin_responses"]), sessions.socket_sessions["resumed"].id == session_id)
+
+    await plugins.trigger_handlers(plugins.Events.USER_DISCONNECT, { "user": users.find_user("joe"), "socket": "first" })
+    session = sessions.socket_sessions["resumed"]
+    print("overlap", session.socket, "first" in sessions.socket_sessions)
+    await plugins.trigger_handlers(plugins.Events.SERVER_STOP, None)
+
+asyncio.run(main())
+'''
+
+def test_rejected_resumption_is_not_recorded(server_root):
+    shutil.copytree(ROOT / "plugins", server_root / "plugins", ignore=shutil.ignore_patterns("__pycache__", ".manifest.json"))
+    (server_root / "plugins" / "gate.py").write_text(GATE_PLUGIN)
+    (server_root / "auth.py").write_text(AUTH)
+    result = subprocess.run([sys.executable, "auth.py"], cwd=server_root, capture_output=True, text=True, timeout=60)
+    assert result.returncode == 0, result.stderr
+    assert result.stdout.splitlines() == ["new SESSIONS_NEW", "rejected WSSB_AUTH_FAILED False 0", "resumed 1 True", "overlap resumed False"]
@@ -0,0 +1,47 @@
+"""
+Tests of the user registry with a lazy store
+"""
+
+import collections
+
+from wssb import storage
+from wssb import users
+
+def lazy_store(tmp_path, monkeypatch, names):
+    """
+    Opens an SQLite store holding users with the given names in place of the configured store
+    """
+    store = storage.SQLiteStore(str(tmp_path / "users.db"))
+    store.open()
+    for name in names:
+        store.put_user(name, storage.user_record())
+    for name, value in (("store", store), ("cache_size", 1), ("registered_users", {}), ("registered_groups", {}), ("user_cache", collections.OrderedDict()), ("pinned_users", {}), ("socket_users", {}), ("online_users", set()), ("group_sockets", {}), ("group_users", {}), ("connected_sockets", set())):
+        monkeypatch.setattr(users, name, value)
+    return store
+
+def test_pinned_user_is_not_evicted(tmp_path, monkeypatch):
+    store = lazy_store(tmp_path, monkeypatch, ["joe", "ann", "bob"])
+    joe = users.find_user("joe")
+    users.pin_user(joe)
+    # Other logins while joe's auth handlers await fill the cache past its size
+    users.find_user("ann")
+    users.find_user("bob")
+    assert users.registered_users["joe"] is joe
+    users.unpin_user(joe)
+    assert users.register_socket("joe", "socket")
+    assert users.socket_users["socket"] is joe
+    assert "joe" not in users.user_cache
+    store.close()
+
+def test_unpinned_user_returns_to_cache(tmp_path, monkeypatch):
+    store = lazy_store(tmp_path, monkeypatch, ["joe", "ann"])
+    joe = users.find_user("joe")
+    users.pin_user(joe)
+    users.pin_user(joe)
+    users.unpin_user(joe)
+    assert "joe" not in users.user_cache
+    users.unpin_user(joe)
+    assert list(users.user_cache) == ["joe"]
+    users.find_user("ann")
+    assert "joe" not in users.registered_users
+    store.close()
@@ -0,0 +1,440 @@
+"""
+This script handles the message backplane that connects several server nodes into one logical server
+Help for all functionality of this script is available in the documentation
+"""
+
+import asyncio
+import os
+import socket
+
+from wssb import codec
+from wssb import log
+from wssb import users
+
+MAX_LINE = 2 ** 24 # Largest backplane message accepted, in bytes
+RECONNECT_DELAY = 1 # Seconds a node waits before reconnecting to the broker, doubled after every failed attempt
+MAX_RECONNECT_DELAY = 30
+
+class Backplane():
+    """
+    Defines an abstract backplane that can be extended to carry messages between server nodes
+    Messages published in the same event loop iteration are batched into a single envelope per destination
+    """
+    def __init__(self, node_id):
+        """
+        Constructor for Backplane
+        """
+        self.node_id = node_id
+        self.on_message = None
+        self.pending = {}
+        self.flush_handle = None
+
+    async def open(self):
+        """
+        Connects the backplane
+        Should be developer defined
+        """
+        raise NotImplementedError()
+
+    async def close(self):
+        """
+        Disconnects the backplane
+        Should be developer defined
+        """
+        raise NotImplementedError()
+
+    def transmit(self, envelope):
+        """
+        Sends an envelope of messages to other nodes
+        Should be developer defined
+        """
+        raise NotImplementedError()
+
+    async def connect(self, on_message):
+        """
+        Connects the backplane and passes every message received to the on_message coroutine
+        """
+        self.on_message = on_message
+        await self.open()
+
+    def publish(self, message, nodes=None):
+        """
+        Queues a message for the given node ids, or for every other node if none are given
+        """
+        key = tuple(sorted(nodes)) if nodes != None else None
+        self.pending.setdefault(key, []).append(message)
+        if self.flush_handle == None:
+            self.flush_handle = asyncio.get_running_loop().call_soon(self.flush)
+
+    def flush(self):
+        """
+        Sends all queued messages as one envelope per destination
+        """
+        self.flush_handle = None
+        pending, self.pending = self.pending, {}
+        for key, messages in pending.items():
+            self.transmit({ "from": self.node_id, "to": list(key) if key != None else None, "messages": messages })
+
+    async def receive(self, envelope):
+        """
+        Passes every message of a received envelope to the message handler in order
+        """
+        for message in envelope["messages"]:
+            try:
+                await self.on_message(envelope["from"], message)
+            except Exception:
+                log.exception("SERVER", "Failed to handle a backplane message from node '" + str(envelope["from"]) + "'", event="backplane_error", console=False)
+
+local_hubs = {} # Maps hub names to the in-process backplanes attached to them
+
+class LocalBackplane(Backplane):
+    """
+    Defines an in-process backplane that connects nodes running in the same process
+    """
+    def __init__(self, node_id, hub="default"):
+        """
+        Constructor for LocalBackplane
+        """
+        super().__init__(node_id)
+        self.hub = hub
+        self.inbox = None
+        self.reader = None
+
+    async def open(self):
+        self.inbox = asyncio.Queue()
+        self.reader = asyncio.create_task(self.read())
+        local_hubs.setdefault(self.hub, {})[self.node_id] = self
+
+    async def close(self):
+        nodes = local_hubs.get(self.hub, {})
+        nodes.pop(self.node_id, None)
+        for other in nodes.values():
+            other.inbox.put_nowait({ "from": None, "to": None, "messages": [{ "type": "node_down", "node": self.node_id }] })
+        if self.reader != None:
+            self.reader.cancel()
+
+    def transmit(self, envelope):
+        for node_id, other in local_hubs.get(self.hub, {}).items():
+            if other is not self and (envelope["to"] == None or node_id in envelope["to"]):
+                other.inbox.put_nowait(envelope)
+
+    async def read(self):
+        """
+        Handles received envelopes one at a time
+        """
+        while True:
+            await self.receive(await self.inbox.get())
+
+async def open_stream(url, limit):
+    """
+    Opens a stream connection to a tcp://host:port or unix:///path url
+    """
+    if url.startswith("unix://"):
+        return await asyncio.open_unix_connection(url[len("unix://"):], limit=limit)
+    host, port = url[len("tcp://"):].rsplit(":", 1)
+    return await asyncio.open_connection(host, int(port), limit=limit)
+
+class BrokerBackplane(Backplane):
+    """
+    Defines a backplane that exchanges messages with other nodes through a broker
+    """
+    def __init__(self, node_id, url):
+        """
+        Constructor for BrokerBackplane
+        """
+        super().__init__(node_id)
+        self.url = url
+        self.writer = None
+        self.reader = None
+
+    async def open(self):
+        self.reader = asyncio.create_task(self.read(await self.dial()))
+
+    async def dial(self):
+        """
+        Opens a connection to the broker and registers this node
+        Returns the stream reader of the connection
+        """
+        reader, self.writer = await open_stream(self.url, MAX_LINE)
+        self.writer.write(encode({ "register": self.node_id }))
+        return reader
+
+    async def close(self):
+        self.flush()
+        if self.reader != None:
+            self.reader.cancel()
+        if self.writer != None:
+            self.writer.close()
+            self.writer = None
+
+    def transmit(self, envelope):
+        if self.writer != None:
+            self.writer.write(encode(envelope))
+
+    async def read(self, reader):
+        """
+        Handles envelopes forwarded by the broker, reconnecting whenever the connection is lost
+        """
+        while True:
+            await self.read_connection(reader)
+            if self.writer != None:
+                self.writer.close()
+                self.writer = None
+            reader = await self.redial()
+            # The broker told the other nodes this node went down, so they are sent its online users again
+            self.publish(presence_sync())
+            self.publish({ "type": "hello" })
+
+    async def read_connection(self, reader):
+        """
+        Handles envelopes forwarded by the broker until it disconnects or sends a line that cannot be read
+        """
+        while True:
+            try:
+                line = await reader.readline()
+                if not line:
+                    log.error("SERVER", "Node '" + self.node_id + "' lost its connection to the backplane broker", console=False)
+                    return
+                envelope = codec.default().decode(line)
+            except (ValueError, asyncio.LimitOverrunError, ConnectionError):
+                log.exception("SERVER", "Node '" + self.node_id + "' received an unreadable line from the backplane broker, reconnecting", event="backplane_error", console=False)
+                return
+            await self.receive(envelope)
+
+    async def redial(self):
+        """
+        Reconnects to the broker, waiting longer after every failed attempt
+        Returns the stream reader of the new connection
+        """
+        delay = RECONNECT_DELAY
+        while True:
+            await asyncio.sleep(delay)
+            try:
+                reader = await self.dial()
+            except OSError:
+                delay = min(delay * 2, MAX_RECONNECT_DELAY)
+                continue
+            log.info("SERVER", "Node '" + self.node_id + "' reconnected to the backplane broker", console=False)
+            return reader
+
+class Broker():
+    """
+    Defines a broker that routes backplane envelopes between the nodes connected to it
+    Listens on a tcp://host:port or unix:///path url
+    """
+    def __init__(self, url):
+        """
+        Constructor for Broker
+        """
+        self.url = url
+        self.nodes = {}
+        self.server = None
+
+    async def start(self):
+        """
+        Starts listening for node connections
+        """
+        if self.url.startswith("unix://"):
+            self.server = await asyncio.start_unix_server(self.handle, self.url[len("unix://"):], limit=MAX_LINE)
+        else:
+            host, port = self.url[len("tcp://"):].rsplit(":", 1)
+            self.server = await asyncio.start_server(self.handle, host, int(port), limit=MAX_LINE)
+
+    def close(self):
+        """
+        Stops listening and disconnects all nodes
+        """
+        self.server.close()
+        for writer in self.nodes.values():
+            writer.close()
+        if self.url.startswith("unix://") and os.path.exists(self.url[len("unix://"):]):
+            os.remove(self.url[len("unix://"):])
+
+    async def handle(self, reader, writer):
+        """
+        Registers a node and forwards its envelopes to their destinations
+        """
+        try:
+            line = await reader.readline()
+            node_id = codec.default().decode(line)["register"] if line else None
+        except (ValueError, asyncio.LimitOverrunError, ConnectionError, KeyError, TypeError):
+            node_id = None
+        if node_id == None:
+            writer.close()
+            return
+        self.nodes[node_id] = writer
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                to = codec.default().decode(line)["to"]
+                if to != None and type(to) != list:
+                    raise TypeError("Envelope destinations must be a list of node ids")
+                for other_id, other in list(self.nodes.items()):
+                    if other_id != node_id and (to == None or other_id in to):
+                        other.write(line)
+        except (ValueError, asyncio.LimitOverrunError, KeyError, TypeError):
+            log.exception("BROKER", "Node '" + str(node_id) + "' sent an unreadable line, disconnecting it", event="backplane_error", console=False)
+        except ConnectionError:
+            pass
+        finally:
+            if self.nodes.get(node_id) is writer:
+                del self.nodes[node_id]
+                down = encode({ "from": None, "to": None, "messages": [{ "type": "node_down", "node": node_id }] })
+                for other in self.nodes.values():
+                    other.write(down)
+            writer.close()
+
+class Presence():
+    """
+    Defines a map of which users are online on which remote nodes
+    Used to send user and group deliveries only to the nodes that can use them
+    """
+    def __init__(self):
+        """
+        Constructor for Presence
+        """
+        self.user_nodes = {}
+        self.node_users = {}
+
+    def set_online(self, node_id, user_name, online):
+        """
+        Records that a user came online or went offline on a remote node
+        """
+        if online:
+            self.node_users.setdefault(node_id, set()).add(user_name)
+            self.user_nodes.setdefault(user_name, set()).add(node_id)
+        else:
+            self.node_users.get(node_id, set()).discard(user_name)
+            nodes = self.user_nodes.get(user_name)
+            if nodes != None:
+                nodes.discard(node_id)
+                if len(nodes) == 0:
+                    del self.user_nodes[user_name]
+
+    def sync(self, node_id, user_names):
+        """
+        Replaces everything known about a remote node with a full list of its online users
+        """
+        self.drop(node_id)
+        for user_name in user_names:
+            self.set_online(node_id, user_name, True)
+
+    def drop(self, node_id):
+        """
+        Forgets a remote node that has disconnected
+        """
+        for user_name in list(self.node_users.get(node_id, [])):
+            self.set_online(node_id, user_name, False)
+        self.node_users.pop(node_id, None)
+
+    def nodes_for_user(self, user_name):
+        """
+        Returns the set of remote nodes a user is online on
+        """
+        return self.user_nodes.get(user_name, set())
+
+    def nodes_for_group(self, group_name):
+        """
+        Returns the set of remote nodes that have at least one member of the group online
+        """
+        members = users.group_members(group_name)
+        if len(members) < len(self.user_nodes):
+            candidates = [name for name in members if name in self.user_nodes]
+        else:
+            candidates = [name for name in self.user_nodes if name in members]
+        nodes = set()
+        for user_name in candidates:
+            nodes.update(self.user_nodes[user_name])
+            if len(nodes) == len(self.node_users):
+                break
+        return nodes
+
+active = None # The backplane this node is connected to, None when running standalone
+presence = Presence()
+
+def presence_sync():
+    """
+    Returns a message listing every user online on this node
+    """
+    return { "type": "presence_sync", "users": [user.name for user in users.connected()] }
+
+def encode(message):
+    """
+    Encodes a backplane message as a single line
+    """
+    return codec.default().encode(message).encode("utf-8") + b"\n"
+
+def default_node_id():
+    """
+    Generates a node id that is unique on the network
+    """
+    return socket.gethostname() + "-" + str(os.getpid())
+
+def create(url, node_id):
+    """
+    Creates a backplane from a url
+    Supports local, local://hub, tcp://host:port and unix:///path
+    Returns None if the url is empty
+    """
+    if url == None or url == "":
+        return None
+    if url == "local":
+        return LocalBackplane(node_id)
+    if url.startswith("local://"):
+        return LocalBackplane(node_id, url[len("local://"):])
+    if url.startswith("tcp://") or url.startswith("unix://"):
+        return BrokerBackplane(node_id, url)
+    raise ValueError("Unsupported backplane url '" + url + "'")
+
+async def connect(url, node_id, on_message):
+    """
+    Connects this node to the backplane at the given url
+    Returns True if a backplane was connected
+    """
+    global active, presence
+
+    active = create(url, node_id)
+    presence = Presence()
+    if active == None:
+        return False
+    await active.connect(on_message)
+    active.publish({ "type": "hello" })
+    return True
+
+async def disconnect():
+    """
+    Disconnects this node from the backplane
+    """
+    global active
+
+    if active != None:
+        await active.close()
+        active = None
+
+def is_connected():
+    """
+    Returns True if this node is connected to a backplane
+    """
+    return active != None
+
+def publish(message, nodes=None):
+    """
+    Publishes a message to the given remote node ids, or to every remote node if none are given
+    Does nothing when this node is not connected to a backplane
+    """
+    if active != None:
+        active.publish(message, nodes)
+
+async def run_broker(url, quiet):
+    """
+    Runs a standalone backplane broker until it is interrupted
+    """
+    broker = Broker(url)
+    await broker.start()
+    log.info("BROKER", "Listening for server nodes on " + url)
+    try:
+        await asyncio.Event().wait()
+    finally:
+        broker.close()
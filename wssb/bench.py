@@ -0,0 +1,583 @@
+"""
+This script handles the end-to-end load benchmarks run by manage.py bench
+Help for all functionality of this script is available in the documentation
+"""
+
+import asyncio
+import datetime
+import json
+import os
+import pathlib
+import platform
+import shutil
+import signal
+import socket
+import sys
+import tempfile
+import time
+
+import websockets
+
+from wssb import codec
+from wssb import config
+from wssb import hashing
+
+# Maps every benchmark scenario to the plugins installed on its server
+SCENARIOS = {
+    "auth": [],
+    "auth_passwords": ["passwords"],
+    "auth_sessions": ["passwords", "sessions"],
+    "foo": ["foo"],
+    "batch": ["foo"],
+    "broadcast_all": [],
+    "broadcast_group": [],
+}
+
+BENCH_PASSWORD = "bench"
+CONNECT_CONCURRENCY = 64 # Most client connections opened at the same time
+RECEIVE_TIMEOUT = 10 # Seconds a client waits for a response before counting it as an error
+START_TIMEOUT = 30 # Seconds the benchmark server is given to start listening
+
+# Installed on every benchmark server to broadcast packets to all users or to a group
+BENCH_PLUGIN = '''"""
+This plugin is installed by manage.py bench to broadcast benchmark packets
+"""
+from wssb import plugins
+from wssb.events import Events
+from wssb.events import EventHandler
+from wssb.views import Target
+
+class BenchPlugin(plugins.WSSBPlugin):
+    def __init__(self, quiet):
+        super().__init__("bench", "1.0.0", "WSSB", [], quiet)
+        self.register_handlers([EventHandler(Events.SERVER_START, self.on_start)])
+
+    def on_start(self, context):
+        self.add_route("bench_all", self.view_broadcast)
+        self.add_route("bench_group", self.view_broadcast)
+        return True
+
+    def view_broadcast(self, context):
+        request = context["request"]
+        response = { "type": "response", "status": "info", "code": "BENCH_BROADCAST", "sent": request.get("sent") }
+        if request["code"] == "bench_all":
+            return self.resp(response, Target.all())
+        return self.resp(response, Target.group(request["group"]))
+'''
+
+class Options():
+    """
+    Defines the options shared by every scenario of a benchmark
+    """
+    def __init__(self, clients=50, duration=10.0, groups=10, batch_size=10, workers=1):
+        """
+        Constructor for Options
+        """
+        self.clients, self.duration = clients, duration
+        self.groups, self.batch_size, self.workers = groups, batch_size, workers
+
+    def to_dict(self):
+        """
+        Returns the options as a dictionary
+        """
+        return { "clients": self.clients, "duration": self.duration, "groups": self.groups, "batch_size": self.batch_size, "workers": self.workers }
+
+class Usage():
+    """
+    Defines a sampler of the CPU time and memory used by the server process and its workers
+    Sampling reads /proc and reports nothing on platforms without it
+    """
+    def __init__(self, pid):
+        """
+        Constructor for Usage
+        """
+        self.pid = pid
+        self.cpu_start = None
+        self.cpu_seconds = None
+        self.rss_peak = 0
+        self.sampler = None
+
+    def pids(self):
+        """
+        Returns the server process id and the ids of all of its descendants
+        """
+        children = {}
+        for entry in os.listdir("/proc"):
+            if entry.isdigit():
+                stat = read_stat(entry)
+                if stat != None:
+                    children.setdefault(int(stat[1]), []).append(int(entry))
+        found, pending = [], [self.pid]
+        while len(pending) > 0:
+            pid = pending.pop()
+            found.append(pid)
+            pending += children.get(pid, [])
+        return found
+
+    def sample(self):
+        """
+        Returns the total CPU seconds and resident memory in bytes of the server processes
+        """
+        ticks = os.sysconf("SC_CLK_TCK")
+        page_size = os.sysconf("SC_PAGE_SIZE")
+        cpu, rss = 0.0, 0
+        for pid in self.pids():
+            stat = read_stat(pid)
+            if stat != None:
+                cpu += (int(stat[11]) + int(stat[12])) / ticks
+                rss += int(stat[21]) * page_size
+        return cpu, rss
+
+    def begin(self):
+        """
+        Starts measuring usage
+        """
+        if not os.path.isdir("/proc"):
+            return
+        self.cpu_start, self.rss_peak = self.sample()
+        self.sampler = asyncio.create_task(self.watch())
+
+    async def watch(self):
+        """
+        Samples the memory used until measuring ends to find its peak
+        """
+        while True:
+            await asyncio.sleep(0.25)
+            self.rss_peak = max(self.rss_peak, self.sample()[1])
+
+    def end(self):
+        """
+        Stops measuring usage
+        """
+        if self.sampler == None:
+            return
+        self.sampler.cancel()
+        cpu, rss = self.sample()
+        self.cpu_seconds = cpu - self.cpu_start
+        self.rss_peak = max(self.rss_peak, rss)
+
+def read_stat(pid):
+    """
+    Returns the fields of /proc/<pid>/stat that follow the process name, or None if the process is gone
+    """
+    try:
+        with open("/proc/" + str(pid) + "/stat") as f:
+            return f.read().rsplit(")", 1)[1].split()
+    except (OSError, IndexError):
+        return None
+
+class Run():
+    """
+    Defines the measurements taken during one scenario
+    """
+    def __init__(self, scenario, options, pid):
+        """
+        Constructor for Run
+        """
+        self.scenario, self.options = scenario, options
+        self.latencies = []
+        self.operations = 0
+        self.errors = 0
+        self.started = None
+        self.elapsed = 0
+        self.usage = Usage(pid)
+
+    def begin(self):
+        """
+        Starts the measured part of the scenario
+        Returns the time at which the scenario should stop
+        """
+        self.usage.begin()
+        self.started = time.perf_counter()
+        return self.started + self.options.duration
+
+    def end(self):
+        """
+        Ends the measured part of the scenario
+        """
+        if self.started != None:
+            self.elapsed = time.perf_counter() - self.started
+        self.usage.end()
+
+    def record(self, seconds, operations=1):
+        """
+        Records the latency of a completed operation
+        """
+        self.latencies.append(seconds)
+        self.operations += operations
+
+    def fail(self, count=1):
+        """
+        Records failed or lost operations
+        """
+        self.errors += count
+
+    def result(self):
+        """
+        Returns the results of the scenario as a dictionary
+        """
+        latencies = sorted(self.latencies)
+        elapsed = self.elapsed if self.elapsed > 0 else None
+        return {
+            "scenario": self.scenario,
+            "plugins": SCENARIOS[self.scenario],
+            "operations": self.operations,
+            "errors": self.errors,
+            "seconds": round(self.elapsed, 3),
+            "throughput": round(self.operations / elapsed, 1) if elapsed != None else 0,
+            "latency_ms": {
+                "mean": to_ms(sum(latencies) / len(latencies)) if len(latencies) > 0 else None,
+                "p50": to_ms(percentile(latencies, 0.5)),
+                "p99": to_ms(percentile(latencies, 0.99)),
+                "p999": to_ms(percentile(latencies, 0.999)),
+                "max": to_ms(latencies[-1]) if len(latencies) > 0 else None,
+            },
+            "server": {
+                "cpu_percent": round(self.usage.cpu_seconds * 100 / elapsed, 1) if self.usage.cpu_seconds != None and elapsed != None else None,
+                "rss_peak_mb": round(self.usage.rss_peak / 2 ** 20, 1) if self.usage.cpu_seconds != None else None,
+            },
+        }
+
+def percentile(values, q):
+    """
+    Returns the q quantile of a sorted list, or None if it is empty
+    """
+    if len(values) == 0:
+        return None
+    return values[min(len(values) - 1, int(q * len(values)))]
+
+def to_ms(seconds):
+    """
+    Converts seconds to milliseconds rounded for reporting
+    """
+    return round(seconds * 1000, 3) if seconds != None else None
+
+def user_name(index):
+    """
+    Returns the name of a benchmark user
+    """
+    return "bench-" + str(index)
+
+def group_name(index, options):
+    """
+    Returns the name of the group a benchmark user is a member of
+    """
+    return "bench-group-" + str(index % options.groups)
+
+def free_port():
+    """
+    Returns a local port that is not in use
+    """
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+def create_root(scenario, options, port):
+    """
+    Creates a temporary server root holding a copy of the server, the scenario's plugins and the benchmark users
+    The real server configuration and data files are never touched
+    """
+    env_root = pathlib.Path(__file__).parent.parent.absolute()
+    root = tempfile.mkdtemp(prefix="wssb-bench-")
+    shutil.copytree(env_root / "wssb", root + "/wssb", ignore=shutil.ignore_patterns("__pycache__"))
+    shutil.copy(env_root / "manage.py", root)
+    os.mkdir(root + "/plugins")
+    for plugin_name in SCENARIOS[scenario]:
+        shutil.copy(env_root / "plugins" / (plugin_name + ".py"), root + "/plugins")
+    with open(root + "/plugins/bench.py", "w") as f:
+        f.write(BENCH_PLUGIN)
+
+    config.Config(root + "/server.ini", { "GENERAL": { "server_address": "127.0.0.1", "server_port": str(port) } }).autogen()
+    groups = { "bench": { "permissions": "" } }
+    for i in range(options.groups):
+        groups[group_name(i, options)] = { "permissions": "" }
+    config.Config(root + "/groups.ini", groups).autogen()
+    bench_users = {}
+    for i in range(options.clients):
+        bench_users[user_name(i)] = { "permissions": "", "groups": "bench," + group_name(i, options), "socket_address": "" }
+    config.Config(root + "/users.ini", bench_users).autogen()
+
+    if "passwords" in SCENARIOS[scenario]:
+        os.mkdir(root + "/plugins/passwords")
+        config.Config(root + "/plugins/passwords/groups_enabled.ini", { "bench": {} }).autogen()
+        # Every user shares one hash since hashing is as slow as verifying
+        stored = hashing.hash_password(BENCH_PASSWORD)
+        passwords = dict([(user_name(i), { "password": stored }) for i in range(options.clients)])
+        config.Config(root + "/plugins/passwords/passwords.ini", passwords).autogen()
+    return root
+
+async def start_server(root, port, options):
+    """
+    Starts the benchmark server and waits until it accepts connections
+    """
+    command = [sys.executable, root + "/manage.py", "runserver", "-q"]
+    if options.workers > 1:
+        command += ["-w", str(options.workers)]
+    process = await asyncio.create_subprocess_exec(*command, cwd=root)
+    deadline = time.monotonic() + START_TIMEOUT
+    while True:
+        try:
+            reader, writer = await asyncio.open_connection("127.0.0.1", port)
+            writer.close()
+            return process
+        except OSError:
+            if process.returncode != None or time.monotonic() > deadline:
+                await stop_server(process)
+                raise RuntimeError("The benchmark server did not start")
+            await asyncio.sleep(0.1)
+
+async def stop_server(process):
+    """
+    Stops the benchmark server
+    """
+    if process.returncode != None:
+        return
+    process.send_signal(signal.SIGTERM)
+    try:
+        await asyncio.wait_for(process.wait(), 10)
+    except asyncio.TimeoutError:
+        process.kill()
+        await process.wait()
+
+def encode(packet):
+    """
+    Encodes a packet sent by a benchmark client
+    """
+    return codec.default().encode(packet)
+
+async def receive(conn, codes):
+    """
+    Reads frames until a packet with one of the given codes or an error arrives
+    Returns the packet, or None if nothing arrived in time
+    """
+    while True:
+        try:
+            frame = codec.default().decode(await asyncio.wait_for(conn.recv(), RECEIVE_TIMEOUT))
+        except asyncio.TimeoutError:
+            return None
+        for packet in (frame if type(frame) == list else [frame]):
+            if packet.get("code") in codes or packet.get("status") == "error":
+                return packet
+
+async def receive_list(conn):
+    """
+    Reads frames until a batched list of replies arrives
+    Returns the list, or None if nothing arrived in time
+    """
+    while True:
+        try:
+            frame = codec.default().decode(await asyncio.wait_for(conn.recv(), RECEIVE_TIMEOUT))
+        except asyncio.TimeoutError:
+            return None
+        if type(frame) == list:
+            return frame
+
+async def authenticate(conn, index, **fields):
+    """
+    Authenticates a benchmark client as its user
+    Returns True if the server accepted the user
+    """
+    request = { "type": "request", "code": "auth", "user_name": user_name(index) }
+    request.update(fields)
+    await conn.send(encode(request))
+    packet = await receive(conn, ("WSSB_USER_AUTHENTICATED",))
+    return packet != None and packet["code"] == "WSSB_USER_AUTHENTICATED"
+
+async def connect_all(url, options, **fields):
+    """
+    Connects and authenticates every benchmark client
+    """
+    limit = asyncio.Semaphore(CONNECT_CONCURRENCY)
+
+    async def connect(index):
+        async with limit:
+            conn = await websockets.connect(url, max_size=None, open_timeout=RECEIVE_TIMEOUT)
+            if not await authenticate(conn, index, **fields):
+                await conn.close()
+                raise RuntimeError("Benchmark user '" + user_name(index) + "' could not authenticate")
+            return conn
+
+    return await asyncio.gather(*[connect(index) for index in range(options.clients)])
+
+async def close_all(conns):
+    """
+    Closes every benchmark client connection
+    """
+    await asyncio.gather(*[conn.close() for conn in conns], return_exceptions=True)
+
+async def bench_auth(url, run, fields):
+    """
+    Each client repeatedly connects and authenticates, measuring the authentication time
+    The extra fields of each client's auth request are returned by the fields function
+    """
+    deadline = run.begin()
+
+    async def client(index):
+        while time.perf_counter() < deadline:
+            async with websockets.connect(url, max_size=None, open_timeout=RECEIVE_TIMEOUT) as conn:
+                start = time.perf_counter()
+                if await authenticate(conn, index, **fields(index)):
+                    run.record(time.perf_counter() - start)
+                else:
+                    run.fail()
+
+    await asyncio.gather(*[client(index) for index in range(run.options.clients)])
+    run.end()
+
+async def scenario_auth(url, run):
+    await bench_auth(url, run, lambda index: {})
+
+async def scenario_auth_passwords(url, run):
+    await bench_auth(url, run, lambda index: { "password": BENCH_PASSWORD })
+
+async def scenario_auth_sessions(url, run):
+    # Sessions are opened with a password once, then every measured authentication resumes them
+    sessions = {}
+    for index, conn in enumerate(await connect_all(url, run.options, password=BENCH_PASSWORD)):
+        packet = await receive(conn, ("SESSIONS_NEW",))
+        sessions[index] = packet["session_id"]
+        await conn.close()
+    await bench_auth(url, run, lambda index: { "session_id": sessions[index] })
+
+async def scenario_foo(url, run):
+    conns = await connect_all(url, run.options)
+    deadline = run.begin()
+
+    async def client(conn):
+        request = encode({ "type": "request", "code": "foo" })
+        while time.perf_counter() < deadline:
+            start = time.perf_counter()
+            await conn.send(request)
+            packet = await receive(conn, ("FOO_EXAMPLE",))
+            if packet != None and packet["code"] == "FOO_EXAMPLE":
+                run.record(time.perf_counter() - start)
+            else:
+                run.fail()
+
+    await asyncio.gather(*[client(conn) for conn in conns])
+    run.end()
+    await close_all(conns)
+
+async def scenario_batch(url, run):
+    conns = await connect_all(url, run.options, batch=True)
+    deadline = run.begin()
+
+    async def client(conn):
+        request = encode([{ "type": "request", "code": "foo" }] * run.options.batch_size)
+        while time.perf_counter() < deadline:
+            start = time.perf_counter()
+            await conn.send(request)
+            frame = await receive_list(conn)
+            replies = len([packet for packet in frame if packet.get("code") == "FOO_EXAMPLE"]) if type(frame) == list else 0
+            if replies > 0:
+                run.record(time.perf_counter() - start, replies)
+            run.fail(run.options.batch_size - replies)
+
+    await asyncio.gather(*[client(conn) for conn in conns])
+    run.end()
+    await close_all(conns)
+
+async def bench_broadcast(url, run, request, receivers):
+    """
+    One client repeatedly broadcasts a packet and waits for every receiver to get it
+    The delivery latency is measured by each receiver
+    """
+    conns = await connect_all(url, run.options)
+    expected = len(receivers)
+    delivered = [0]
+    round_done = asyncio.Event()
+
+    async def receiver(conn):
+        while True:
+            try:
+                frame = codec.default().decode(await conn.recv())
+            except websockets.exceptions.ConnectionClosed:
+                return
+            for packet in (frame if type(frame) == list else [frame]):
+                if packet.get("code") == "BENCH_BROADCAST":
+                    run.record(time.perf_counter() - packet["sent"])
+                    delivered[0] += 1
+                    if delivered[0] >= expected:
+                        round_done.set()
+
+    readers = [asyncio.create_task(receiver(conns[index])) for index in receivers]
+    deadline = run.begin()
+    while time.perf_counter() < deadline:
+        delivered[0] = 0
+        round_done.clear()
+        request["sent"] = time.perf_counter()
+        await conns[0].send(encode(request))
+        try:
+            await asyncio.wait_for(round_done.wait(), RECEIVE_TIMEOUT)
+        except asyncio.TimeoutError:
+            run.fail(expected - delivered[0])
+    run.end()
+    await close_all(conns)
+    for reader in readers:
+        reader.cancel()
+
+async def scenario_broadcast_all(url, run):
+    await bench_broadcast(url, run, { "type": "request", "code": "bench_all" }, list(range(run.options.clients)))
+
+async def scenario_broadcast_group(url, run):
+    receivers = [index for index in range(run.options.clients) if group_name(index, run.options) == group_name(0, run.options)]
+    await bench_broadcast(url, run, { "type": "request", "code": "bench_group", "group": group_name(0, run.options) }, receivers)
+
+async def run_scenario(scenario, options):
+    """
+    Runs one scenario against a fresh server
+    Returns the results of the scenario
+    """
+    port = free_port()
+    root = create_root(scenario, options, port)
+    try:
+        process = await start_server(root, port, options)
+        try:
+            run = Run(scenario, options, process.pid)
+            await globals()["scenario_" + scenario]("ws://127.0.0.1:" + str(port), run)
+            return run.result()
+        finally:
+            await stop_server(process)
+    finally:
+        shutil.rmtree(root, ignore_errors=True)
+
+async def run_all(scenarios, options, on_result=None):
+    """
+    Runs the given scenarios one after another
+    Returns the list of results, each result is also passed to on_result as soon as it is ready
+    """
+    results = []
+    for scenario in scenarios:
+        result = await run_scenario(scenario, options)
+        results.append(result)
+        if on_result != None:
+            on_result(result)
+    return results
+
+def describe(result):
+    """
+    Returns a one line summary of the results of a scenario
+    """
+    latency = result["latency_ms"]
+    server = result["server"]
+    s = result["scenario"] + ": " + str(result["throughput"]) + " ops/s"
+    s += ", p50 " + str(latency["p50"]) + " ms, p99 " + str(latency["p99"]) + " ms, p999 " + str(latency["p999"]) + " ms"
+    s += ", " + str(result["errors"]) + " errors"
+    if server["cpu_percent"] != None:
+        s += ", server CPU " + str(server["cpu_percent"]) + "%, RSS " + str(server["rss_peak_mb"]) + " MB"
+    return s
+
+def write_results(path, results, options):
+    """
+    Writes the results of a benchmark and the environment it ran in to a JSON file
+    """
+    report = {
+        "created": datetime.datetime.now().isoformat(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpus": os.cpu_count(),
+        "options": options.to_dict(),
+        "results": results,
+    }
+    with open(path, "w") as f:
+        json.dump(report, f, indent=4)
@@ -0,0 +1,177 @@
+"""
+This script handles encoding and decoding packets in the formats supported by the server
+Help for all functionality of this script is available in the documentation
+"""
+
+import json
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import ujson
+except ImportError:
+    ujson = None
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+class Codec():
+    """
+    Defines an abstract packet codec that can be extended to support new packet formats
+    """
+    def __init__(self, name, binary):
+        """
+        Constructor for Codec
+        Binary codecs produce bytes frames, other codecs produce str frames
+        """
+        self.name, self.binary = name, binary
+        self.subprotocol = "wssb." + name
+
+    def encode(self, x):
+        """
+        Encodes a dictionary or list of dictionaries into a frame
+        Should be developer defined
+        """
+        raise NotImplementedError()
+
+    def decode(self, data):
+        """
+        Decodes a frame into a dictionary or list of dictionaries
+        Should be developer defined
+        Raises ValueError if the frame cannot be decoded
+        """
+        raise NotImplementedError()
+
+    def __str__(self):
+        """
+        String conversion for Codec
+        """
+        return self.name
+
+class JSONCodec(Codec):
+    """
+    Defines the JSON codec using the standard library json module
+    """
+    def __init__(self):
+        """
+        Constructor for JSONCodec
+        """
+        super().__init__("json", False)
+
+    def encode(self, x):
+        return json.dumps(x)
+
+    def decode(self, data):
+        return json.loads(data)
+
+class ORJSONCodec(JSONCodec):
+    """
+    Defines the JSON codec using the orjson library
+    Falls back to the standard library for objects orjson does not support
+    """
+    def encode(self, x):
+        try:
+            return orjson.dumps(x).decode("utf-8")
+        except TypeError:
+            return json.dumps(x)
+
+    def decode(self, data):
+        return orjson.loads(data)
+
+class UJSONCodec(JSONCodec):
+    """
+    Defines the JSON codec using the ujson library
+    """
+    def encode(self, x):
+        return ujson.dumps(x)
+
+    def decode(self, data):
+        return ujson.loads(data)
+
+class MessagePackCodec(Codec):
+    """
+    Defines the binary MessagePack codec using the msgpack library
+    """
+    def __init__(self):
+        """
+        Constructor for MessagePackCodec
+        """
+        super().__init__("msgpack", True)
+
+    def encode(self, x):
+        return msgpack.packb(x)
+
+    def decode(self, data):
+        return msgpack.unpackb(data)
+
+codecs = {} # Maps codec names to every codec available on the server
+socket_codecs = {} # Maps sockets to the codec negotiated for them
+
+if orjson != None:
+    codecs["json"] = ORJSONCodec()
+elif ujson != None:
+    codecs["json"] = UJSONCodec()
+else:
+    codecs["json"] = JSONCodec()
+
+if msgpack != None:
+    codecs["msgpack"] = MessagePackCodec()
+
+def register(codec):
+    """
+    Registers a codec so that clients can negotiate it
+    """
+    codecs[codec.name] = codec
+
+def default():
+    """
+    Returns the codec used when a client has not negotiated one
+    """
+    return codecs["json"]
+
+def find(name):
+    """
+    Finds an available codec by name
+    Returns None if the codec is not available
+    """
+    return codecs.get(name)
+
+def subprotocols():
+    """
+    Returns the list of websocket subprotocols that select a codec
+    """
+    return [codec.subprotocol for codec in codecs.values()]
+
+def from_subprotocol(subprotocol):
+    """
+    Finds the codec selected by a websocket subprotocol
+    Returns the default codec if the subprotocol does not select one
+    """
+    if subprotocol != None and subprotocol.startswith("wssb."):
+        codec = find(subprotocol[len("wssb."):])
+        if codec != None:
+            return codec
+    return default()
+
+def assign(socket, codec):
+    """
+    Sets the codec used for a socket
+    """
+    socket_codecs[socket] = codec
+
+def release(socket):
+    """
+    Forgets the codec of a disconnected socket
+    """
+    socket_codecs.pop(socket, None)
+
+def of(socket):
+    """
+    Returns the codec used for a socket
+    """
+    return socket_codecs.get(socket, codecs["json"])
@@ -4,6 +4,7 @@ Help for all functionality of this script is available in the documentation
 """
 
 import configparser
+import contextlib
 import pathlib
 import os
 import logging
@@ -18,6 +19,8 @@ class Config():
         """
         self.path, self.required = path, required
         self.config = None
+        self.batch_depth = 0
+        self.dirty = False
 
     def load(self):
         """
@@ -101,20 +104,67 @@ class Config():
     def save(self):
         """
         Writes the configuration data to file
+        Inside a batch the write is deferred until the outermost batch is committed
         """
-        with open(self.path, "w") as config_file:
-            self.config.write(config_file)
+        if self.batch_depth > 0:
+            self.dirty = True
             return True
-        return False
+        self.write()
+        return True
+
+    def write(self):
+        """
+        Atomically replaces the config file with the configuration data
+        The data is written to a temporary file first so readers never see a partially written file
+        """
+        temp_path = self.path + "." + str(os.getpid()) + ".tmp"
+        with open(temp_path, "w") as config_file:
+            self.config.write(config_file)
+        os.replace(temp_path, self.path)
+        self.dirty = False
+
+    def begin(self):
+        """
+        Starts a batch of changes that are saved to file once when the batch is committed
+        Batches can be nested, only the outermost commit writes the file
+        """
+        self.batch_depth += 1
+
+    def commit(self):
+        """
+        Ends a batch of changes and saves them if this was the outermost batch
+        """
+        self.batch_depth = max(0, self.batch_depth - 1)
+        if self.batch_depth == 0 and self.dirty:
+            self.write()
+
+    def rollback(self):
+        """
+        Ends all batches and discards their changes by reloading the config from file
+        """
+        self.batch_depth = 0
+        self.dirty = False
+        self.reload()
+
+    @contextlib.contextmanager
+    def transaction(self):
+        """
+        Groups changes into a batch that is committed on success and rolled back if an exception is raised
+        """
+        self.begin()
+        try:
+            yield self
+        except BaseException:
+            self.rollback()
+            raise
+        self.commit()
 
     def autogen(self):
         """
         Autogenerates a configuration file in the path given
         Adds required default sections and options if they are not already defined in the config
         """
-        if not os.path.exists(self.path):
-            with open(self.path, "w") as config_file:
-                config_file.write("; Default configuration creation in progress...")
+        changed = not os.path.exists(self.path)
 
         self.config = configparser.ConfigParser()
         self.config.read(self.path)
@@ -122,15 +172,16 @@ class Config():
         for section in self.required.keys():
             if not self.config.has_section(section):
                 self.config[section] = {}
+                changed = True
             for key in self.required[section].keys():
                 if not self.config.has_option(section, key):
                     self.config[section][key] = self.required[section][key]
+                    changed = True
 
-        with open(self.path, "w") as config_file:
-            self.config.write(config_file)
-            return True
-
-        return False
+        # Only rewrite the file when defaults were added, so concurrent server processes never see it truncated
+        if changed:
+            self.write()
+        return True
 
 # Stores the global config in memory
 global_conf = None
@@ -147,6 +198,27 @@ def load_global_config():
         "GENERAL": {
             "server_address": "localhost",
             "server_port": "8765",
+            "outbound_queue_size": "256",
+            "outbound_queue_policy": "drop_oldest",
+            "backplane": "",
+            "node_id": "",
+            "log_format": "text",
+            "log_rate_limit": "20",
+            "log_rate_interval": "1",
+            "user_store": "ini",
+            "user_store_path": "users.db",
+            "user_cache_size": "10000",
+            "plugin_watch": "false",
+            "plugin_watch_interval": "1",
+            "metrics_address": "localhost",
+            "metrics_port": "",
+            "rate_limit_action": "reject",
+            "rate_limit_connection_messages": "",
+            "rate_limit_connection_bytes": "",
+            "rate_limit_user_messages": "",
+            "rate_limit_user_bytes": "",
+            "rate_limit_code_messages": "",
+            "rate_limit_codes": "",
         },
     }
     global_conf = Config(env_root + "/server.ini", required=fields)
@@ -210,7 +282,7 @@ def validate(s):
     """
     Validates a string for config insertion
     """
-    return not ("," in s or "\"" in s or "\'" in s or "\n" in s or " " in s or s[0] == "%")
+    return s != "" and not ("," in s or "\"" in s or "\'" in s or "\n" in s or " " in s or s[0] == "%")
 
 def validate_permission_string(s):
     """
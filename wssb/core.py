@@ -3,45 +3,203 @@ This script creates the server object and processes incoming requests
 Help for all functionality of this script is available in the documentation
 """
 
-import logging
 import asyncio
 import websockets
 import signal
-import json
-import traceback
+import time
 
 from wssb import config
 from wssb import plugins
 from wssb import users
 from wssb import views
+from wssb import outbound
+from wssb import codec
+from wssb import backplane
+from wssb import log
+from wssb import metrics
+from wssb import profiling
+from wssb import ratelimit
+from wssb import workers
 from wssb.events import Events
 
 quiet_mode = False
 stop = None
+profile_startup = False # Whether startup timings are reported once the server is listening
+profile_output = None # Path the cProfile of the startup is written to, None to skip profiling
 
 def get_target_conns(response, socket):
-    resp = response["response"]
+    """
+    Resolves the list of sockets a response should be sent to
+    """
     target = response["target"]
-    target_conns = []
     if target == None:
         return []
     if target.mode == "ALL":
-        for user in users.connected():
-            target_conns += user._sockets
+        return users.connected_conns()
     elif target.mode == "SOURCE":
-        target_conns = [socket]
+        return [socket]
+
+    target_conns = set()
+    for target_user in target.users:
+        if target_user != None:
+            target_conns.update(users.user_conns(target_user.name))
+    for target_group in target.groups:
+        if target_group != None:
+            target_conns.update(users.group_conns(target_group.name))
+    return list(target_conns)
+
+def send(socket, packet, batch=None):
+    """
+    Queues a packet to be sent to a single socket using the socket's codec
+    If a batch list is given the packet is collected into it instead
+    """
+    count_error(packet)
+    if batch != None:
+        batch.append(packet)
+        return True
+    return outbound.send(socket, views.format_packet(packet, codec.of(socket)))
+
+def broadcast(sockets, packet, frames=None):
+    """
+    Queues a packet to be sent to every socket given
+    The packet is encoded once per codec in use and the same frame is shared by every recipient
+    Already encoded frames can be given as a dictionary of codec names to frames
+    Returns the dictionary of encoded frames
+    """
+    if frames == None:
+        frames = {}
+    for socket in sockets:
+        socket_codec = codec.of(socket)
+        frame = frames.get(socket_codec.name)
+        if frame == None:
+            frame = views.format_packet(packet, socket_codec)
+            frames[socket_codec.name] = frame
+        outbound.send(socket, frame)
+    return frames
+
+def send_response(response, socket, batch=None):
+    """
+    Sends a targetted response to all of its target connections
+    If a batch list is given the copy meant for the source socket is collected into it instead
+    Deliveries for users and groups online on other nodes are published to the backplane
+    """
+    target_conns = get_target_conns(response, socket)
+    count = len(target_conns)
+    count_error(response["response"])
+    metrics.fanout.observe(count)
+    if batch != None and socket in target_conns:
+        batch.append(response["response"])
+        target_conns = [conn for conn in target_conns if conn is not socket]
+    frames = broadcast(target_conns, response["response"])
+    target = response["target"]
+    if backplane.is_connected() and target != None and target.mode != "SOURCE":
+        publish_delivery(target, response["response"], frames)
+    return count
+
+def count_error(packet):
+    """
+    Counts an outgoing packet in the error metrics if it is an error response
+    """
+    if type(packet) == dict and packet.get("status") == "error":
+        metrics.errors.inc(str(packet.get("code")))
+
+def rate_limited(socket, limited, user=None, batch=None):
+    """
+    Rejects or drops traffic over a rate limit as configured
+    """
+    limit, retry_after = limited
+    metrics.rate_limited.inc(limit)
+    log.warning("SERVER", "Rate limited " + (("user '" + user.name + "'") if user != None else "an unauthenticated connection") + " on " + limit, event="rate_limited", console=False, limit=limit)
+    if ratelimit.action == ratelimit.REJECT:
+        response = views.error("WSSB_RATE_LIMITED", "You are sending too much, please slow down!")
+        response["limit"], response["retry_after"] = limit, round(retry_after, 3)
+        send(socket, response, batch)
+
+def request_label(code):
+    """
+    Returns the request code a request is counted under in the metrics
+    Unknown codes are counted together so clients cannot create an unbounded number of metrics
+    """
+    if type(code) == str and (code == "auth" or code in views.core_routes or code in plugins.routes or code in plugins.deferred_routes):
+        return code
+    return "other"
+
+def publish_delivery(target, packet, frames):
+    """
+    Publishes a pre-encoded delivery to the remote nodes the target can reach
+    """
+    target_users = [user.name for user in target.users if user != None]
+    target_groups = [group.name for group in target.groups if group != None]
+    if target.mode == "ALL":
+        nodes = None
     else:
-        for target_user in target.users:
-            for online_user in users.connected():
-                if target_user != None and target_user.name == online_user.name:
-                    target_conns += online_user._sockets
-        for target_group in target.groups:
-            for online_user in users.connected():
-                if target_group != None and online_user.belongs_to(target_group):
-                    for conn in online_user._sockets:
-                        if conn not in target_conns:
-                            target_conns.append(conn)
-    return target_conns
+        nodes = set()
+        for user_name in target_users:
+            nodes.update(backplane.presence.nodes_for_user(user_name))
+        for group_name in target_groups:
+            nodes.update(backplane.presence.nodes_for_group(group_name))
+        if len(nodes) == 0:
+            return
+    default_codec = codec.default()
+    frame = frames.get(default_codec.name)
+    if frame == None:
+        frame = views.format_packet(packet, default_codec)
+    backplane.publish({ "type": "deliver", "mode": target.mode, "users": target_users, "groups": target_groups, "frame": frame }, nodes)
+
+def publish_presence(user_name, online):
+    """
+    Tells the other nodes that a user came online or went offline on this node
+    """
+    backplane.publish({ "type": "presence", "user": user_name, "online": online })
+
+async def handle_backplane(node_id, message):
+    """
+    Handles a message published by another node
+    Deliveries are sent to matching local sockets, control messages repeat core reloads locally
+    """
+    if message["type"] == "deliver":
+        if message["mode"] == "ALL":
+            conns = users.connected_conns()
+        else:
+            conns = set()
+            for user_name in message["users"]:
+                conns.update(users.user_conns(user_name))
+            for group_name in message["groups"]:
+                conns.update(users.group_conns(group_name))
+        frames = { codec.default().name: message["frame"] }
+        packet = None
+        if any([codec.of(conn).name not in frames for conn in conns]):
+            packet = codec.default().decode(message["frame"])
+        broadcast(conns, packet, frames)
+    elif message["type"] == "presence":
+        backplane.presence.set_online(node_id, message["user"], message["online"])
+    elif message["type"] == "hello":
+        backplane.publish(backplane.presence_sync(), [node_id])
+    elif message["type"] == "presence_sync":
+        backplane.presence.sync(node_id, message["users"])
+    elif message["type"] == "node_down":
+        backplane.presence.drop(message["node"])
+    elif message["type"] == "control":
+        code = message["code"]
+        if code in ("reloadcfg", "reload"):
+            config.global_config().reload()
+            outbound.load_config()
+            log.load_config()
+            ratelimit.load_config()
+        if code in ("reloadusers", "reload"):
+            to_close = []
+            users.reload_all(to_close)
+            ratelimit.invalidate()
+            broadcast(to_close, views.info("WSSB_USER_KICKED", "You have been kicked from the server!"))
+            for sock in to_close:
+                outbound.close(sock)
+        if code == "reloadplugins" and message.get("plugin") != None:
+            await plugins.reload_plugin(message["plugin"], quiet_mode)
+        elif code in ("reloadplugins", "reload"):
+            await plugins.trigger_handlers(Events.SERVER_STOP, None)
+            if not await plugins.reload_all(quiet_mode):
+                stop.set_result(1)
+        log.info("SERVER", "Repeated '" + code + "' from node '" + node_id + "'", console=False)
 
 async def run_server(socket, path):
     """
@@ -50,127 +208,236 @@ async def run_server(socket, path):
     global quiet_mode, stop
 
     authenticated = False
+    batch_responses = False
     session_user = None
+    limiter = ratelimit.Limiter()
+
+    outbound.attach(socket)
+    codec.assign(socket, codec.from_subprotocol(socket.subprotocol))
 
     try:
         while True:
             data = await socket.recv()
-            packets = views.parse_packet(data)
+            metrics.received_bytes.inc(amount=len(data))
+            # Frames over a limit are turned away before they are decoded
+            limited = limiter.check_frame(len(data))
+            if limited != None:
+                rate_limited(socket, limited, session_user)
+                continue
+            packets = views.parse_packet(data, codec.of(socket))
+            if packets == None:
+                send(socket, views.error("WSSB_INVALID_PACKET", "The packet could not be decoded."))
+                continue
+            limited = limiter.check_messages(len(packets))
+            if limited != None:
+                rate_limited(socket, limited, session_user)
+                continue
+            # Replies to the source from a multi-request packet are sent as one list frame if enabled
+            batch = [] if batch_responses and len(packets) > 1 else None
             for request in packets:
                 if "type" in request and request["type"] == "request" and "code" in request:
+                    start = time.perf_counter()
                     if not authenticated and request["code"] != None and request["code"] != "auth":
-                        await socket.send(views.format_packet(views.error("WSSB_USER_NOT_AUTHENTICATED", "You have not yet been authenticated!")))
+                        send(socket, views.error("WSSB_USER_NOT_AUTHENTICATED", "You have not yet been authenticated!"), batch)
                         break
-                    response = views.process(session_user, request, socket, quiet_mode)
+                    limited = limiter.check_request(request_label(request["code"]))
+                    if limited != None:
+                        rate_limited(socket, limited, session_user, batch)
+                        continue
+                    response = await views.process(session_user, request, socket, quiet_mode)
                     if response == None:
                         # Trigger plugin event handler for custom commands
-                        responses = plugins.handle(request, session_user)
+                        responses = await plugins.handle(request, session_user)
                         for response in responses:
-                            target_conns = get_target_conns(response, socket)
-                            for conn in target_conns:
-                                await conn.send(views.format_packet(response["response"]))
+                            send_response(response, socket, batch)
                         if len(responses) == 0:
-                            await socket.send(views.format_packet(views.error("WSSB_REQUEST_CODE_NOT_FOUND", "The request code given could not be found in any core or plugin features.")))
+                            send(socket, views.error("WSSB_REQUEST_CODE_NOT_FOUND", "The request code given could not be found in any core or plugin features."), batch)
                     elif type(response) == dict and "wssb_authenticated" in response:
                         # Authenticate user
                         authenticated = True
                         session_user = response["user"]
-                        users.register_socket(session_user.name, socket)
+                        limiter.user = session_user
+                        if users.register_socket(session_user.name, socket):
+                            publish_presence(session_user.name, True)
                         users.connected_sockets.add(socket)
-                        await socket.send(views.format_packet(views.success("WSSB_USER_AUTHENTICATED", "You are now logged in!")))
+                        if response["codec"] != None:
+                            codec.assign(socket, response["codec"])
+                        batch_responses = response["batch"]
+                        send(socket, views.success("WSSB_USER_AUTHENTICATED", "You are now logged in!"), batch)
                         for plugin_response in response["plugin_responses"]:
-                            target_conns = get_target_conns(plugin_response, socket)
-                            for conn in target_conns:
-                                await conn.send(views.format_packet(plugin_response["response"]))
+                            send_response(plugin_response, socket, batch)
                     else:
                         # Check for core flagged actions
-                        if "to_close" in response:
+                        if "to_close" in response and len(response["to_close"]) > 0:
+                            broadcast(response["to_close"], views.info("WSSB_USER_KICKED", response["close_reason"]))
                             for sock in response["to_close"]:
-                                await sock.send(views.format_packet(views.info("WSSB_USER_KICKED", response["close_reason"])))
-                                await sock.close()
+                                outbound.close(sock)
 
                         if "target" in response:
-                            target_conns = get_target_conns(response, socket)
-                            for conn in target_conns:
-                                await conn.send(views.format_packet(response["response"]))
+                            send_response(response, socket, batch)
                         else:
-                            await socket.send(views.format_packet(response))
+                            send(socket, response, batch)
+
+                        # Repeat successful reloads on the other worker processes
+                        if request["code"] in views.repeated_routes and response["response"]["status"] == "success":
+                            backplane.publish({ "type": "control", "code": request["code"], "plugin": request.get("plugin") })
 
                         if "stop" in response:
                             if response["stop"]:
-                                logging.info("[SERVER] " + session_user.name + " is closing the server")
-                                if not quiet_mode:
-                                    print("[SERVER] " + session_user.name + " is closing the server")
-                                plugins.trigger_handlers(Events.SERVER_STOP, None)
+                                log.info("SERVER", session_user.name + " is closing the server")
+                                await plugins.trigger_handlers(Events.SERVER_STOP, None)
                                 stop.set_result(0)
+                    metrics.request_seconds.observe(time.perf_counter() - start, request_label(request["code"]))
+            if batch != None and len(batch) > 0:
+                send(socket, batch)
     except Exception as e:
-        # Exceptions to ignore when printing can be added to the conn_excp blacklist
+        # Exceptions to ignore when logging can be added to the conn_excp blacklist
         conn_excp = (
             websockets.exceptions.ConnectionClosedOK,
         )
-        if type(e) not in conn_excp and not quiet_mode:
-            print(traceback.format_exc())
+        if type(e) not in conn_excp:
+            log.exception("SERVER", "Connection handler failed", event="connection_error")
     finally:
+        outbound.detach(socket)
+        codec.release(socket)
         if session_user != None:
             users.connected_sockets.remove(socket)
-            plugins.trigger_handlers(Events.USER_DISCONNECT, { "user": session_user, "socket": socket })
-            users.unregister_socket(session_user.name, socket)
-            logging.info("[SERVER] User '" + session_user.name + "' has disconnected.")
-            if not quiet_mode:
-                print("[SERVER] User '" + session_user.name + "' has disconnected.")
+            await plugins.trigger_handlers(Events.USER_DISCONNECT, { "user": session_user, "socket": socket })
+            if users.unregister_socket(session_user.name, socket):
+                publish_presence(session_user.name, False)
+                ratelimit.forget(session_user.name)
+            log.info("SERVER", "User '" + session_user.name + "' has disconnected.", event="user_disconnected", user=session_user.name)
+
+def finish_startup():
+    """
+    Stops recording startup timings and reports them if startup profiling is enabled
+    """
+    profiling.end()
+    if profile_output != None:
+        profiling.stop_profiler(profile_output)
+    if profile_startup:
+        profiling.report()
 
-async def start_core(address, port, stop):
-    async with websockets.serve(run_server, address, port):
-        await stop
+async def start_core(address, port, stop, backplane_url, node_id, reuse_port, metrics_port=None):
+    with profiling.timed(profiling.PHASES, "backplane_connect"):
+        if await backplane.connect(backplane_url, node_id, handle_backplane):
+            log.info("SERVER", "Connected to backplane " + backplane_url + " as node '" + node_id + "'")
+    metrics_server = None
+    if metrics_port != None:
+        metrics_address = config.global_config()["GENERAL"]["metrics_address"]
+        metrics_server = await metrics.serve(metrics_address, metrics_port)
+        log.info("SERVER", "Serving metrics on http://" + metrics_address + ":" + str(metrics_port) + "/metrics")
+    watcher = None
+    if config.global_config()["GENERAL"].getboolean("plugin_watch"):
+        watcher = asyncio.create_task(plugins.watch(float(config.global_config()["GENERAL"]["plugin_watch_interval"]), quiet_mode))
+    with profiling.timed(profiling.PHASES, "bind"):
+        server = await websockets.serve(run_server, address, port, subprotocols=codec.subprotocols(), reuse_port=reuse_port)
+    finish_startup()
+    try:
+        result = await stop
+        await outbound.flush_all(5)
+    finally:
+        server.close()
+        await server.wait_closed()
+    if watcher != None:
+        watcher.cancel()
+    if metrics_server != None:
+        metrics_server.close()
+    await backplane.disconnect()
+    return result
 
-def start(quiet):
+def start(quiet, worker_id=None, ipc_path=None, profile=False, profile_path=None, worker_count=1):
     """
     Starts the main application WebSocket server
+    When started as a worker the listening port is shared with the other workers
+    The worker count lets plugins divide host resources such as CPU cores between the workers
+    If profile is set the wall time of every startup phase, plugin import and start handler is reported,
+    and if a profile path is given a cProfile of the startup is written to it
+    Returns the exit code of the server
     """
-    global quiet_mode, stop
+    global quiet_mode, stop, profile_startup, profile_output
     quiet_mode = quiet
+    profile_startup = profile
+    profile_output = profile_path
+    workers.count = worker_count if worker_id != None else 1
+    if profile_output != None and worker_id != None:
+        profile_output += ".worker-" + str(worker_id)
+
+    profiling.begin()
+    if profile_output != None:
+        profiling.start_profiler()
 
     # Autogenerate the plugins folder
-    plugins.autogen_folder(quiet)
+    with profiling.timed(profiling.PHASES, "autogen_folder"):
+        plugins.autogen_folder(quiet)
 
     # Load server config
-    if config.load_global_config():
-        logging.info("[SERVER] Loaded server configuration file successfully")
-        if not quiet:
-            print("[SERVER] Loaded server configuration file successfully")
-    else:
-        if not quiet:
-            print("[SERVER] Could not load server configuration file")
-        logging.error("[SERVER] Could not load server configuration file")
+    with profiling.timed(profiling.PHASES, "load_global_config"):
+        if config.load_global_config():
+            log.info("SERVER", "Loaded server configuration file successfully")
+        else:
+            log.error("SERVER", "Could not load server configuration file")
+
+        # Apply logging, outbound queue and rate limit options
+        log.load_config()
+        outbound.load_config()
+        ratelimit.load_config()
 
     # Load all plugins
-    if not plugins.load_all(quiet):
-        return
+    with profiling.timed(profiling.PHASES, "load_plugins"):
+        loaded = plugins.load_all(quiet, lazy=True)
+    if not loaded:
+        finish_startup()
+        return 1
 
     # Load all users
-    config.load_users_config()
-    config.load_groups_config()
-    users.reload_all()
+    with profiling.timed(profiling.PHASES, "load_users"):
+        loaded = users.load_store()
+        if loaded:
+            users.reload_all()
+    if not loaded:
+        log.error("SERVER", "Could not open the user store")
+        finish_startup()
+        return 1
+
+    loop = asyncio.get_event_loop()
 
     # Trigger server start event handlers
-    if not plugins.trigger_conditional_handlers(Events.SERVER_START, None):
-        return
+    with profiling.timed(profiling.PHASES, "server_start_handlers"):
+        started = loop.run_until_complete(plugins.trigger_conditional_handlers(Events.SERVER_START, None))
+    if not started:
+        finish_startup()
+        return 1
+    plugins.update_manifest()
 
     # Load server information from config
     address = config.global_config()["GENERAL"]["server_address"]
     port = int(config.global_config()["GENERAL"]["server_port"])
 
+    # Workers use the configured backplane, or the supervisor's local one if none is configured
+    backplane_url = config.global_config()["GENERAL"]["backplane"]
+    node_id = config.global_config()["GENERAL"]["node_id"]
+    if node_id == "":
+        node_id = backplane.default_node_id()
+    if worker_id != None:
+        node_id += "-worker-" + str(worker_id)
+        if backplane_url == "" and ipc_path != None:
+            backplane_url = "unix://" + ipc_path
+
+    # Workers serve their metrics on consecutive ports starting at the configured one
+    metrics_port = None
+    if config.global_config()["GENERAL"]["metrics_port"] != "":
+        metrics_port = int(config.global_config()["GENERAL"]["metrics_port"])
+        if worker_id != None:
+            metrics_port += worker_id
+
     # Start the server
-    logging.info("[SERVER] Starting WebSocket server on " + address + ":" + str(port))
-    if not quiet:
-        print("[SERVER] Starting WebSocket server on " + address + ":" + str(port))
+    log.info("SERVER", "Starting WebSocket server on " + address + ":" + str(port))
 
-    loop = asyncio.get_event_loop()
     stop = loop.create_future()
     loop.add_signal_handler(signal.SIGTERM, stop.set_result, None)
 
-    loop.run_until_complete(start_core(address, port, stop))
+    result = loop.run_until_complete(start_core(address, port, stop, backplane_url, node_id, worker_id != None, metrics_port))
 
-    logging.info("[SERVER] Server closed")
-    if not quiet_mode:
-        print("[SERVER] Server closed")
+    log.info("SERVER", "Server closed")
+    return result if result != None else 0
@@ -3,9 +3,12 @@ This script handles general File I/O actions used in the environment
 Help for all functionality of this script is available in the documentation
 """
 
+import csv
+import json
 import pathlib
 import os
-import logging
+
+from wssb import log
 
 def reset_log_file(quiet):
     """
@@ -14,8 +17,76 @@ def reset_log_file(quiet):
     env_root = str(pathlib.Path(__file__).parent.parent.absolute())
     if os.path.exists(env_root + "/server.log"):
         os.remove(env_root + "/server.log")
-        logging.info("[SERVER] Log file reset successfully")
-        if not quiet:
-            print("[SERVER] Log file reset successfully")
+        log.info("SERVER", "Log file reset successfully")
         return True
     return False
+
+def split_values(values, entry):
+    """
+    Returns a list of non-empty names from a list or a comma separated string
+    Raises ValueError naming the entry if the values are not strings
+    """
+    if type(values) == str:
+        values = values.split(",")
+    if type(values) != list or not all([type(value) == str for value in values]):
+        raise ValueError("Expected a list of strings in " + entry)
+    return [value.strip() for value in values if value.strip() != ""]
+
+def entries(data, kind):
+    """
+    Returns the (name, values) pairs of the groups or users object of a JSON import file
+    Raises ValueError naming the entry if a name is empty or its values are not an object
+    """
+    objects = data.get(kind + "s", {})
+    if type(objects) != dict:
+        raise ValueError("Expected \"" + kind + "s\" to be an object")
+    for name, values in objects.items():
+        if name.strip() == "":
+            raise ValueError("Empty " + kind + " name")
+        if type(values) != dict:
+            raise ValueError("Expected an object for " + kind + " '" + name + "'")
+        yield name.strip(), values
+
+def read_import_file(path):
+    """
+    Reads groups and users to bulk import from a CSV or JSON file
+    CSV files have a header of type,name,groups,permissions where type is user or group
+    JSON files hold a "groups" and a "users" object mapping names to their "groups" and "permissions"
+    Returns dictionaries of groups and users, raises ValueError if the file cannot be read
+    """
+    groups, users = {}, {}
+    if path.endswith(".json"):
+        with open(path) as import_file:
+            try:
+                data = json.load(import_file)
+            except json.JSONDecodeError as e:
+                raise ValueError("Invalid JSON: " + str(e))
+        if type(data) != dict:
+            raise ValueError("Expected a JSON object with groups and users")
+        for group_name, values in entries(data, "group"):
+            groups[group_name] = { "permissions": split_values(values.get("permissions", []), "group '" + group_name + "'") }
+        for user_name, values in entries(data, "user"):
+            entry = "user '" + user_name + "'"
+            users[user_name] = { "groups": split_values(values.get("groups", []), entry), "permissions": split_values(values.get("permissions", []), entry) }
+    elif path.endswith(".csv"):
+        with open(path, newline="") as import_file:
+            reader = csv.DictReader(import_file)
+            if reader.fieldnames == None or "type" not in reader.fieldnames or "name" not in reader.fieldnames:
+                raise ValueError("Expected a CSV header of type,name,groups,permissions")
+            for row in reader:
+                name = (row["name"] or "").strip()
+                line = "line " + str(reader.line_num)
+                if name == "":
+                    raise ValueError("Empty name on " + line)
+                perms = split_values(row.get("permissions") or "", line)
+                if row["type"] == "group":
+                    groups.setdefault(name, { "permissions": [] })["permissions"] += perms
+                elif row["type"] == "user":
+                    user = users.setdefault(name, { "groups": [], "permissions": [] })
+                    user["groups"] += split_values(row.get("groups") or "", line)
+                    user["permissions"] += perms
+                else:
+                    raise ValueError("Unknown type '" + str(row["type"]) + "' on " + line)
+    else:
+        raise ValueError("Import files must be .csv or .json")
+    return groups, users
@@ -0,0 +1,41 @@
+"""
+This script handles salted password hashing and verification for plugins
+Help for all functionality of this script is available in the documentation
+"""
+
+import hashlib
+import hmac
+import os
+
+SCHEME = "scrypt"
+
+def hash_password(password, n=16384, r=8, p=1):
+    """
+    Hashes a password with a random salt using scrypt
+    Returns a string of the form scrypt$n$r$p$salt$hash that is safe for config insertion
+    """
+    salt = os.urandom(16)
+    digest = hashlib.scrypt(password.encode("utf-8"), salt=salt, n=n, r=r, p=p, dklen=64)
+    return "$".join([SCHEME, str(n), str(r), str(p), salt.hex(), digest.hex()])
+
+def is_hashed(stored):
+    """
+    Returns True if a stored password string was produced by hash_password
+    """
+    return stored.startswith(SCHEME + "$")
+
+def verify_password(password, stored):
+    """
+    Returns True if the password matches the stored password string
+    Stored strings that are not hashed are compared as plaintext
+    This function is CPU heavy and should be run in a process pool by servers
+    """
+    if not is_hashed(stored):
+        return hmac.compare_digest(password.encode("utf-8"), stored.encode("utf-8"))
+    try:
+        scheme, n, r, p, salt, digest = stored.split("$")
+        expected = bytes.fromhex(digest)
+        actual = hashlib.scrypt(password.encode("utf-8"), salt=bytes.fromhex(salt), n=int(n), r=int(r), p=int(p), dklen=len(expected))
+    except ValueError:
+        return False
+    return hmac.compare_digest(actual, expected)
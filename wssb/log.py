@@ -0,0 +1,278 @@
+"""
+This script handles the queued logging pipeline used by the server and its plugins
+Help for all functionality of this script is available in the documentation
+"""
+
+import atexit
+import datetime
+import json
+import logging
+import logging.handlers
+import pathlib
+import queue
+import time
+import traceback
+
+from wssb import config
+
+TEXT = "text"
+JSON = "json"
+FORMATS = (TEXT, JSON)
+
+class TextFormatter(logging.Formatter):
+    """
+    Defines the plain text log line format
+    """
+    def __init__(self, fmt='%(asctime)s %(levelname)s: %(message)s'):
+        """
+        Constructor for TextFormatter
+        """
+        super().__init__(fmt)
+
+    def format(self, record):
+        s = super().format(record)
+        suppressed = getattr(record, "wssb_suppressed", 0)
+        if suppressed > 0:
+            s += " (" + str(suppressed) + " similar messages suppressed)"
+        return s
+
+class JSONFormatter(logging.Formatter):
+    """
+    Defines a structured log line format with one JSON object per record
+    """
+    def format(self, record):
+        entry = {
+            "time": datetime.datetime.fromtimestamp(record.created).isoformat(),
+            "level": record.levelname,
+            "source": getattr(record, "wssb_source", record.name),
+            "message": getattr(record, "wssb_message", record.getMessage()),
+        }
+        if getattr(record, "wssb_event", None) != None:
+            entry["event"] = record.wssb_event
+        entry.update(getattr(record, "wssb_fields", {}))
+        if getattr(record, "wssb_suppressed", 0) > 0:
+            entry["suppressed"] = record.wssb_suppressed
+        return json.dumps(entry, default=str)
+
+class Sink(logging.Handler):
+    """
+    Defines an abstract log output that can be extended to create custom sinks
+    Sinks run on the log listener thread so they may block without stalling the server
+    """
+    def __init__(self, console=False):
+        """
+        Constructor for Sink
+        Console sinks only receive records meant for the terminal, other sinks only receive records meant for the log
+        """
+        super().__init__()
+        self.console = console
+
+    def filter(self, record):
+        if self.console:
+            return getattr(record, "wssb_console", False)
+        return getattr(record, "wssb_file", True)
+
+    def emit(self, record):
+        try:
+            self.write(self.format(record))
+        except Exception:
+            self.handleError(record)
+
+    def write(self, s):
+        """
+        Writes a formatted record
+        Should be developer defined
+        """
+        raise NotImplementedError()
+
+class ConsoleSink(Sink):
+    """
+    Defines a sink that prints records to the terminal
+    """
+    def __init__(self):
+        """
+        Constructor for ConsoleSink
+        """
+        super().__init__(console=True)
+        self.setFormatter(TextFormatter('%(message)s'))
+
+    def write(self, s):
+        print(s, flush=True)
+
+class FileSink(Sink):
+    """
+    Defines a sink that appends records to a log file
+    The file is opened on the first record so it can be reset while no records are written
+    """
+    def __init__(self, path):
+        """
+        Constructor for FileSink
+        """
+        super().__init__()
+        self.path = path
+        self.file = None
+        self.setFormatter(TextFormatter())
+
+    def write(self, s):
+        if self.file == None:
+            self.file = open(self.path, "a")
+        self.file.write(s + "\n")
+        self.file.flush()
+
+    def close(self):
+        if self.file != None:
+            self.file.close()
+            self.file = None
+        super().close()
+
+class RateLimiter(logging.Filter):
+    """
+    Defines a filter that lets at most limit records of the same event through per interval
+    Suppressed records are counted and reported on the first record of the next interval
+    Server records without an event are never limited, records of other libraries are limited by message
+    """
+    def __init__(self, limit=0, interval=1.0):
+        """
+        Constructor for RateLimiter
+        A limit of 0 disables rate limiting
+        """
+        super().__init__()
+        self.limit, self.interval = limit, interval
+        self.windows = {}
+
+    def filter(self, record):
+        if not hasattr(record, "wssb_source") and not hasattr(record, "wssb_file"):
+            event = record.name + ":" + str(record.msg)
+        else:
+            event = getattr(record, "wssb_event", None)
+        if self.limit <= 0 or event == None:
+            return True
+        now = time.monotonic()
+        window = self.windows.get(event)
+        if window == None or now - window[0] >= self.interval:
+            record.wssb_suppressed = window[2] if window != None else 0
+            self.windows[event] = [now, 1, 0]
+            return True
+        if window[1] < self.limit:
+            window[1] += 1
+            return True
+        window[2] += 1
+        return False
+
+logger = logging.getLogger("wssb")
+limiter = RateLimiter()
+listener = None
+file_sink = None
+
+def setup(quiet, path=None):
+    """
+    Routes all log records through a queue to a background listener thread
+    Records are written to the log file and, unless quiet mode is enabled, printed to the terminal
+    Does nothing if the pipeline has already been set up
+    """
+    global listener, file_sink
+
+    if listener != None:
+        return False
+    if path == None:
+        path = str(pathlib.Path(__file__).parent.parent.absolute()) + "/server.log"
+
+    file_sink = FileSink(path)
+    sinks = [file_sink]
+    if not quiet:
+        sinks.append(ConsoleSink())
+
+    log_queue = queue.SimpleQueue()
+    handler = logging.handlers.QueueHandler(log_queue)
+    handler.addFilter(limiter)
+    root = logging.getLogger()
+    for old_handler in list(root.handlers):
+        root.removeHandler(old_handler)
+    root.addHandler(handler)
+    root.setLevel(logging.INFO)
+
+    listener = logging.handlers.QueueListener(log_queue, *sinks, respect_handler_level=True)
+    listener.start()
+    atexit.register(shutdown)
+    return True
+
+def add_sink(sink):
+    """
+    Adds a custom sink to the running pipeline
+    """
+    listener.handlers = listener.handlers + (sink,)
+
+def shutdown():
+    """
+    Writes all queued records and stops the listener thread
+    """
+    global listener
+
+    if listener != None:
+        listener.stop()
+        for sink in listener.handlers:
+            sink.close()
+        listener = None
+
+def configure(log_format, rate_limit, rate_interval):
+    """
+    Sets the log file format and the rate limit applied to repetitive events
+    """
+    if log_format not in FORMATS:
+        error("SERVER", "Unknown log format '" + log_format + "', using '" + TEXT + "'")
+        log_format = TEXT
+    if file_sink != None:
+        file_sink.setFormatter(JSONFormatter() if log_format == JSON else TextFormatter())
+    limiter.limit, limiter.interval = rate_limit, rate_interval
+    limiter.windows = {}
+
+def load_config():
+    """
+    Applies the logging options from the global server config
+    """
+    general = config.global_config()["GENERAL"]
+    configure(general["log_format"], int(general["log_rate_limit"]), float(general["log_rate_interval"]))
+
+def log(level, source, message, event=None, console=True, **fields):
+    """
+    Queues a structured record tagged with its source, such as SERVER or a plugin name
+    Records with an event name are subject to rate limiting
+    Extra keyword arguments are kept as fields of the record
+    """
+    logger.log(level, "[" + source + "] " + message, extra={
+        "wssb_source": source,
+        "wssb_message": message,
+        "wssb_event": event,
+        "wssb_fields": fields,
+        "wssb_console": console,
+    })
+
+def info(source, message, event=None, console=True, **fields):
+    """
+    Logs an informative message
+    """
+    log(logging.INFO, source, message, event, console, **fields)
+
+def warning(source, message, event=None, console=True, **fields):
+    """
+    Logs a warning message
+    """
+    log(logging.WARNING, source, message, event, console, **fields)
+
+def error(source, message, event=None, console=True, **fields):
+    """
+    Logs an error message
+    """
+    log(logging.ERROR, source, message, event, console, **fields)
+
+def exception(source, message, event=None, console=True, **fields):
+    """
+    Logs an error message followed by the traceback of the exception being handled
+    """
+    log(logging.ERROR, source, message + "\n" + traceback.format_exc().rstrip(), event, console, **fields)
+
+def echo(message):
+    """
+    Prints a message to the terminal through the pipeline without writing it to the log
+    """
+    logger.info(message, extra={ "wssb_console": True, "wssb_file": False })
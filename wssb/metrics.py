@@ -0,0 +1,288 @@
+"""
+This script handles the metrics registry of the server and exposes it in the Prometheus text format
+Help for all functionality of this script is available in the documentation
+"""
+
+import asyncio
+import bisect
+import math
+
+from wssb import outbound
+from wssb import profiling
+from wssb import users
+
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+FANOUT_BUCKETS = (0, 1, 2, 5, 10, 50, 100, 500, 1000, 5000, 10000, 50000)
+HTTP_TIMEOUT = 5 # Seconds a metrics scraper is given to send its request
+
+class Metric():
+    """
+    Defines an abstract metric that can be extended to create custom metric types
+    Every metric holds one value per combination of label values
+    """
+    kind = "untyped"
+
+    def __init__(self, name, help, labels=()):
+        """
+        Constructor for Metric
+        """
+        self.name, self.help, self.labels = name, help, tuple(labels)
+
+    def samples(self):
+        """
+        Returns a list of (name suffix, label dictionary, value) samples of the metric
+        Should be developer defined
+        """
+        raise NotImplementedError()
+
+    def snapshot(self):
+        """
+        Returns a list of the metric's values and their labels
+        """
+        return [{ "labels": labels, "value": value } for suffix, labels, value in self.samples()]
+
+    def label_dict(self, values):
+        """
+        Returns the labels of a tuple of label values as a dictionary
+        """
+        return dict(zip(self.labels, values))
+
+    def render(self):
+        """
+        Returns the metric in the Prometheus text format
+        """
+        lines = ["# HELP " + self.name + " " + self.help, "# TYPE " + self.name + " " + self.kind]
+        for suffix, labels, value in self.samples():
+            lines.append(self.name + suffix + format_labels(labels) + " " + format_value(value))
+        return "\n".join(lines)
+
+class Counter(Metric):
+    """
+    Defines a metric that only ever increases
+    A counter given a function reads its values from it when collected instead of storing them
+    The function returns a number, or a dictionary of label value tuples to numbers
+    """
+    kind = "counter"
+
+    def __init__(self, name, help, labels=(), function=None):
+        """
+        Constructor for Counter
+        """
+        super().__init__(name, help, labels)
+        self.values = {}
+        self.function = function
+
+    def inc(self, *labels, amount=1):
+        """
+        Increases the counter of the given label values
+        """
+        self.values[labels] = self.values.get(labels, 0) + amount
+
+    def samples(self):
+        values = self.values
+        if self.function != None:
+            values = self.function()
+            if type(values) != dict:
+                values = { (): values }
+        return [("", self.label_dict(labels), value) for labels, value in sorted(values.items(), key=sort_key)]
+
+class Gauge(Counter):
+    """
+    Defines a metric that can go up and down
+    """
+    kind = "gauge"
+
+    def set(self, value, *labels):
+        """
+        Sets the gauge of the given label values
+        """
+        self.values[labels] = value
+
+class Histogram(Metric):
+    """
+    Defines a metric that counts observed values in buckets
+    """
+    kind = "histogram"
+
+    def __init__(self, name, help, labels=(), buckets=LATENCY_BUCKETS):
+        """
+        Constructor for Histogram
+        """
+        super().__init__(name, help, labels)
+        self.buckets = tuple(buckets)
+        self.values = {} # Maps label value tuples to [bucket counts, sum, count]
+
+    def observe(self, value, *labels):
+        """
+        Records an observed value for the given label values
+        """
+        entry = self.values.get(labels)
+        if entry == None:
+            entry = [[0] * (len(self.buckets) + 1), 0, 0]
+            self.values[labels] = entry
+        entry[0][bisect.bisect_left(self.buckets, value)] += 1
+        entry[1] += value
+        entry[2] += 1
+
+    def cumulative(self, counts):
+        """
+        Returns (upper bound, cumulative count) pairs of a list of bucket counts, ending with +Inf
+        """
+        total, pairs = 0, []
+        for bound, count in zip(self.buckets + (math.inf,), counts):
+            total += count
+            pairs.append((bound, total))
+        return pairs
+
+    def samples(self):
+        samples = []
+        for labels, (counts, total, count) in sorted(self.values.items(), key=sort_key):
+            label_dict = self.label_dict(labels)
+            for bound, cumulative in self.cumulative(counts):
+                samples.append(("_bucket", dict(label_dict, le=format_value(bound)), cumulative))
+            samples.append(("_sum", label_dict, total))
+            samples.append(("_count", label_dict, count))
+        return samples
+
+    def snapshot(self):
+        snapshot = []
+        for labels, (counts, total, count) in sorted(self.values.items(), key=sort_key):
+            buckets = dict([(format_value(bound), cumulative) for bound, cumulative in self.cumulative(counts)])
+            snapshot.append({ "labels": self.label_dict(labels), "count": count, "sum": total, "buckets": buckets })
+        return snapshot
+
+class Registry():
+    """
+    Defines a collection of metrics rendered together
+    """
+    def __init__(self):
+        """
+        Constructor for Registry
+        """
+        self.metrics = {}
+
+    def register(self, metric):
+        """
+        Adds a metric to the registry and returns it
+        """
+        self.metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name, help, labels=(), function=None):
+        """
+        Creates and registers a counter
+        """
+        return self.register(Counter(name, help, labels, function))
+
+    def gauge(self, name, help, labels=(), function=None):
+        """
+        Creates and registers a gauge
+        """
+        return self.register(Gauge(name, help, labels, function))
+
+    def histogram(self, name, help, labels=(), buckets=LATENCY_BUCKETS):
+        """
+        Creates and registers a histogram
+        """
+        return self.register(Histogram(name, help, labels, buckets))
+
+    def render(self):
+        """
+        Returns every metric in the Prometheus text format
+        """
+        return "\n".join([metric.render() for metric in self.metrics.values()]) + "\n"
+
+    def snapshot(self):
+        """
+        Returns a dictionary of every metric's type, help and values
+        """
+        return dict([(name, { "type": metric.kind, "help": metric.help, "values": metric.snapshot() }) for name, metric in self.metrics.items()])
+
+def sort_key(item):
+    """
+    Orders metric values by their label values
+    """
+    return tuple([str(value) for value in item[0]])
+
+def format_labels(labels):
+    """
+    Formats a label dictionary for the Prometheus text format
+    """
+    if len(labels) == 0:
+        return ""
+    escaped = [key + "=\"" + str(value).replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n") + "\"" for key, value in labels.items()]
+    return "{" + ",".join(escaped) + "}"
+
+def format_value(value):
+    """
+    Formats a sample value for the Prometheus text format
+    """
+    if value == math.inf:
+        return "+Inf"
+    if type(value) == float and value.is_integer() and abs(value) < 1e15:
+        return str(int(value))
+    return str(value)
+
+def startup_timings():
+    """
+    Returns the timings of the last server startup keyed by kind and name
+    """
+    return dict([((kind, name), seconds) for kind, timings in profiling.startup.items() for name, seconds in timings.items()])
+
+registry = Registry()
+
+request_seconds = registry.histogram("wssb_request_seconds", "Time taken to process requests by request code", ("code",))
+errors = registry.counter("wssb_errors_total", "Error responses sent by response code", ("code",))
+open_sockets = registry.gauge("wssb_open_sockets", "Open client connections, authenticated or not", function=lambda: len(outbound.queues))
+authenticated_sockets = registry.gauge("wssb_authenticated_sockets", "Authenticated client connections", function=lambda: len(users.connected_sockets))
+online_users = registry.gauge("wssb_online_users", "Users with at least one authenticated connection", function=lambda: len(users.online_users))
+received_bytes = registry.counter("wssb_received_bytes_total", "Size of received frames, text frames are counted in characters")
+sent_bytes = registry.counter("wssb_sent_bytes_total", "Size of sent frames, text frames are counted in characters", function=outbound.sent_bytes)
+rate_limited = registry.counter("wssb_rate_limited_total", "Frames and requests over a rate limit by limit", ("limit",))
+fanout = registry.histogram("wssb_fanout_recipients", "Local connections each response was delivered to", buckets=FANOUT_BUCKETS)
+handler_seconds = registry.histogram("wssb_handler_seconds", "Time taken by plugin views and event handlers", ("plugin", "handler"))
+handler_cpu_seconds = registry.counter("wssb_handler_cpu_seconds_total", "CPU time spent running plugin views and event handlers", ("plugin", "handler"))
+startup_seconds = registry.gauge("wssb_startup_seconds", "Time taken by each phase, plugin import and start handler of the last startup", ("kind", "name"), function=startup_timings)
+
+def snapshot():
+    """
+    Returns every metric and the outbound queue statistics as a dictionary
+    """
+    return { "metrics": registry.snapshot(), "outbound": outbound.stats() }
+
+async def handle_http(reader, writer):
+    """
+    Answers a single HTTP request for the metrics page
+    """
+    try:
+        request_line = await asyncio.wait_for(read_request(reader), HTTP_TIMEOUT)
+        parts = request_line.split()
+        if len(parts) >= 2 and parts[0] == "GET" and parts[1].split("?")[0] in ("/", "/metrics"):
+            status, content_type, body = "200 OK", "text/plain; version=0.0.4; charset=utf-8", registry.render().encode("utf-8")
+        else:
+            status, content_type, body = "404 Not Found", "text/plain; charset=utf-8", b"Not found\n"
+        head = "HTTP/1.1 " + status + "\r\nContent-Type: " + content_type + "\r\nContent-Length: " + str(len(body)) + "\r\nConnection: close\r\n\r\n"
+        writer.write(head.encode("latin-1") + body)
+        await writer.drain()
+    except (asyncio.TimeoutError, asyncio.LimitOverrunError, ValueError, ConnectionError):
+        pass
+    finally:
+        writer.close()
+
+async def read_request(reader):
+    """
+    Reads the headers of an HTTP request
+    Returns the request line
+    """
+    request_line = (await reader.readline()).decode("latin-1")
+    while True:
+        line = await reader.readline()
+        if line in (b"\r\n", b"\n", b""):
+            return request_line
+
+async def serve(address, port):
+    """
+    Starts serving the metrics page over HTTP
+    Returns the server
+    """
+    return await asyncio.start_server(handle_http, address, port)
@@ -0,0 +1,297 @@
+"""
+This script handles the micro-benchmarks of the functions on every message path run by manage.py microbench
+Help for all functionality of this script is available in the documentation
+"""
+
+import asyncio
+import datetime
+import gc
+import json
+import os
+import platform
+import statistics
+import time
+
+from wssb import core
+from wssb import plugins
+from wssb import storage
+from wssb import users
+from wssb import views
+from wssb.events import Events
+from wssb.events import EventHandler
+from wssb.views import Target
+
+SIZES = [10, 1000, 100000] # Default numbers of users and sockets in the synthetic registries, with a tenth as many groups
+GROUPS_PER_USER = 3
+PLUGIN_COUNT = 10 # Plugins handling events while benchmarking handler dispatch
+MIN_TIME = 0.05 # Seconds each timing must last, iterations are scaled up until it does
+REPEAT = 15 # Timings taken of each benchmark, the median is kept
+MIN_DIFFERENCE = 100 # Nanoseconds a benchmark must slow down by before it is flagged, so sub-microsecond noise is ignored
+RECHECKS = 2 # Times flagged benchmarks are measured again before they are reported
+STATISTIC = "median" # Statistic stored in baselines, baselines measured another way are not compared
+
+class MemoryStore(storage.Store):
+    """
+    Defines a store holding synthetic users and groups in memory
+    """
+    def __init__(self, size):
+        """
+        Constructor for MemoryStore
+        """
+        group_count = max(1, size // 10)
+        self.group_records = {}
+        for i in range(group_count):
+            self.group_records["group-" + str(i)] = storage.group_record(["bench.group." + str(i), "wssb.plugin" + str(i % PLUGIN_COUNT)])
+        self.user_records = {}
+        for i in range(size):
+            groups = ["group-" + str((i + j) % group_count) for j in range(GROUPS_PER_USER)]
+            self.user_records["user-" + str(i)] = storage.user_record(groups, ["bench.user." + str(i)])
+
+    def open(self):
+        return True
+
+    def groups(self):
+        return self.group_records.items()
+
+    def users(self):
+        return self.user_records.items()
+
+    def get_group(self, group_name):
+        return self.group_records.get(group_name)
+
+    def get_user(self, user_name):
+        return self.user_records.get(user_name)
+
+class FakeSocket():
+    """
+    Defines a stand-in for a client connection that is only used as a registry key
+    """
+    def __init__(self, index):
+        """
+        Constructor for FakeSocket
+        """
+        self.index = index
+
+class MicrobenchPlugin(plugins.WSSBPlugin):
+    """
+    Defines a plugin that answers a request code and handles authentication events without doing any work
+    """
+    def __init__(self, index):
+        """
+        Constructor for MicrobenchPlugin
+        """
+        super().__init__("microbench" + str(index), "1.0.0", "WSSB", [], True)
+        self.register_handler(EventHandler(Events.USER_AUTHENTICATED, self.on_auth))
+        self.add_route("microbench" + str(index), self.view_bench)
+
+    def on_auth(self, context):
+        return None
+
+    def view_bench(self, context):
+        return self.resp(views.success("MICROBENCH", "ok"), Target.source())
+
+def build_registry(size):
+    """
+    Replaces the user registry with a synthetic one and registers one socket per user
+    Returns the list of sockets
+    """
+    users.store = MemoryStore(size)
+    users.registered_users.clear()
+    users.registered_groups.clear()
+    users.user_cache.clear()
+    users.socket_users.clear()
+    users.online_users.clear()
+    users.group_sockets.clear()
+    users.group_users.clear()
+    users.reload_all()
+    sockets = []
+    for i in range(size):
+        sockets.append(FakeSocket(i))
+        users.register_socket("user-" + str(i), sockets[-1])
+    return sockets
+
+def install_plugins():
+    """
+    Installs the benchmark plugins in place of any loaded plugins
+    Returns the installed plugins
+    """
+    plugins.plugins = []
+    plugins.routes = {}
+    plugins.fallback_plugins = []
+    created = [MicrobenchPlugin(i) for i in range(PLUGIN_COUNT)]
+    plugins.install(created)
+    return created
+
+def remove_plugins(created):
+    """
+    Removes the data folders the benchmark plugins created
+    """
+    for pl in created:
+        if os.path.isdir(pl.path) and len(os.listdir(pl.path)) == 0:
+            os.rmdir(pl.path)
+
+def measure(action):
+    """
+    Returns the median time per call of an action in nanoseconds
+    The action is given a number of iterations to run
+    Garbage collection is paused while timing so collections do not land on random benchmarks
+    """
+    gc.collect()
+    gc_enabled = gc.isenabled()
+    gc.disable()
+    try:
+        return median(action)
+    finally:
+        if gc_enabled:
+            gc.enable()
+
+def median(action):
+    """
+    Scales the iterations until a timing lasts MIN_TIME, then returns the median of REPEAT timings per call
+    """
+    number = 1
+    while True:
+        start = time.perf_counter()
+        action(number)
+        elapsed = time.perf_counter() - start
+        if elapsed >= MIN_TIME:
+            break
+        number *= 10 if elapsed < MIN_TIME / 10 else 2
+    timings = [elapsed]
+    for i in range(REPEAT - 1):
+        start = time.perf_counter()
+        action(number)
+        timings.append(time.perf_counter() - start)
+    return statistics.median(timings) * 1e9 / number
+
+def repeat(function, *args):
+    """
+    Returns an action calling a function with the given arguments
+    """
+    def action(number):
+        for i in range(number):
+            function(*args)
+    return action
+
+def repeat_async(loop, function, *args):
+    """
+    Returns an action awaiting a coroutine function with the given arguments in an event loop
+    """
+    async def run(number):
+        for i in range(number):
+            await function(*args)
+    return lambda number: loop.run_until_complete(run(number))
+
+def benchmarks(size, sockets, loop):
+    """
+    Returns the named actions to time against a registry of the given size
+    """
+    middle = size // 2
+    user = users.find_user("user-" + str(middle))
+    socket = sockets[middle]
+    request = { "type": "request", "code": "microbench0" }
+    packet = views.success("MICROBENCH", "ok")
+    batch = [packet] * 10
+    frame, batch_frame = views.format_packet(packet), views.format_packet(batch)
+    return [
+        ("core.get_target_conns.all", repeat(core.get_target_conns, { "target": Target.all() }, socket)),
+        ("core.get_target_conns.source", repeat(core.get_target_conns, { "target": Target.source() }, socket)),
+        ("core.get_target_conns.user", repeat(core.get_target_conns, { "target": Target.user(user) }, socket)),
+        ("core.get_target_conns.group", repeat(core.get_target_conns, { "target": Target.group(user.groups[0]) }, socket)),
+        ("users.perm_is_child", repeat(users.perm_is_child, "bench.group", "bench.group." + str(middle))),
+        ("User.has_permission.granted", repeat(user.has_permission, "bench.user." + str(middle) + ".child")),
+        ("User.has_permission.denied", repeat(user.has_permission, "wssb.stop")),
+        ("users.find_user.hit", repeat(users.find_user, "user-" + str(middle))),
+        ("users.find_user.miss", repeat(users.find_user, "nobody")),
+        ("views.parse_packet", repeat(views.parse_packet, frame)),
+        ("views.parse_packet.batch", repeat(views.parse_packet, batch_frame)),
+        ("views.format_packet", repeat(views.format_packet, packet)),
+        ("views.format_packet.batch", repeat(views.format_packet, batch)),
+        ("plugins.handle", repeat_async(loop, plugins.handle, request, user)),
+        ("plugins.trigger_handlers", repeat_async(loop, plugins.trigger_handlers, Events.USER_AUTHENTICATED, { "user": user, "socket": socket })),
+    ]
+
+def run_all(sizes, only=None, on_result=None, keys=None):
+    """
+    Times every benchmark against registries of each size
+    Benchmarks can be limited to names starting with one of the given prefixes, or to a set of benchmark keys
+    Returns a dictionary of benchmark keys to nanoseconds per call, each result is also passed to on_result
+    """
+    results = {}
+    created = install_plugins()
+    loop = asyncio.new_event_loop()
+    try:
+        for size in sizes:
+            sockets = build_registry(size)
+            for name, action in benchmarks(size, sockets, loop):
+                if only != None and not any([name.startswith(prefix) for prefix in only]):
+                    continue
+                key = name + "[" + str(size) + "]"
+                if keys != None and key not in keys:
+                    continue
+                results[key] = round(measure(action), 1)
+                if on_result != None:
+                    on_result(key, results[key])
+    finally:
+        loop.close()
+        remove_plugins(created)
+    return results
+
+def compare(results, baseline, threshold, min_difference=MIN_DIFFERENCE):
+    """
+    Compares results with a baseline
+    Returns a list of (key, baseline, result, ratio) for every benchmark slower than the baseline
+    by more than the threshold ratio and by more than min_difference nanoseconds
+    """
+    regressions = []
+    for key, result in results.items():
+        expected = baseline.get(key)
+        if expected != None and expected > 0 and result / expected > 1 + threshold and result - expected > min_difference:
+            regressions.append((key, expected, result, result / expected))
+    return regressions
+
+def recheck(results, baseline, threshold, min_difference=MIN_DIFFERENCE, rechecks=RECHECKS):
+    """
+    Compares results with a baseline, measuring flagged benchmarks again and keeping their faster result
+    A burst of noise during one measurement is not reported unless it repeats in every recheck
+    Returns the regressions that are left
+    """
+    regressions = compare(results, baseline, threshold, min_difference)
+    for i in range(rechecks):
+        if len(regressions) == 0:
+            break
+        keys = set([key for key, expected, result, ratio in regressions])
+        sizes = sorted(set([int(key.rsplit("[", 1)[1][:-1]) for key in keys]))
+        for key, result in run_all(sizes, keys=keys).items():
+            results[key] = min(results[key], result)
+        regressions = compare(results, baseline, threshold, min_difference)
+    return regressions
+
+def read_baseline(path):
+    """
+    Returns the benchmark results stored in a baseline file
+    Baselines are machine specific, so they are not committed and are created with manage.py microbench --save-baseline
+    Returns None if the file does not exist or was measured with another statistic
+    """
+    if not os.path.exists(path):
+        return None
+    with open(path) as f:
+        baseline = json.load(f)
+    if baseline.get("statistic") != STATISTIC:
+        return None
+    return baseline["results"]
+
+def write_baseline(path, results):
+    """
+    Stores benchmark results and the environment they were measured in as a baseline file
+    """
+    baseline = {
+        "created": datetime.datetime.now().isoformat(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "statistic": STATISTIC,
+        "repeat": REPEAT,
+        "results": results,
+    }
+    with open(path, "w") as f:
+        json.dump(baseline, f, indent=4, sort_keys=True)
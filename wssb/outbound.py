@@ -0,0 +1,236 @@
+"""
+This script handles the bounded outbound frame queues of every connected socket
+Help for all functionality of this script is available in the documentation
+"""
+
+import asyncio
+import collections
+import websockets.exceptions
+
+from wssb import config
+from wssb import log
+
+DROP_OLDEST = "drop_oldest"
+DROP_NEWEST = "drop_newest"
+DISCONNECT = "disconnect"
+
+POLICIES = (DROP_OLDEST, DROP_NEWEST, DISCONNECT)
+
+class CloseFrame():
+    """
+    Defines a queued request to close a socket once all frames before it have been sent
+    """
+    def __init__(self, code=1000, reason=""):
+        """
+        Constructor for CloseFrame
+        """
+        self.code, self.reason = code, reason
+
+class OutboundQueue():
+    """
+    Defines a bounded queue of frames waiting to be written to a single socket
+    Frames are written in order by a dedicated writer task
+    """
+    def __init__(self, socket, max_size, policy):
+        """
+        Constructor for OutboundQueue
+        Starts the writer task on the running event loop
+        """
+        self.socket, self.max_size, self.policy = socket, max_size, policy
+        self.frames = collections.deque()
+        self.ready = asyncio.Event()
+        self.empty = asyncio.Event()
+        self.empty.set()
+        self.closing = False
+        self.sent, self.dropped, self.high_water = 0, 0, 0
+        self.sent_bytes = 0
+        self.task = asyncio.create_task(self.drain())
+
+    def depth(self):
+        """
+        Returns the number of frames waiting to be sent
+        """
+        return len(self.frames)
+
+    def put(self, frame):
+        """
+        Queues a frame to be sent, applying the overflow policy if the queue is full
+        Returns True if the frame was queued
+        """
+        if self.closing:
+            self.dropped += 1
+            return False
+        if len(self.frames) >= self.max_size:
+            if self.policy == DROP_NEWEST:
+                self.dropped += 1
+                return False
+            elif self.policy == DROP_OLDEST:
+                self.frames.popleft()
+                self.dropped += 1
+            else:
+                self.dropped += len(self.frames) + 1
+                self.frames.clear()
+                self.abort(1008, "Outbound queue overflow")
+                return False
+        self.frames.append(frame)
+        self.high_water = max(self.high_water, len(self.frames))
+        self.empty.clear()
+        self.ready.set()
+        return True
+
+    def close(self, code=1000, reason=""):
+        """
+        Closes the socket once every frame already queued has been sent
+        """
+        if not self.closing:
+            self.closing = True
+            self.frames.append(CloseFrame(code, reason))
+            self.empty.clear()
+            self.ready.set()
+
+    def abort(self, code, reason):
+        """
+        Drops all queued frames and closes the socket immediately
+        Used when the peer is not reading fast enough to keep up
+        """
+        self.closing = True
+        self.frames.clear()
+        self.task.cancel()
+        self.empty.set()
+        task = asyncio.create_task(self.socket.close(code, reason))
+        closing_tasks.add(task)
+        task.add_done_callback(closing_tasks.discard)
+        log.warning("SERVER", "Disconnected a slow consumer with a full outbound queue", event="slow_consumer", console=False)
+
+    async def drain(self):
+        """
+        Writes queued frames to the socket until it closes
+        """
+        try:
+            while True:
+                if len(self.frames) == 0:
+                    self.empty.set()
+                    self.ready.clear()
+                    await self.ready.wait()
+                    continue
+                frame = self.frames.popleft()
+                if type(frame) == CloseFrame:
+                    self.frames.clear()
+                    await self.socket.close(frame.code, frame.reason)
+                    return
+                await self.socket.send(frame)
+                self.sent += 1
+                self.sent_bytes += len(frame)
+        except websockets.exceptions.ConnectionClosed:
+            pass
+        finally:
+            self.frames.clear()
+            self.empty.set()
+
+queues = {} # Maps every connected socket to its outbound queue
+closing_tasks = set() # Keeps references to pending slow consumer disconnects
+totals = { "sent": 0, "dropped": 0, "sent_bytes": 0 } # Frame counts and sizes of queues that have been detached
+
+max_size = 256
+policy = DROP_OLDEST
+
+def configure(size, overflow_policy):
+    """
+    Sets the outbound queue size and overflow policy for all current and future sockets
+    """
+    global max_size, policy
+
+    if overflow_policy not in POLICIES:
+        log.error("SERVER", "Unknown outbound queue policy '" + overflow_policy + "', using '" + DROP_OLDEST + "'", console=False)
+        overflow_policy = DROP_OLDEST
+    max_size, policy = max(1, size), overflow_policy
+    for queue in queues.values():
+        queue.max_size, queue.policy = max_size, policy
+
+def load_config():
+    """
+    Applies the outbound queue options from the global server config
+    """
+    general = config.global_config()["GENERAL"]
+    configure(int(general["outbound_queue_size"]), general["outbound_queue_policy"])
+
+def attach(socket):
+    """
+    Creates the outbound queue for a newly connected socket
+    """
+    queues[socket] = OutboundQueue(socket, max_size, policy)
+    return queues[socket]
+
+def detach(socket):
+    """
+    Removes the outbound queue of a disconnected socket and stops its writer task
+    """
+    queue = queues.pop(socket, None)
+    if queue != None:
+        queue.task.cancel()
+        totals["sent"] += queue.sent
+        totals["dropped"] += queue.dropped
+        totals["sent_bytes"] += queue.sent_bytes
+
+def send(socket, frame):
+    """
+    Queues a frame to be sent to a single socket
+    Returns True if the frame was queued
+    """
+    queue = queues.get(socket)
+    if queue != None:
+        return queue.put(frame)
+    return False
+
+def broadcast(sockets, frame):
+    """
+    Queues the same frame to be sent to every socket given
+    Returns the number of sockets the frame was queued for
+    """
+    count = 0
+    for socket in sockets:
+        if send(socket, frame):
+            count += 1
+    return count
+
+def close(socket, code=1000, reason=""):
+    """
+    Closes a socket after all of its queued frames have been sent
+    """
+    queue = queues.get(socket)
+    if queue != None:
+        queue.close(code, reason)
+
+async def flush_all(timeout):
+    """
+    Waits until every outbound queue has been emptied or the timeout expires
+    """
+    waiters = [queue.empty.wait() for queue in queues.values()]
+    if len(waiters) > 0:
+        try:
+            await asyncio.wait_for(asyncio.gather(*waiters), timeout)
+        except asyncio.TimeoutError:
+            pass
+
+def sent_bytes():
+    """
+    Returns the total size of all frames sent, text frames are counted in characters
+    """
+    return totals["sent_bytes"] + sum([queue.sent_bytes for queue in queues.values()])
+
+def stats():
+    """
+    Returns a dictionary of outbound queue depth statistics
+    """
+    depths = [queue.depth() for queue in queues.values()]
+    return {
+        "connections": len(depths),
+        "queued": sum(depths),
+        "max_depth": max(depths) if len(depths) > 0 else 0,
+        "high_water": max([queue.high_water for queue in queues.values()], default=0),
+        "sent": totals["sent"] + sum([queue.sent for queue in queues.values()]),
+        "dropped": totals["dropped"] + sum([queue.dropped for queue in queues.values()]),
+        "sent_bytes": sent_bytes(),
+        "max_size": max_size,
+        "policy": policy,
+    }
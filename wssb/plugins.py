@@ -3,16 +3,21 @@ This script handles the loading, processing, and managing of installed server pl
 Help for all functionality of this script is available in the documentation
 """
 
-import logging
 import pathlib
 import os
 import importlib.util
 import inspect
+import asyncio
+import json
+import time
 
 import pathlib
 import os
 
 from wssb import events
+from wssb import log
+from wssb import metrics
+from wssb import profiling
 from wssb.events import Events
 
 class WSSBPlugin():
@@ -27,6 +32,7 @@ class WSSBPlugin():
         self.name, self.version_str, self.author, self.dependencies, self.quiet = name.lower(), version_str, author, dependencies, quiet
         self.handlers = []
         self.routes = {}
+        self.file = None
 
         env_root = str(pathlib.Path(__file__).parent.parent.absolute())
         if not os.path.exists(env_root + "/plugins/" + name.lower()):
@@ -56,45 +62,45 @@ class WSSBPlugin():
     def add_route(self, request_name, view):
         """
         Adds a specific view that a request should be routed to
-        Request names must be unique per plugin
+        Request names must be unique across the core and all plugins
+        Returns False if the request name is already owned elsewhere
         """
+        if not register_route(request_name, self):
+            return False
         self.routes[request_name] = view
+        return True
 
-    def process_request(self, request, user):
+    async def process_request(self, request, user):
         """
         Processes a command by routing it to the correct view
         """
         if request["code"] in self.routes:
-            return self.routes[request["code"]]({"request": request, "user": user})
+            return await call(self.routes[request["code"]], {"request": request, "user": user})
         return None
 
     def qprint(self, s):
         """
         Prints a message if quiet mode is disabled
         """
-        if not self.quiet:
-            print(s)
+        log.echo(s)
 
     def info(self, s):
         """
         Logs an informative plugin message
         """
-        logging.info("[" + self.name + "] " + s)
-        self.qprint("[" + self.name + "] " + s)
+        log.info(self.name, s)
 
     def warning(self, s):
         """
         Logs an warning plugin message
         """
-        logging.warning("[" + self.name + "] " + s)
-        self.qprint("[" + self.name + "] " + s)
+        log.warning(self.name, s)
 
     def error(self, s):
         """
         Logs an error plugin message
         """
-        logging.error("[" + self.name + "] " + s)
-        self.qprint("[" + self.name + "] " + s)
+        log.error(self.name, s)
 
     def register_handler(self, handler):
         """
@@ -114,47 +120,207 @@ class WSSBPlugin():
 
 plugins = []
 
-def trigger_conditional_handlers(type, context):
+routes = {} # Maps request codes to the plugin that owns them
+reserved_routes = set() # Request codes handled by the server core
+fallback_plugins = [] # Plugins that override process_request instead of using routes
+plugin_files = {} # Maps loaded plugin files to their modification time when they were loaded
+replacing = [] # Plugins being replaced by a reload, their request codes can be claimed by the new plugins
+reload_lock = asyncio.Lock() # Serializes single plugin reloads
+staged_routes = None # Request codes claimed by plugins being loaded by a reload, installed once they have started
+
+MANIFEST_FILE = ".manifest.json"
+manifest = {} # Maps plugin file names to their modification time and the cached description of their plugins
+deferred = {} # Maps names of plugins that have not been imported yet to their plugin file
+deferred_routes = {} # Maps request codes of deferred plugins to their plugin file
+deferred_events = {} # Maps event type names to the files of deferred plugins that handle them
+deferred_quiet = False
+
+def reserve_routes(codes):
     """
-    Triggers all plugin conditional event handlers that match the type given
+    Marks request codes as owned by the server core so plugins cannot claim them
     """
-    global plugins
+    reserved_routes.update(codes)
+
+def register_route(code, plugin):
+    """
+    Registers a plugin as the owner of a request code
+    Returns False and logs the conflict if the code is already owned by the core or another plugin
+    """
+    if code in reserved_routes:
+        log.error("SERVER", "Plugin \'" + plugin.name + "\' cannot claim core request code \'" + code + "\'")
+        return False
+    owner = routes.get(code)
+    if owner != None and any([owner is old for old in replacing]):
+        owner = None
+    if owner == None and staged_routes != None:
+        owner = staged_routes.get(code)
+    if owner != None and owner is not plugin:
+        log.error("SERVER", "Plugin \'" + plugin.name + "\' cannot claim request code \'" + code + "\' owned by plugin \'" + owner.name + "\'")
+        return False
+    if staged_routes != None and not any([plugin is installed for installed in plugins]):
+        staged_routes[code] = plugin
+    else:
+        routes[code] = plugin
+    return True
+
+def threaded(action):
+    """
+    Marks a synchronous view or event handler action to be run in a thread-pool executor
+    Should be used for actions that block on disk, network, or heavy computation
+    """
+    action.wssb_threaded = True
+    return action
+
+def begin_call(action, context):
+    """
+    Starts a view or event handler action
+    Synchronous actions are run inline and their result is returned
+    Coroutine and threaded actions return an awaitable of their result
+    """
+    if getattr(action, "wssb_threaded", False):
+        return threaded_call(action, context)
+    start = time.perf_counter()
+    result, cpu = profiling.thread_timed(action, context)
+    if inspect.isawaitable(result):
+        return finish_call(action, result, start, cpu)
+    record_call(action, time.perf_counter() - start, cpu)
+    return result
+
+async def threaded_call(action, context):
+    """
+    Runs a synchronous action in the default executor
+    """
+    start = time.perf_counter()
+    result, cpu = await asyncio.get_running_loop().run_in_executor(None, profiling.thread_timed, action, context)
+    if inspect.isawaitable(result):
+        return await finish_call(action, result, start, cpu)
+    record_call(action, time.perf_counter() - start, cpu)
+    return result
+
+async def finish_call(action, awaitable, start, cpu):
+    """
+    Awaits the result of an action that returned an awaitable
+    """
+    timer = profiling.StepTimer(awaitable)
+    result = await timer
+    record_call(action, time.perf_counter() - start, cpu + timer.cpu)
+    return result
+
+def record_call(action, wall, cpu):
+    """
+    Records the wall and CPU time of a call by plugin and action
+    """
+    labels = action_labels(action)
+    metrics.handler_seconds.observe(wall, *labels)
+    metrics.handler_cpu_seconds.inc(*labels, amount=cpu)
+    profiling.record_handler(labels, wall, cpu)
+
+async def call(action, context):
+    """
+    Runs a view or event handler action without blocking the event loop
+    Coroutine actions are awaited, threaded actions are run in the default executor
+    The wall and CPU time of every call is recorded by plugin and action
+    """
+    result = begin_call(action, context)
+    if inspect.isawaitable(result):
+        result = await result
+    return result
 
+async def run_all(calls):
+    """
+    Collects the results of started calls and awaits the ones still pending concurrently
+    Calls are started as the iterable is consumed, synchronous ones finish inline without creating tasks
+    Returns the results in the order the calls were started
+    """
     results = []
+    try:
+        for result in calls:
+            results.append(result)
+    except Exception:
+        await asyncio.gather(*[result for result in results if inspect.isawaitable(result)], return_exceptions=True)
+        raise
+    pending = [i for i, result in enumerate(results) if inspect.isawaitable(result)]
+    if len(pending) == 1:
+        results[pending[0]] = await results[pending[0]]
+    elif len(pending) > 1:
+        for i, result in zip(pending, await asyncio.gather(*[results[i] for i in pending])):
+            results[i] = result
+    return results
+
+def action_labels(action):
+    """
+    Returns the names of the plugin owning a view or event handler action and of the action itself
+    """
+    owner = getattr(action, "__self__", None)
+    name = getattr(action, "__name__", str(action))
+    if isinstance(owner, WSSBPlugin):
+        return owner.name, name
+    return "", name
 
-    for plugin in plugins:
-        for handler in plugin.handlers:
-            if handler.type == type:
-                results.append(handler.action(context))
+def matching_handlers(type, only=None):
+    """
+    Returns all plugin event handlers that match the type given
+    If a list of plugins is given only their handlers are returned
+    Deferred plugins handling the type are imported first
+    """
+    if only == None and type.name in deferred_events:
+        for plugin_path in list(deferred_events[type.name]):
+            load_deferred(plugin_path)
+    return [handler for plugin in (plugins if only == None else only) for handler in plugin.handlers if handler.type == type]
 
-    return all(results)
+def handler_name(handler):
+    """
+    Returns a readable name for an event handler, such as plugin.on_start
+    """
+    plugin_name, name = action_labels(handler.action)
+    if plugin_name != "":
+        return plugin_name + "." + name
+    return name
 
-def trigger_handlers(type, context):
+async def timed_call(handler, context):
     """
-    Triggers all non-conditional plugin event handlers that match the type given
+    Runs an event handler action and records its wall time as a startup timing
     """
-    global plugins
+    with profiling.timed(profiling.HANDLERS, handler_name(handler)):
+        return await call(handler.action, context)
 
-    responses = []
-    for plugin in plugins:
-        for handler in plugin.handlers:
-            if handler.type == type:
-                response = handler.action(context)
-                if response != None:
-                    responses.append(response)
+async def trigger_conditional_handlers(type, context, only=None):
+    """
+    Triggers all plugin conditional event handlers that match the type given
+    Synchronous handlers are run inline and the others concurrently
+    Their wall times are recorded while the server is starting
+    """
+    if profiling.recording:
+        results = await asyncio.gather(*[timed_call(handler, context) for handler in matching_handlers(type, only)])
+    else:
+        results = await run_all(begin_call(handler.action, context) for handler in matching_handlers(type, only))
+    return all(results)
 
-    return responses
+async def trigger_handlers(type, context, only=None):
+    """
+    Triggers all non-conditional plugin event handlers that match the type given
+    Synchronous handlers are run inline and the others concurrently
+    Responses are returned in registration order
+    """
+    results = await run_all(begin_call(handler.action, context) for handler in matching_handlers(type, only))
+    return [response for response in results if response != None]
 
-def handle(request, user):
+async def handle(request, user):
     """
-    Attempts to route a request to all custom plugins
+    Routes a request to the plugin that owns its request code
+    Plugins with a custom process_request are only tried when no plugin owns the code
     """
-    responses = []
-    for plugin in plugins:
-        response = plugin.process_request(request, user)
-        if response != None:
-            responses.append(response)
-    return responses
+    owner = routes.get(request["code"])
+    if owner == None and request["code"] in deferred_routes:
+        load_deferred(deferred_routes[request["code"]])
+        owner = routes.get(request["code"])
+    if owner != None:
+        result = owner.process_request(request, user)
+        if inspect.isawaitable(result):
+            result = await result
+        return [result] if result != None else []
+    results = await run_all(plugin.process_request(request, user) for plugin in fallback_plugins)
+    return [response for response in results if response != None]
 
 def get():
     """
@@ -163,52 +329,355 @@ def get():
     global plugins
     return plugins
 
-def reload_all(quiet):
+async def reload_all(quiet):
     """
     Reloads all server plugins
     """
-    global plugins
+    global plugins, routes, fallback_plugins, plugin_files, deferred, deferred_routes, deferred_events
 
     plugins = []
+    routes = {}
+    fallback_plugins = []
+    plugin_files = {}
+    deferred, deferred_routes, deferred_events = {}, {}, {}
     autogen_folder(True)
 
-    if load_all(quiet):
-        trigger_conditional_handlers(Events.SERVER_START, None)
+    if load_all(quiet, lazy=True):
+        await trigger_conditional_handlers(Events.SERVER_START, None)
+        update_manifest()
         return True
     return False
 
+def plugins_folder():
+    """
+    Returns the path of the plugins folder
+    """
+    return str(pathlib.Path(__file__).parent.parent.absolute()) + "/plugins/"
+
+def load_module(plugin_path):
+    """
+    Executes a plugin file and returns its module
+    """
+    spec = importlib.util.spec_from_file_location("wssb.plugins", plugin_path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+def create_plugins(module, plugin_path, quiet):
+    """
+    Creates an instance of every plugin class defined in a plugin module
+    """
+    created = []
+    for name, cls in inspect.getmembers(module):
+        if inspect.isclass(cls) and issubclass(cls, WSSBPlugin):
+            pl = cls(quiet)
+            pl.file = plugin_path
+            created.append(pl)
+    return created
+
+def overrides_process_request(plugin):
+    """
+    Returns True if a plugin handles requests with its own process_request instead of routes
+    """
+    return type(plugin).process_request is not WSSBPlugin.process_request
 
-def load_all(quiet):
+def check_dependencies(quiet, only=None):
+    """
+    Returns False and logs the first plugin that is missing one of its dependencies
+    If a list of plugins is given only their dependencies are checked
+    """
+    for plugin in (plugins if only == None else only):
+        for dep in plugin.dependencies:
+            if find_loaded(dep) == None and dep not in deferred:
+                log.error("SERVER", "FATAL: Plugin \'" + plugin.name + "\' is missing its dependency \'" + dep + "\'")
+                return False
+    return True
+
+def load_all(quiet, lazy=False):
     """
     Attempts to load all RDK3Plugins available in the plugins directory
+    In lazy mode, plugin files the manifest describes as not needed at startup are only imported
+    once one of their request codes or event types is used
     """
-    global plugins
-    plugins_folder = str(pathlib.Path(__file__).parent.parent.absolute()) + "/plugins/"
-    for file_name in os.listdir(plugins_folder):
+    global plugins, manifest, deferred_quiet
+    folder = plugins_folder()
+    manifest = read_manifest()
+    deferred_quiet = quiet
+    for file_name in os.listdir(folder):
+        if file_name.endswith(".py"):
+            plugin_path = folder + file_name
+            plugin_files[plugin_path] = os.stat(plugin_path).st_mtime_ns
+            entry = manifest.get(file_name)
+            if lazy and entry != None and entry["mtime"] == plugin_files[plugin_path] and can_defer(entry):
+                defer(plugin_path, entry)
+                continue
+            with profiling.timed(profiling.PLUGINS, file_name):
+                install(create_plugins(load_module(plugin_path), plugin_path, quiet))
+    return check_dependencies(quiet)
+
+def install(created):
+    """
+    Adds newly created plugins to the list of loaded plugins
+    """
+    for pl in created:
+        if find_loaded(pl.name) == None and deferred.get(pl.name, pl.file) == pl.file: # <- Makes sure plugin with same name does not exist
+             plugins.append(pl)
+             if overrides_process_request(pl):
+                 fallback_plugins.append(pl)
+
+def can_defer(entry):
+    """
+    Returns True if the plugins of a manifest entry do not have to be imported at startup
+    Plugins that handle server start or process requests without routes are always imported,
+    so the bundled plugins are never deferred and only plugins without start handlers benefit
+    """
+    return len(entry["plugins"]) > 0 and all([not pl["fallback"] and Events.SERVER_START.name not in pl["events"] for pl in entry["plugins"]])
+
+def defer(plugin_path, entry):
+    """
+    Registers the plugins of a plugin file to be imported once they are first needed
+    """
+    for pl in entry["plugins"]:
+        if find_loaded(pl["name"]) != None or pl["name"] in deferred:
+            continue
+        deferred[pl["name"]] = plugin_path
+        for code in pl["routes"]:
+            deferred_routes.setdefault(code, plugin_path)
+        for event in pl["events"]:
+            deferred_events.setdefault(event, set()).add(plugin_path)
+
+def undefer(plugin_path):
+    """
+    Removes the deferred entries of a plugin file
+    Returns True if the file was deferred
+    """
+    global deferred, deferred_routes, deferred_events
+
+    found = plugin_path in deferred.values()
+    deferred = dict([(name, path) for name, path in deferred.items() if path != plugin_path])
+    deferred_routes = dict([(code, path) for code, path in deferred_routes.items() if path != plugin_path])
+    for paths in deferred_events.values():
+        paths.discard(plugin_path)
+    deferred_events = dict([(event, paths) for event, paths in deferred_events.items() if len(paths) > 0])
+    return found
+
+def load_deferred(plugin_path):
+    """
+    Imports a deferred plugin file and adds its plugins
+    """
+    if not undefer(plugin_path):
+        return
+    try:
+        install(create_plugins(load_module(plugin_path), plugin_path, deferred_quiet))
+    except Exception:
+        log.exception("SERVER", "Could not load deferred plugin file \'" + plugin_path + "\'")
+        return
+    log.info("SERVER", "Loaded deferred plugin file \'" + os.path.basename(plugin_path) + "\'", console=False)
+
+def describe(plugin):
+    """
+    Returns the manifest description of a plugin
+    """
+    return {
+        "name": plugin.name,
+        "version": plugin.version_str,
+        "author": plugin.author,
+        "dependencies": list(plugin.dependencies),
+        "routes": sorted(plugin.routes),
+        "events": sorted(set([handler.type.name for handler in plugin.handlers])),
+        "fallback": overrides_process_request(plugin),
+    }
+
+def read_manifest():
+    """
+    Reads the cached plugin manifest
+    Returns an empty manifest if it does not exist or cannot be read
+    """
+    try:
+        with open(plugins_folder() + MANIFEST_FILE) as manifest_file:
+            cached = json.load(manifest_file)
+    except (OSError, ValueError):
+        return {}
+    return cached if type(cached) == dict else {}
+
+def save_manifest(entries):
+    """
+    Atomically writes the plugin manifest if it changed
+    """
+    global manifest
+
+    if entries == manifest:
+        return False
+    manifest = entries
+    path = plugins_folder() + MANIFEST_FILE
+    temp_path = path + "." + str(os.getpid()) + ".tmp"
+    try:
+        with open(temp_path, "w") as manifest_file:
+            json.dump(entries, manifest_file, indent=4, sort_keys=True)
+        os.replace(temp_path, path)
+    except OSError:
+        log.exception("SERVER", "Could not write the plugin manifest", console=False)
+        return False
+    return True
+
+def update_manifest():
+    """
+    Updates the manifest with the description of every loaded plugin
+    Deferred plugin files keep their cached description
+    """
+    entries = {}
+    for plugin_path, mtime in plugin_files.items():
+        file_name = os.path.basename(plugin_path)
+        if plugin_path in deferred.values():
+            entries[file_name] = manifest[file_name]
+        else:
+            entries[file_name] = { "mtime": mtime, "plugins": [describe(pl) for pl in plugins if pl.file == plugin_path] }
+    return save_manifest(entries)
+
+def describe_all(quiet):
+    """
+    Returns the descriptions of all available plugins
+    Only plugin files changed since the manifest was written are imported
+    """
+    global manifest
+
+    folder = plugins_folder()
+    manifest = read_manifest()
+    entries = {}
+    for file_name in sorted(os.listdir(folder)):
         if file_name.endswith(".py"):
-            plugin_path = plugins_folder + file_name
-            spec = importlib.util.spec_from_file_location("wssb.plugins", plugin_path)
-            module = importlib.util.module_from_spec(spec)
-            spec.loader.exec_module(module)
-            plugin_class = None
-            for name, cls in inspect.getmembers(module):
-                if inspect.isclass(cls) and issubclass(cls, WSSBPlugin):
-                    pl = cls(quiet)
-                    if find(pl.name) == None: # <- Makes sure plugin with same name does not exist
-                         plugins.append(pl)
+            plugin_path = folder + file_name
+            mtime = os.stat(plugin_path).st_mtime_ns
+            entry = manifest.get(file_name)
+            if entry == None or entry["mtime"] != mtime:
+                entry = { "mtime": mtime, "plugins": [describe(pl) for pl in create_plugins(load_module(plugin_path), plugin_path, quiet)] }
+            entries[file_name] = entry
+    save_manifest(entries)
+    described = []
+    for entry in entries.values():
+        for pl in entry["plugins"]:
+            if not any([other["name"] == pl["name"] for other in described]):
+                described.append(pl)
+    return described
+
+async def reload_plugin(name, quiet):
+    """
+    Reloads a single plugin and every other plugin defined in the same file
+    Returns False if the plugin does not exist or could not be reloaded
+    """
+    plugin = find(name)
+    if plugin == None or plugin.file == None:
+        return False
+    return await reload_file(plugin.file, quiet)
+
+async def reload_file(plugin_path, quiet):
+    """
+    Loads, reloads, or unloads the plugins defined in a single plugin file
+    Only the plugins of that file are stopped and started, all other plugins keep their state
+    The new plugins are started before their routes and handlers replace the old ones in a single step
+    Returns False if the file could not be loaded, in which case the old plugins are kept
+    """
+    async with reload_lock:
+        return await swap_file(plugin_path, quiet)
+
+async def swap_file(plugin_path, quiet):
+    """
+    Replaces the plugins of a single plugin file, should only be called through reload_file
+    """
+    global plugins, routes, fallback_plugins, replacing, staged_routes
+
+    old = [plugin for plugin in plugins if plugin.file == plugin_path]
+    module = None
+    if os.path.exists(plugin_path):
+        mtime = os.stat(plugin_path).st_mtime_ns
+        try:
+            module = load_module(plugin_path)
+        except Exception:
+            log.exception("SERVER", "Could not load plugin file \'" + plugin_path + "\'")
+            return False
+    undefer(plugin_path)
+
+    await trigger_handlers(Events.SERVER_STOP, None, old)
+
+    # Create and start the new plugins while the old ones still own their request codes
+    started = False
+    replacing, staged_routes = old, {}
+    try:
+        created = create_plugins(module, plugin_path, quiet) if module != None else []
+        others = [plugin for plugin in plugins if not any([plugin is o for o in old])]
+        added = [pl for pl in created if not any([other.name == pl.name for other in others]) and pl.name not in deferred]
+        if check_dependencies(quiet, added):
+            await trigger_conditional_handlers(Events.SERVER_START, None, added)
+            started = True
+    except Exception:
+        log.exception("SERVER", "Could not start the plugins of \'" + plugin_path + "\'")
+    finally:
+        replacing, new_routes, staged_routes = [], staged_routes, None
+    if not started:
+        await trigger_conditional_handlers(Events.SERVER_START, None, old)
+        return False
+
+    # Swap the old plugins and their routes for the new ones, keeping the order plugins were loaded in
+    swapped = []
     for plugin in plugins:
-        for dep in plugin.dependencies:
-            pl = find(dep)
-            if pl == None:
-                logging.error("[SERVER] FATAL: Plugin \'" + plugin.name + "\' is missing its dependency \'" + dep + "\'")
-                if not quiet:
-                    print("[SERVER] FATAL: Plugin \'" + plugin.name + "\' is missing its dependency \'" + dep + "\'")
-                return False
+        if not any([plugin is o for o in old]):
+            swapped.append(plugin)
+        elif plugin is old[0]:
+            swapped += added
+    if len(old) == 0:
+        swapped += added
+    plugins = swapped
+    routes = dict([(code, owner) for code, owner in routes.items() if not any([owner is o for o in old])])
+    for code, owner in new_routes.items():
+        if any([owner is pl for pl in added]):
+            routes[code] = owner
+    fallback_plugins = [pl for pl in plugins if overrides_process_request(pl)]
+    if module != None:
+        plugin_files[plugin_path] = mtime
+    else:
+        plugin_files.pop(plugin_path, None)
+    update_manifest()
     return True
 
+def changed_files():
+    """
+    Returns the plugin files that were added, modified, or removed since they were loaded
+    """
+    folder = plugins_folder()
+    found = {}
+    for entry in os.scandir(folder):
+        if entry.name.endswith(".py") and entry.is_file():
+            found[folder + entry.name] = entry.stat().st_mtime_ns
+    changed = [path for path, mtime in found.items() if plugin_files.get(path) != mtime]
+    changed += [path for path in plugin_files if path not in found]
+    return changed
+
+async def watch(interval, quiet):
+    """
+    Polls the plugins folder and reloads only the plugin files that changed
+    Files that fail to load are retried once they are modified again
+    """
+    while True:
+        await asyncio.sleep(interval)
+        for plugin_path in changed_files():
+            if await reload_file(plugin_path, quiet):
+                log.info("SERVER", "Reloaded plugin file \'" + os.path.basename(plugin_path) + "\'")
+            elif os.path.exists(plugin_path):
+                plugin_files[plugin_path] = os.stat(plugin_path).st_mtime_ns
+
 def find(name):
     """
     Finds a plugin object by name
+    Deferred plugins are imported when they are first looked up
+    Returns None if plugin cannot be found
+    """
+    if name in deferred:
+        load_deferred(deferred[name])
+    return find_loaded(name)
+
+def find_loaded(name):
+    """
+    Finds a plugin object by name without importing deferred plugins
     Returns None if plugin cannot be found
     """
     global plugins
@@ -224,8 +693,6 @@ def autogen_folder(quiet):
     env_root = str(pathlib.Path(__file__).parent.parent.absolute())
     if not os.path.exists(env_root + "/plugins"):
         os.mkdir(env_root + "/plugins")
-        logging.info("[SERVER] Autogenerated plugins folder")
-        if not quiet:
-            print("[SERVER] Autogenerated plugins folder")
+        log.info("SERVER", "Autogenerated plugins folder", console=not quiet)
         return True
     return False
@@ -0,0 +1,226 @@
+"""
+This script handles timing and profiling of the server startup and of plugin code
+Help for all functionality of this script is available in the documentation
+"""
+
+import contextlib
+import cProfile
+import datetime
+import os
+import pathlib
+import pstats
+import time
+
+from wssb import log
+
+PHASES = "phases"
+PLUGINS = "plugins"
+HANDLERS = "handlers"
+
+# Wall times in seconds of the last server startup, kept so they can be read once the server is running
+startup = { PHASES: {}, PLUGINS: {}, HANDLERS: {} }
+
+recording = False # Timings are only recorded while the server is starting
+profiler = None # The running cProfile, None when the server is not being profiled
+profiler_started = None
+
+# Maps (plugin name, action name) of every view and event handler called to [calls, wall seconds, CPU seconds, slowest call]
+handler_stats = {}
+
+def begin():
+    """
+    Clears the timings of any previous startup and starts recording new ones
+    """
+    global recording
+
+    for timings in startup.values():
+        timings.clear()
+    recording = True
+
+def end():
+    """
+    Stops recording startup timings
+    """
+    global recording
+
+    recording = False
+
+def record(kind, name, seconds):
+    """
+    Records the wall time of a startup phase, plugin import, or event handler
+    """
+    if recording:
+        startup[kind][name] = startup[kind].get(name, 0) + seconds
+
+@contextlib.contextmanager
+def timed(kind, name):
+    """
+    Records the wall time spent in a block
+    """
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        record(kind, name, time.perf_counter() - start)
+
+def start_profiler():
+    """
+    Starts collecting a cProfile of the server
+    Returns False if a profile is already being collected
+    """
+    global profiler, profiler_started
+
+    if profiler != None:
+        return False
+    profiler = cProfile.Profile()
+    profiler_started = time.perf_counter()
+    profiler.enable()
+    return True
+
+def stop_profiler(path=None):
+    """
+    Stops the running cProfile and writes it to a file if a path is given
+    Profile files can be read with pstats or snakeviz
+    Returns the profile and the seconds it ran for, or None if no profile was being collected
+    """
+    global profiler
+
+    if profiler == None:
+        return None
+    profile = profiler
+    profile.disable()
+    profiler = None
+    if path != None:
+        profile.dump_stats(path)
+        log.info("SERVER", "Wrote profile to " + path)
+    return profile, time.perf_counter() - profiler_started
+
+def profile_path():
+    """
+    Returns a new file path in the profiles folder of the server root to save a profile to
+    """
+    folder = str(pathlib.Path(__file__).parent.parent.absolute()) + "/profiles/"
+    if not os.path.exists(folder):
+        os.mkdir(folder)
+    return folder + "profile-" + datetime.datetime.now().strftime("%Y%m%d-%H%M%S-%f") + ".prof"
+
+def summarize(profile, limit=30):
+    """
+    Returns the functions of a profile that took the most cumulative time, slowest first
+    """
+    stats = pstats.Stats(profile).stats
+    functions = []
+    for (file_name, line, name), (primitive_calls, calls, own_time, cumulative_time, callers) in stats.items():
+        functions.append({
+            "function": pstats.func_std_string((file_name, line, name)),
+            "calls": calls,
+            "tottime": round(own_time, 6),
+            "cumtime": round(cumulative_time, 6),
+        })
+    functions.sort(key=lambda function: function["cumtime"], reverse=True)
+    return functions[:limit]
+
+def record_handler(labels, wall, cpu):
+    """
+    Records the wall and CPU time of a call to a view or event handler
+    """
+    entry = handler_stats.get(labels)
+    if entry == None:
+        handler_stats[labels] = [1, wall, cpu, wall]
+    else:
+        entry[0] += 1
+        entry[1] += wall
+        entry[2] += cpu
+        if wall > entry[3]:
+            entry[3] = wall
+
+def slowest_handlers(limit=20):
+    """
+    Returns the views and event handlers that took the most total wall time, slowest first
+    """
+    ranked = sorted(handler_stats.items(), key=lambda item: item[1][1], reverse=True)[:limit]
+    return [{
+        "plugin": plugin_name,
+        "handler": name,
+        "calls": calls,
+        "wall_total": round(wall, 6),
+        "wall_mean": round(wall / calls, 6),
+        "wall_max": round(slowest, 6),
+        "cpu_total": round(cpu, 6),
+        "cpu_mean": round(cpu / calls, 6),
+    } for (plugin_name, name), (calls, wall, cpu, slowest) in ranked]
+
+def reset_handlers():
+    """
+    Clears the recorded view and event handler timings
+    """
+    handler_stats.clear()
+
+def thread_timed(action, context):
+    """
+    Runs an action and returns its result and the CPU time it took on the current thread
+    """
+    start = time.thread_time()
+    result = action(context)
+    return result, time.thread_time() - start
+
+class StepTimer():
+    """
+    Defines an awaitable that measures the CPU time a coroutine spends running
+    Time spent suspended while other tasks run is not counted
+    """
+    def __init__(self, awaitable):
+        """
+        Constructor for StepTimer
+        """
+        self.awaitable = awaitable
+        self.cpu = 0
+
+    def __await__(self):
+        iterator = self.awaitable.__await__()
+        send, value = iterator.send, None
+        while True:
+            start = time.thread_time()
+            try:
+                signal = send(value)
+            except StopIteration as e:
+                self.cpu += time.thread_time() - start
+                return e.value
+            except BaseException:
+                self.cpu += time.thread_time() - start
+                raise
+            self.cpu += time.thread_time() - start
+            try:
+                value = yield signal
+                send = iterator.send
+            except GeneratorExit:
+                iterator.close()
+                raise
+            except BaseException as e:
+                value = e
+                send = iterator.throw
+
+def total():
+    """
+    Returns the total wall time of all recorded startup phases
+    """
+    return sum(startup[PHASES].values())
+
+def report():
+    """
+    Logs the recorded startup timings
+    Phases are listed in the order they ran, plugin imports and handlers slowest first
+    """
+    log.info("STARTUP", "Server started in " + format_ms(total()))
+    for name, seconds in startup[PHASES].items():
+        log.info("STARTUP", "  phase " + name + ": " + format_ms(seconds))
+    for name, seconds in sorted(startup[PLUGINS].items(), key=lambda item: item[1], reverse=True):
+        log.info("STARTUP", "  plugin import " + name + ": " + format_ms(seconds))
+    for name, seconds in sorted(startup[HANDLERS].items(), key=lambda item: item[1], reverse=True):
+        log.info("STARTUP", "  handler " + name + ": " + format_ms(seconds))
+
+def format_ms(seconds):
+    """
+    Formats a duration in seconds as milliseconds
+    """
+    return ("%.1f" % (seconds * 1000)) + " ms"
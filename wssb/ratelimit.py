@@ -0,0 +1,265 @@
+"""
+This script handles rate limiting of incoming traffic per connection, per user and per request code
+Help for all functionality of this script is available in the documentation
+"""
+
+import time
+
+from wssb import config
+from wssb import log
+
+REJECT = "reject"
+DROP = "drop"
+ACTIONS = (REJECT, DROP)
+
+BYPASS_PERMISSION = "wssb.ratelimit.bypass"
+CONFIG_PREFIX = "rate_limit_" # Prefix of the rate limit options in server.ini and groups.ini
+
+CONNECTION_MESSAGES = "connection_messages"
+CONNECTION_BYTES = "connection_bytes"
+USER_MESSAGES = "user_messages"
+USER_BYTES = "user_bytes"
+CODE_MESSAGES = "code_messages"
+LIMITS = (CONNECTION_MESSAGES, CONNECTION_BYTES, USER_MESSAGES, USER_BYTES, CODE_MESSAGES)
+CODES = "codes" # Option holding the limits of individual request codes, such as auth=1:5,foo=10
+
+action = REJECT # What is done with traffic over a limit
+defaults = None # The limits from the global config, before group overrides
+
+user_limits = {} # Caches the limits of users after their group overrides by user name
+user_buckets = {} # Maps the names of limited users to the buckets shared by all of their connections
+
+class TokenBucket():
+    """
+    Defines a bucket that refills with tokens at a steady rate up to its burst size
+    """
+    def __init__(self, limit):
+        """
+        Constructor for TokenBucket
+        """
+        self.limit = limit
+        self.rate, self.burst = limit
+        self.tokens = self.burst
+        self.updated = time.monotonic()
+
+    def take(self, amount, now):
+        """
+        Takes tokens from the bucket
+        Amounts larger than the burst size are let through once the bucket is full and leave it in debt
+        Returns None if the tokens were taken, otherwise the seconds until they will be available
+        """
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        needed = min(amount, self.burst)
+        if self.tokens >= needed:
+            self.tokens -= amount
+            return None
+        return (needed - self.tokens) / self.rate
+
+class Limits():
+    """
+    Defines the (rate, burst) pair of every limit that applies to a connection
+    Limits that are disabled are None
+    """
+    def __init__(self, values, codes):
+        """
+        Constructor for Limits
+        """
+        self.values, self.codes = values, codes
+        self.enabled = any([limit != None for limit in values.values()]) or any([limit != None for limit in codes.values()])
+
+    def code(self, code):
+        """
+        Returns the limit of a request code, the code_messages limit unless the code has its own
+        """
+        if code in self.codes:
+            return self.codes[code]
+        return self.values[CODE_MESSAGES]
+
+class Limiter():
+    """
+    Defines the rate limiter of a single connection
+    Limits of the user the connection is authenticated as are shared with the user's other connections
+    """
+    def __init__(self):
+        """
+        Constructor for Limiter
+        """
+        self.user = None
+        self.buckets = {}
+
+    def check_frame(self, size):
+        """
+        Checks a received frame against the byte limits
+        Returns None if it is allowed, otherwise the name of the exceeded limit and the seconds until it would be allowed
+        """
+        return self.check(CONNECTION_BYTES, USER_BYTES, size)
+
+    def check_messages(self, count):
+        """
+        Checks the messages of a received packet against the message limits
+        Returns None if they are allowed, otherwise the name of the exceeded limit and the seconds until they would be allowed
+        """
+        return self.check(CONNECTION_MESSAGES, USER_MESSAGES, count)
+
+    def check(self, connection_limit, user_limit, amount):
+        """
+        Takes an amount from the connection and user buckets of a pair of limits
+        """
+        limits = limits_of(self.user)
+        if not limits.enabled or self.exempt():
+            return None
+        now = time.monotonic()
+        retry_after = take(self.buckets, connection_limit, limits.values[connection_limit], amount, now)
+        if retry_after != None:
+            return connection_limit, retry_after
+        if self.user != None:
+            retry_after = take(user_buckets.setdefault(self.user.name, {}), user_limit, limits.values[user_limit], amount, now)
+            if retry_after != None:
+                return user_limit, retry_after
+        return None
+
+    def check_request(self, code):
+        """
+        Checks a request against the limit of its request code
+        Returns None if it is allowed, otherwise the name of the exceeded limit and the seconds until it would be allowed
+        """
+        limits = limits_of(self.user)
+        if not limits.enabled or self.exempt():
+            return None
+        buckets = self.buckets if self.user == None else user_buckets.setdefault(self.user.name, {})
+        retry_after = take(buckets, (CODE_MESSAGES, code), limits.code(code), 1, time.monotonic())
+        if retry_after != None:
+            return CODE_MESSAGES, retry_after
+        return None
+
+    def exempt(self):
+        """
+        Returns True if the connection is authenticated as a user that bypasses rate limits
+        """
+        return self.user != None and self.user.has_permission(BYPASS_PERMISSION)
+
+def take(buckets, key, limit, amount, now):
+    """
+    Takes an amount from the bucket of a limit, replacing the bucket if the limit changed
+    Returns None if the limit is disabled or the amount was taken, otherwise the seconds until it will be available
+    """
+    if limit == None:
+        return None
+    bucket = buckets.get(key)
+    if bucket == None or bucket.limit != limit:
+        bucket = TokenBucket(limit)
+        buckets[key] = bucket
+    return bucket.take(amount, now)
+
+def parse_limit(value):
+    """
+    Parses a limit given as a rate per second optionally followed by a burst size, such as 10 or 10:50
+    Returns None for an empty value or a rate of 0, which disable the limit
+    """
+    value = value.strip()
+    if value == "":
+        return None
+    rate, separator, burst = value.partition(":")
+    rate = float(rate)
+    burst = float(burst) if separator != "" else rate
+    if rate <= 0:
+        return None
+    if burst <= 0:
+        raise ValueError("The burst size must be positive")
+    return rate, burst
+
+def parse_limits(options, source):
+    """
+    Parses the rate limit options of a server.ini or groups.ini section
+    Returns dictionaries of the limits and request code limits that are set, invalid values are logged and skipped
+    """
+    values, codes = {}, {}
+    for name in LIMITS:
+        if CONFIG_PREFIX + name in options:
+            try:
+                values[name] = parse_limit(options[CONFIG_PREFIX + name])
+            except ValueError:
+                log.error("SERVER", "Invalid rate limit '" + options[CONFIG_PREFIX + name] + "' for " + CONFIG_PREFIX + name + " in " + source, event="invalid_rate_limit", console=False)
+    if CONFIG_PREFIX + CODES in options:
+        for entry in config.parse_safe_csv(options[CONFIG_PREFIX + CODES]):
+            if entry.strip() == "":
+                continue
+            code, separator, value = entry.partition("=")
+            try:
+                if separator == "":
+                    raise ValueError("Missing request code")
+                codes[code.strip()] = parse_limit(value)
+            except ValueError:
+                log.error("SERVER", "Invalid rate limit '" + entry + "' for " + CONFIG_PREFIX + CODES + " in " + source, event="invalid_rate_limit", console=False)
+    return values, codes
+
+def most_generous(a, b):
+    """
+    Returns the more generous of two limits, None being unlimited
+    """
+    if a == None or b == None:
+        return None
+    return max(a, b)
+
+def merge(overrides, limits):
+    """
+    Adds limits to a dictionary of overrides, keeping the most generous limit of each name
+    """
+    for name, limit in limits.items():
+        overrides[name] = most_generous(overrides[name], limit) if name in overrides else limit
+
+def configure(limit_action, values, codes):
+    """
+    Sets the action taken on traffic over a limit and the default limits
+    """
+    global action, defaults
+
+    if limit_action not in ACTIONS:
+        log.error("SERVER", "Unknown rate limit action '" + limit_action + "', using '" + REJECT + "'", console=False)
+        limit_action = REJECT
+    action = limit_action
+    defaults = Limits(dict([(name, values.get(name)) for name in LIMITS]), codes)
+    invalidate()
+
+def load_config():
+    """
+    Applies the rate limit options from the global server config
+    """
+    general = config.global_config()["GENERAL"]
+    configure(general[CONFIG_PREFIX + "action"], *parse_limits(general, "server.ini"))
+
+def limits_of(user):
+    """
+    Returns the limits that apply to a user, the defaults overridden by the user's groups
+    When several of the user's groups override a limit the most generous one is used
+    """
+    if defaults == None:
+        load_config()
+    if user == None:
+        return defaults
+    limits = user_limits.get(user.name)
+    if limits == None:
+        overrides, code_overrides = {}, {}
+        for group in user.groups:
+            if len(group.limits) > 0:
+                values, codes = parse_limits(group.limits, "group '" + group.name + "'")
+                merge(overrides, values)
+                merge(code_overrides, codes)
+        limits = Limits(dict(defaults.values, **overrides), dict(defaults.codes, **code_overrides))
+        user_limits[user.name] = limits
+    return limits
+
+def invalidate():
+    """
+    Clears the cached limits of every user so changed groups and config are applied
+    Token buckets are kept and replaced once their limit changes
+    """
+    user_limits.clear()
+
+def forget(user_name):
+    """
+    Removes the cached limits and buckets of a user whose last connection closed
+    """
+    user_limits.pop(user_name, None)
+    user_buckets.pop(user_name, None)
@@ -0,0 +1,358 @@
+"""
+This script handles the storage backends that hold users, groups, and permissions
+Help for all functionality of this script is available in the documentation
+"""
+
+import contextlib
+import json
+import pathlib
+import sqlite3
+
+from wssb import config
+
+INI = "ini"
+SQLITE = "sqlite"
+BACKENDS = (INI, SQLITE)
+LIMIT_PREFIX = "rate_limit_" # Group options starting with this are rate limit overrides
+
+def user_record(groups=[], permissions=[], socket_address=""):
+    """
+    Returns a stored user record
+    """
+    return { "groups": list(groups), "permissions": list(permissions), "socket_address": socket_address }
+
+def group_record(permissions=[], limits={}):
+    """
+    Returns a stored group record
+    Limits map rate limit option names to the values the group overrides them with
+    """
+    return { "permissions": list(permissions), "limits": dict(limits) }
+
+def split_csv(s):
+    """
+    Parses a comma separated string into a list without empty values
+    """
+    return [value for value in config.parse_safe_csv(s) if value != ""]
+
+class Store():
+    """
+    Defines an abstract storage backend that can be extended to store users and groups elsewhere
+    Lazy stores only load users when they are looked up, other stores are loaded in full
+    """
+    lazy = False
+
+    def open(self):
+        """
+        Opens the store
+        Should be developer defined
+        """
+        raise NotImplementedError()
+
+    def reload(self):
+        """
+        Refreshes the store from its source
+        Returns False if the store could not be read
+        """
+        return True
+
+    def close(self):
+        """
+        Closes the store
+        """
+        pass
+
+    def groups(self):
+        """
+        Returns an iterable of all (group name, group record) pairs
+        Should be developer defined
+        """
+        raise NotImplementedError()
+
+    def users(self):
+        """
+        Returns an iterable of all (user name, user record) pairs
+        Should be developer defined
+        """
+        raise NotImplementedError()
+
+    def get_group(self, group_name):
+        """
+        Returns the record of a group or None if it does not exist
+        Should be developer defined
+        """
+        raise NotImplementedError()
+
+    def get_user(self, user_name):
+        """
+        Returns the record of a user or None if it does not exist
+        Should be developer defined
+        """
+        raise NotImplementedError()
+
+    def group_member_names(self, group_name):
+        """
+        Returns the set of names of all users that list the group
+        Should be developer defined
+        """
+        raise NotImplementedError()
+
+    def put_group(self, group_name, record):
+        """
+        Adds or replaces a group
+        Should be developer defined
+        """
+        raise NotImplementedError()
+
+    def put_user(self, user_name, record):
+        """
+        Adds or replaces a user
+        Should be developer defined
+        """
+        raise NotImplementedError()
+
+    def delete_group(self, group_name):
+        """
+        Removes a group, users listing it are left unchanged
+        Returns False if the group does not exist
+        Should be developer defined
+        """
+        raise NotImplementedError()
+
+    def delete_user(self, user_name):
+        """
+        Removes a user
+        Returns False if the user does not exist
+        Should be developer defined
+        """
+        raise NotImplementedError()
+
+    @contextlib.contextmanager
+    def transaction(self):
+        """
+        Groups changes so they are written once when the block ends
+        """
+        yield self
+
+class INIStore(Store):
+    """
+    Defines a store backed by the users.ini and groups.ini config files
+    """
+    def open(self):
+        config.load_groups_config()
+        config.load_users_config()
+        return config.groups_config().is_loaded() and config.users_config().is_loaded()
+
+    def reload(self):
+        return config.users_config().reload() and config.groups_config().reload()
+
+    def groups(self):
+        groups_conf = config.groups_config()
+        for group_name in groups_conf.sections():
+            yield group_name, self.section_record(groups_conf[group_name])
+
+    def users(self):
+        users_conf = config.users_config()
+        for user_name in users_conf.sections():
+            section = users_conf[user_name]
+            yield user_name, user_record(split_csv(section["groups"]), split_csv(section["permissions"]), section["socket_address"])
+
+    def get_group(self, group_name):
+        if not config.groups_config().has_section(group_name):
+            return None
+        return self.section_record(config.groups_config()[group_name])
+
+    def section_record(self, section):
+        """
+        Returns the group record of a groups.ini section
+        """
+        limits = dict([(key, value) for key, value in section.items() if key.startswith(LIMIT_PREFIX)])
+        return group_record(split_csv(section["permissions"]), limits)
+
+    def get_user(self, user_name):
+        if not config.users_config().has_section(user_name):
+            return None
+        section = config.users_config()[user_name]
+        return user_record(split_csv(section["groups"]), split_csv(section["permissions"]), section["socket_address"])
+
+    def group_member_names(self, group_name):
+        return set([user_name for user_name, record in self.users() if group_name in record["groups"]])
+
+    def put_group(self, group_name, record):
+        config.groups_config().set_section(group_name, dict({ "permissions": config.list_to_csv(record["permissions"]) }, **record["limits"]))
+        config.groups_config().save()
+
+    def put_user(self, user_name, record):
+        config.users_config().set_section(user_name, {
+            "permissions": config.list_to_csv(record["permissions"]),
+            "groups": config.list_to_csv(record["groups"]),
+            "socket_address": record["socket_address"],
+        })
+        config.users_config().save()
+
+    def delete_group(self, group_name):
+        if not config.groups_config().has_section(group_name):
+            return False
+        config.groups_config().remove_section(group_name)
+        config.groups_config().save()
+        return True
+
+    def delete_user(self, user_name):
+        if not config.users_config().has_section(user_name):
+            return False
+        config.users_config().remove_section(user_name)
+        config.users_config().save()
+        return True
+
+    @contextlib.contextmanager
+    def transaction(self):
+        with config.groups_config().transaction(), config.users_config().transaction():
+            yield self
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS groups (
+    name TEXT PRIMARY KEY,
+    permissions TEXT NOT NULL DEFAULT '',
+    limits TEXT NOT NULL DEFAULT '{}'
+);
+CREATE TABLE IF NOT EXISTS users (
+    name TEXT PRIMARY KEY,
+    permissions TEXT NOT NULL DEFAULT '',
+    socket_address TEXT NOT NULL DEFAULT ''
+);
+CREATE TABLE IF NOT EXISTS memberships (
+    user_name TEXT NOT NULL,
+    group_name TEXT NOT NULL,
+    position INTEGER NOT NULL,
+    PRIMARY KEY (user_name, group_name)
+);
+CREATE INDEX IF NOT EXISTS memberships_by_group ON memberships (group_name);
+"""
+
+class SQLiteStore(Store):
+    """
+    Defines a lazy store backed by an SQLite database with indexed lookups by user and group name
+    """
+    lazy = True
+
+    def __init__(self, path):
+        """
+        Constructor for SQLiteStore
+        """
+        self.path = path
+        self.db = None
+        self.batch_depth = 0
+
+    def open(self):
+        self.db = sqlite3.connect(self.path, isolation_level=None, check_same_thread=False)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.executescript(SCHEMA)
+        # Databases created before groups had rate limits are missing the column
+        if "limits" not in [row[1] for row in self.db.execute("PRAGMA table_info(groups)")]:
+            self.db.execute("ALTER TABLE groups ADD COLUMN limits TEXT NOT NULL DEFAULT '{}'")
+        return True
+
+    def close(self):
+        if self.db != None:
+            self.db.close()
+            self.db = None
+
+    def groups(self):
+        for name, permissions, limits in self.db.execute("SELECT name, permissions, limits FROM groups ORDER BY name"):
+            yield name, group_record(split_csv(permissions), json.loads(limits))
+
+    def users(self):
+        for name, permissions, socket_address in self.db.execute("SELECT name, permissions, socket_address FROM users ORDER BY name"):
+            yield name, user_record(self.user_groups(name), split_csv(permissions), socket_address)
+
+    def user_groups(self, user_name):
+        """
+        Returns the names of the groups a user lists in order
+        """
+        return [row[0] for row in self.db.execute("SELECT group_name FROM memberships WHERE user_name = ? ORDER BY position", (user_name,))]
+
+    def get_group(self, group_name):
+        row = self.db.execute("SELECT permissions, limits FROM groups WHERE name = ?", (group_name,)).fetchone()
+        if row == None:
+            return None
+        return group_record(split_csv(row[0]), json.loads(row[1]))
+
+    def get_user(self, user_name):
+        row = self.db.execute("SELECT permissions, socket_address FROM users WHERE name = ?", (user_name,)).fetchone()
+        if row == None:
+            return None
+        return user_record(self.user_groups(user_name), split_csv(row[0]), row[1])
+
+    def group_member_names(self, group_name):
+        return set([row[0] for row in self.db.execute("SELECT user_name FROM memberships WHERE group_name = ?", (group_name,))])
+
+    def put_group(self, group_name, record):
+        with self.transaction():
+            self.db.execute("INSERT OR REPLACE INTO groups (name, permissions, limits) VALUES (?, ?, ?)", (group_name, config.list_to_csv(record["permissions"]), json.dumps(record["limits"])))
+
+    def put_user(self, user_name, record):
+        with self.transaction():
+            self.db.execute("INSERT OR REPLACE INTO users (name, permissions, socket_address) VALUES (?, ?, ?)", (user_name, config.list_to_csv(record["permissions"]), record["socket_address"]))
+            self.db.execute("DELETE FROM memberships WHERE user_name = ?", (user_name,))
+            self.db.executemany("INSERT OR IGNORE INTO memberships (user_name, group_name, position) VALUES (?, ?, ?)", [(user_name, group_name, i) for i, group_name in enumerate(record["groups"])])
+
+    def delete_group(self, group_name):
+        return self.db.execute("DELETE FROM groups WHERE name = ?", (group_name,)).rowcount > 0
+
+    def delete_user(self, user_name):
+        with self.transaction():
+            deleted = self.db.execute("DELETE FROM users WHERE name = ?", (user_name,)).rowcount > 0
+            self.db.execute("DELETE FROM memberships WHERE user_name = ?", (user_name,))
+        return deleted
+
+    @contextlib.contextmanager
+    def transaction(self):
+        if self.batch_depth == 0:
+            self.db.execute("BEGIN")
+        self.batch_depth += 1
+        try:
+            yield self
+        except BaseException:
+            self.batch_depth -= 1
+            if self.batch_depth == 0:
+                self.db.execute("ROLLBACK")
+            raise
+        self.batch_depth -= 1
+        if self.batch_depth == 0:
+            self.db.execute("COMMIT")
+
+def create(backend, path):
+    """
+    Creates a store for the given backend name
+    Relative paths are resolved from the server root
+    """
+    if backend == INI:
+        return INIStore()
+    if backend == SQLITE:
+        if not pathlib.Path(path).is_absolute():
+            path = str(pathlib.Path(__file__).parent.parent.absolute()) + "/" + path
+        return SQLiteStore(path)
+    raise ValueError("Unsupported user store '" + backend + "'")
+
+def configured():
+    """
+    Creates the store selected in the global server config
+    """
+    if config.global_config() == None:
+        config.load_global_config()
+    general = config.global_config()["GENERAL"]
+    return create(general["user_store"], general["user_store_path"])
+
+def migrate(source, destination):
+    """
+    Copies every group and user from one store into another in a single transaction
+    Returns the number of groups and users copied
+    """
+    group_count, user_count = 0, 0
+    with destination.transaction():
+        for group_name, record in source.groups():
+            destination.put_group(group_name, record)
+            group_count += 1
+        for user_name, record in source.users():
+            destination.put_user(user_name, record)
+            user_count += 1
+    return group_count, user_count
@@ -3,28 +3,82 @@ This script handles actions relating to users, groups, and permissions
 Help for all functionality of this script is available in the documentation
 """
 
+import collections
+
 from wssb import config
+from wssb import storage
+
+store = None # The storage backend users and groups are loaded from
+
+registered_users = {} # Maps user names to all loaded users, every user unless the store is lazy
+registered_groups = {} # Maps group names to all registered groups
+user_cache = collections.OrderedDict() # Names of loaded offline users of a lazy store, least recently used first
+pinned_users = {} # Maps the names of users being authenticated to their pin count, pinned users are never evicted
+cache_size = 10000
 
-registered_users = [] # Stores all users registered in users.ini
-registered_groups = [] # Stores all groups registered in groups.ini
+socket_users = {} # Maps each registered socket to the user it belongs to
+online_users = set() # Stores all users with at least one registered socket
+group_sockets = {} # Maps group names to the registered sockets of their online members
+group_users = {} # Maps group names to the names of all their registered members
 
 connected_sockets = set()
 
+class PermissionTrie():
+    """
+    Defines a prefix tree of granted permission strings
+    A granted permission also grants every permission nested below it
+    """
+    GRANTED = None # Marks a node whose permission is granted (never a valid permission segment)
+
+    def __init__(self, permissions=[]):
+        """
+        Constructor for PermissionTrie
+        """
+        self.root = {}
+        for perm in permissions:
+            self.add(perm)
+
+    def add(self, perm):
+        """
+        Grants a permission string and all of its children
+        """
+        node = self.root
+        for part in perm.split("."):
+            if PermissionTrie.GRANTED in node:
+                return
+            node = node.setdefault(part, {})
+        node.clear()
+        node[PermissionTrie.GRANTED] = True
+
+    def contains(self, perm):
+        """
+        Returns True if the permission string is granted by the trie
+        """
+        node = self.root
+        for part in perm.split("."):
+            node = node.get(part)
+            if node == None:
+                return False
+            if PermissionTrie.GRANTED in node:
+                return True
+        return False
+
 class Group():
     """
-    Defines a group object who has permissions and users
+    Defines a group object who has permissions, rate limit overrides and users
     """
-    def __init__(self, name, permissions=[]):
+    def __init__(self, name, permissions=[], limits={}):
         """
         Constructor for Group
         """
-        self.name, self.permissions = name, permissions
+        self.name, self.permissions, self.limits = name, permissions, limits
+        self._trie = PermissionTrie(permissions)
 
     def has_permission(self, p):
         """
         Returns True if Group has the given permission
         """
-        return any([perm_is_child(perm, p) for perm in self.permissions])
+        return self._trie.contains(p)
 
 class User():
     """
@@ -35,18 +89,30 @@ class User():
         Constructor for User
         """
         self.name, self.address, self.groups, self.permissions = name, address, groups, permissions
-        self._sockets = []
+        self._sockets = set()
+        self._source = None # Config values the user was loaded from, used to skip unchanged users on reload
+        self.compile_permissions()
+
+    def compile_permissions(self):
+        """
+        Compiles the user's own and group permissions into a single trie
+        Clears all memoized permission checks
+        """
+        self._trie = PermissionTrie(self.permissions)
+        for group in self.groups:
+            for perm in group.permissions:
+                self._trie.add(perm)
+        self._permission_cache = {}
 
     def has_permission(self, p):
         """
         Returns True if User has the given permission
         """
-        if any([perm_is_child(perm, p) for perm in self.permissions]):
-            return True
-        for group in self.groups:
-            if group.has_permission(p):
-                return True
-        return False
+        result = self._permission_cache.get(p)
+        if result == None:
+            result = self._trie.contains(p)
+            self._permission_cache[p] = result
+        return result
 
     def belongs_to(self, g):
         """
@@ -56,94 +122,261 @@ class User():
             return any([group.name == g for group in self.groups])
         return g in self.groups
 
-def reload_all():
-    """
-    Reloads all users, groups, and permissions from file
-    """
-    global registered_users, registered_groups
-
-    if config.users_config().reload() and config.groups_config().reload():
-        registered_groups = []
-        new_registered_users = []
-
-        for group in config.groups_config().sections():
-            group_permissions = config.parse_safe_csv(config.groups_config()[group]["permissions"])
-            registered_groups.append(Group(group, [p for p in group_permissions if p != ""]))
-        for user in config.users_config().sections():
-            user_groups = config.parse_safe_csv(config.users_config()[user]["groups"])
-            groups = []
-            for group in user_groups:
-                for group2 in registered_groups:
-                    if group == group2.name:
-                        groups.append(group2)
-            user_permissions = config.parse_safe_csv(config.users_config()[user]["permissions"])
-            user_address = config.users_config()[user]["socket_address"]
-            new_user = User(user, user_address, groups, [p for p in user_permissions if p != ""])
-            for existing in registered_users:
-                if existing.name == new_user.name:
-                    new_user._sockets = existing._sockets
-            new_registered_users.append(new_user)
-        registered_users = new_registered_users
-    else:
+def load_store():
+    """
+    Opens the storage backend selected in the global server config
+    Returns False if the store could not be opened
+    """
+    global store, cache_size
+
+    if store != None:
+        store.close()
+    store = storage.configured()
+    cache_size = int(config.global_config()["GENERAL"]["user_cache_size"])
+    return store.open()
+
+def reload_all(orphaned=None):
+    """
+    Reloads all users, groups, and permissions from the store
+    The registry is updated in place so only users and groups that changed are rebuilt
+    Lazy stores only refresh the users that are currently loaded
+    If an orphaned list is given the sockets of users that were removed are collected into it
+    """
+    if store == None:
+        load_store()
+    if not store.reload():
         return False
 
+    # Update groups in place and find the members whose permissions must be recompiled
+    stale_users = set()
+    changed_names = set()
+    group_records = dict(store.groups())
+    for group_name in list(registered_groups):
+        if group_name not in group_records:
+            del registered_groups[group_name]
+            group_sockets.pop(group_name, None)
+            changed_names.add(group_name)
+    for group_name, record in group_records.items():
+        group = registered_groups.get(group_name)
+        if group == None:
+            registered_groups[group_name] = Group(group_name, record["permissions"], record["limits"])
+            changed_names.add(group_name)
+        else:
+            group.limits = record["limits"]
+            if group.permissions != record["permissions"]:
+                group.permissions = record["permissions"]
+                group._trie = PermissionTrie(record["permissions"])
+                stale_users.update(group_users.get(group_name, set()))
+
+    if store.lazy:
+        for user_name in list(registered_users):
+            record = store.get_user(user_name)
+            if record == None:
+                remove_loaded_user(user_name, orphaned)
+            else:
+                load_user(user_name, record, changed_names, stale_users)
+    else:
+        user_names = set()
+        for user_name, record in store.users():
+            user_names.add(user_name)
+            load_user(user_name, record, changed_names, stale_users)
+        for user_name in list(registered_users):
+            if user_name not in user_names:
+                remove_loaded_user(user_name, orphaned)
+
+    for group_name in changed_names:
+        if group_name not in registered_groups:
+            group_users.pop(group_name, None)
+    return True
+
+def load_user(user_name, record, changed_names=set(), stale_users=set()):
+    """
+    Adds a user from a store record to the registry or updates it in place if it changed
+    Returns the loaded user
+    """
+    source = (tuple(record["groups"]), tuple(record["permissions"]), record["socket_address"])
+    user = registered_users.get(user_name)
+    if user != None and user._source == source:
+        # Group membership can only change if a group the user lists was added or removed
+        if changed_names.isdisjoint(record["groups"]):
+            if user_name in stale_users:
+                user.compile_permissions()
+            return user
+    groups = [registered_groups[group] for group in record["groups"] if group in registered_groups]
+    if user == None:
+        user = User(user_name, record["socket_address"], [], record["permissions"])
+        registered_users[user_name] = user
+    else:
+        user.address, user.permissions = record["socket_address"], record["permissions"]
+    set_user_groups(user, groups)
+    user._source = source
+    user.compile_permissions()
+    return user
+
+def remove_loaded_user(user_name, orphaned=None):
+    """
+    Removes a user from the registry and all indexes
+    If an orphaned list is given the user's sockets are collected into it
+    """
+    user = registered_users.pop(user_name)
+    user_cache.pop(user_name, None)
+    set_user_groups(user, [])
+    for socket in user._sockets:
+        socket_users.pop(socket, None)
+        if orphaned != None:
+            orphaned.append(socket)
+    online_users.discard(user)
+
+def cache_user(user):
+    """
+    Marks a loaded offline user of a lazy store as recently used
+    Evicts the least recently used offline users once the cache is full
+    """
+    if user.name in pinned_users:
+        return
+    user_cache[user.name] = True
+    user_cache.move_to_end(user.name)
+    while len(user_cache) > cache_size:
+        user_name, _ = user_cache.popitem(last=False)
+        evicted = registered_users.pop(user_name)
+        set_user_groups(evicted, [])
+
+def pin_user(user):
+    """
+    Keeps a loaded user of a lazy store from being evicted, such as while it is being authenticated
+    """
+    pinned_users[user.name] = pinned_users.get(user.name, 0) + 1
+    user_cache.pop(user.name, None)
+
+def unpin_user(user):
+    """
+    Releases a pin, offline users that are no longer pinned go back to the cache
+    """
+    count = pinned_users.get(user.name, 0) - 1
+    if count > 0:
+        pinned_users[user.name] = count
+        return
+    pinned_users.pop(user.name, None)
+    if store != None and store.lazy and len(user._sockets) == 0 and registered_users.get(user.name) is user:
+        cache_user(user)
+
+def set_user_groups(user, groups):
+    """
+    Changes the groups of a user and updates the group member and socket indexes
+    """
+    old_names = set([group.name for group in user.groups])
+    new_names = set([group.name for group in groups])
+    for group_name in old_names - new_names:
+        members = group_users.get(group_name)
+        if members != None:
+            members.discard(user.name)
+            if len(members) == 0:
+                del group_users[group_name]
+        sockets = group_sockets.get(group_name)
+        if sockets != None:
+            sockets.difference_update(user._sockets)
+            if len(sockets) == 0:
+                del group_sockets[group_name]
+    for group_name in new_names - old_names:
+        group_users.setdefault(group_name, set()).add(user.name)
+        if len(user._sockets) > 0:
+            group_sockets.setdefault(group_name, set()).update(user._sockets)
+    user.groups = groups
+
 def is_registered(user):
     """
     Checks if the given user or username is registered
     """
-    global registered_users
-
-    if type(user) == str:
-        for reg_user in registered_users:
-            if reg_user.name == user:
-                return True
-        return False
-    for reg_user in registered_users:
-        if reg_user.name == user.name:
-            return True
-    return False
+    if type(user) != str:
+        user = user.name
+    return find_user(user) != None
 
 def socket_is_registered(socket):
     """
     Checks if a socket object is linked to valid registered user
     """
-    global registered_users
+    return socket in socket_users
 
-    for user in registered_users:
-        if socket in user._sockets:
-            return True
-    return False
+def socket_user(socket):
+    """
+    Finds the registered user a socket is linked to
+    Returns None if the socket is not registered
+    """
+    return socket_users.get(socket)
 
 def register_socket(user_name, socket):
     """
     Registers a socket under the given username
-    """
-    global registered_users
-
-    for user in registered_users:
-        if user_name == user.name:
-            user._sockets.append(socket)
+    Returns True if this is the user's first registered socket
+    """
+    user = find_user(user_name)
+    if user != None:
+        first = len(user._sockets) == 0
+        user_cache.pop(user_name, None)
+        user._sockets.add(socket)
+        socket_users[socket] = user
+        online_users.add(user)
+        for group in user.groups:
+            group_sockets.setdefault(group.name, set()).add(socket)
+        return first
+    return False
 
 def unregister_socket(user_name, socket):
     """
     Unregisters a socket under the given username
-    """
-    global registered_users
-
-    for user in registered_users:
-        if user_name == user.name:
-            user._sockets.remove(socket)
+    Returns True if this was the user's last registered socket
+    """
+    user = registered_users.get(user_name)
+    if user != None and socket in user._sockets:
+        user._sockets.remove(socket)
+        del socket_users[socket]
+        if len(user._sockets) == 0:
+            online_users.discard(user)
+            if store.lazy:
+                cache_user(user)
+        for group in user.groups:
+            members = group_sockets.get(group.name)
+            if members != None:
+                members.discard(socket)
+                if len(members) == 0:
+                    del group_sockets[group.name]
+        return len(user._sockets) == 0
+    return False
 
 def connected():
     """
     Gets a list of all connected users
     """
-    global registered_users
-    conn = []
-    for user in registered_users:
-        if len(user._sockets) > 0:
-            conn.append(user)
-    return conn
+    return list(online_users)
+
+def connected_conns():
+    """
+    Gets a list of all registered sockets
+    """
+    return list(socket_users)
+
+def group_members(group_name):
+    """
+    Gets the set of names of all registered members of the given group
+    """
+    if store != None and store.lazy:
+        return store.group_member_names(group_name) if group_name in registered_groups else set()
+    return group_users.get(group_name, set())
+
+def user_conns(user_name):
+    """
+    Gets the set of sockets registered under the given username
+    """
+    user = registered_users.get(user_name)
+    if user != None:
+        return user._sockets
+    return set()
+
+def group_conns(group_name):
+    """
+    Gets the set of sockets registered by online members of the given group
+    """
+    return group_sockets.get(group_name, set())
 
 def exists(user_name):
     """
@@ -160,24 +393,29 @@ def group_exists(group_name):
 def find_user(user_name):
     """
     Finds a registered user by name
+    Users of a lazy store are loaded on first use and kept in a cache of recently used users
     Returns None if the user does not exist
     """
-    global registered_users
-    for user in registered_users:
-        if user.name == user_name:
-            return (user)
-    return None
+    user = registered_users.get(user_name)
+    if user != None:
+        if user_name in user_cache:
+            user_cache.move_to_end(user_name)
+        return user
+    if store == None or not store.lazy:
+        return None
+    record = store.get_user(user_name)
+    if record == None:
+        return None
+    user = load_user(user_name, record)
+    cache_user(user)
+    return user
 
 def find_group(group_name):
     """
     Finds a registered group by name
     Returns None if the group does not exist
     """
-    global registered_groups
-    for group in registered_groups:
-        if group.name == group_name:
-            return group
-    return None
+    return registered_groups.get(group_name)
 
 def perm_is_child(parent, child):
     """
@@ -185,6 +423,8 @@ def perm_is_child(parent, child):
     """
     parent_parts = parent.split(".")
     child_parts = child.split(".")
+    if len(parent_parts) > len(child_parts):
+        return False
     for i in range(len(parent_parts)):
         if parent_parts[i] != child_parts[i]:
             return False
@@ -192,55 +432,45 @@ def perm_is_child(parent, child):
 
 def add_group(group_name):
     """
-    Adds a new group to the global groups file if it does not exist
+    Adds a new group to the store if it does not exist
     """
-    if not config.groups_config().has_section(group_name):
-        config.groups_config().set_section(group_name, { "permissions": "" })
-        config.groups_config().save()
+    if store.get_group(group_name) == None:
+        store.put_group(group_name, storage.group_record())
         return True
     return False
 
 def remove_group(group_name):
     """
-    Removes a group from the global groups file if the group exists
+    Removes a group from the store if the group exists
     """
-    if config.groups_config().has_section(group_name):
-        config.groups_config().remove_section(group_name)
-        config.groups_config().save()
-        return True
-    return False
+    return store.delete_group(group_name)
 
 def add_user(user_name):
     """
-    Adds a new user to the global users file if it does not exist
+    Adds a new user to the store if it does not exist
     """
-    if not config.users_config().has_section(user_name):
-        config.users_config().set_section(user_name, { "permissions": "", "groups": "", "socket_address": "" })
-        config.users_config().save()
+    if store.get_user(user_name) == None:
+        store.put_user(user_name, storage.user_record())
         return True
     return False
 
 def remove_user(user_name):
     """
-    Removes a user from the global users file if the user exists
+    Removes a user from the store if the user exists
     """
-    if config.users_config().has_section(user_name):
-        config.users_config().remove_section(user_name)
-        config.users_config().save()
-        return True
-    return False
+    return store.delete_user(user_name)
 
 def add_user_to_group(user_name, group_name):
     """
     Adds a user to the specified group
     """
-    if config.users_config().has_section(user_name):
-        if config.groups_config().has_section(group_name):
-            groups = config.parse_safe_csv(config.users_config()[user_name]["groups"])
-            if group_name in groups:
+    record = store.get_user(user_name)
+    if record != None:
+        if store.get_group(group_name) != None:
+            if group_name in record["groups"]:
                 return -3
-            config.users_config().set(user_name, "groups", config.append_csv(config.users_config()[user_name]["groups"], group_name))
-            config.users_config().save()
+            record["groups"].append(group_name)
+            store.put_user(user_name, record)
             return True
         else:
             return -2
@@ -251,14 +481,13 @@ def remove_user_from_group(user_name, group_name):
     """
     Removes a user from the specified group
     """
-    if config.users_config().has_section(user_name):
-        if config.groups_config().has_section(group_name):
-            groups = config.parse_safe_csv(config.users_config()[user_name]["groups"])
-            if group_name not in groups:
+    record = store.get_user(user_name)
+    if record != None:
+        if store.get_group(group_name) != None:
+            if group_name not in record["groups"]:
                 return -3
-            groups.remove(group_name)
-            config.users_config().set(user_name, "groups", config.list_to_csv(groups))
-            config.users_config().save()
+            record["groups"].remove(group_name)
+            store.put_user(user_name, record)
             return True
         else:
             return -2
@@ -269,12 +498,12 @@ def add_group_permissions(group_name, perms):
     """
     Adds a permission string to a group
     """
-    if config.groups_config().has_section(group_name):
-        old_perms = config.parse_safe_csv(config.groups_config()[group_name]["permissions"])
+    record = store.get_group(group_name)
+    if record != None:
         new_perms = config.parse_safe_csv(perms)
-        if all([perm not in old_perms for perm in new_perms]):
-            config.groups_config().set(group_name, "permissions", config.append_csv(config.groups_config()[group_name]["permissions"], perms))
-            config.groups_config().save()
+        if all([perm not in record["permissions"] for perm in new_perms]):
+            record["permissions"] += new_perms
+            store.put_group(group_name, record)
             return True
         else:
             return -2
@@ -285,14 +514,13 @@ def remove_group_permissions(group_name, perms):
     """
     Adds a permission string to a group
     """
-    if config.groups_config().has_section(group_name):
-        old_perms = config.parse_safe_csv(config.groups_config()[group_name]["permissions"])
+    record = store.get_group(group_name)
+    if record != None:
         rem_perms = config.parse_safe_csv(perms)
-        if all([perm in old_perms for perm in rem_perms]):
+        if all([perm in record["permissions"] for perm in rem_perms]):
             for perm in rem_perms:
-                old_perms.remove(perm)
-            config.groups_config().set(group_name, "permissions", config.list_to_csv(old_perms))
-            config.groups_config().save()
+                record["permissions"].remove(perm)
+            store.put_group(group_name, record)
             return True
         else:
             return -2
@@ -303,12 +531,12 @@ def add_user_permissions(user_name, perms):
     """
     Adds a permission string to a user
     """
-    if config.users_config().has_section(user_name):
-        old_perms = config.parse_safe_csv(config.users_config()[user_name]["permissions"])
+    record = store.get_user(user_name)
+    if record != None:
         new_perms = config.parse_safe_csv(perms)
-        if all([perm not in old_perms for perm in new_perms]):
-            config.users_config().set(user_name, "permissions", config.append_csv(config.users_config()[user_name]["permissions"], perms))
-            config.users_config().save()
+        if all([perm not in record["permissions"] for perm in new_perms]):
+            record["permissions"] += new_perms
+            store.put_user(user_name, record)
             return True
         else:
             return -2
@@ -319,16 +547,89 @@ def remove_user_permissions(user_name, perms):
     """
     Adds a permission string to a user
     """
-    if config.users_config().has_section(user_name):
-        old_perms = config.parse_safe_csv(config.users_config()[user_name]["permissions"])
+    record = store.get_user(user_name)
+    if record != None:
         rem_perms = config.parse_safe_csv(perms)
-        if all([perm in old_perms for perm in rem_perms]):
+        if all([perm in record["permissions"] for perm in rem_perms]):
             for perm in rem_perms:
-                old_perms.remove(perm)
-            config.users_config().set(user_name, "permissions", config.list_to_csv(old_perms))
-            config.users_config().save()
+                record["permissions"].remove(perm)
+            store.put_user(user_name, record)
             return True
         else:
             return -2
     else:
         return -1
+
+def merge_values(values, new_values):
+    """
+    Appends the new values missing from a list
+    """
+    existing = set(values)
+    for value in new_values:
+        if value not in existing:
+            values.append(value)
+            existing.add(value)
+    return values
+
+def check_import(entries, kind, keys):
+    """
+    Checks that imported entries have non-empty string names and lists of strings as values
+    Raises ValueError naming the first malformed entry
+    """
+    if type(entries) != dict:
+        raise ValueError("Expected the " + kind + "s to import as a dictionary")
+    for name, values in entries.items():
+        if type(name) != str or name == "":
+            raise ValueError("Empty or invalid " + kind + " name " + repr(name))
+        if type(values) != dict:
+            raise ValueError("Expected a dictionary of values for " + kind + " '" + name + "'")
+        for key in keys:
+            value = values.get(key, [])
+            if type(value) != list or not all([type(item) == str for item in value]):
+                raise ValueError("Expected a list of strings as the " + key + " of " + kind + " '" + name + "'")
+
+def import_all(groups, users):
+    """
+    Bulk adds groups and users with their permissions and group memberships
+    Groups and users are given as dictionaries of names to { "permissions": [...], "groups": [...] }
+    Existing entries are merged with the imported values and the store is written once
+    Returns the number of groups and users imported and a list of the entries that were skipped
+    Every entry is checked before anything is written, raises ValueError naming the first malformed entry
+    """
+    check_import(groups, "group", ("permissions",))
+    check_import(users, "user", ("permissions", "groups"))
+    skipped = []
+    imported_groups, imported_users = 0, 0
+
+    with store.transaction():
+        for group_name, values in groups.items():
+            perms = values.get("permissions", [])
+            if not config.validate(group_name) or not all([config.validate_permission_string(perm) for perm in perms]):
+                skipped.append("group '" + group_name + "' contains illegal characters")
+                continue
+            record = store.get_group(group_name)
+            if record == None:
+                record = storage.group_record()
+            merge_values(record["permissions"], perms)
+            store.put_group(group_name, record)
+            imported_groups += 1
+
+        for user_name, values in users.items():
+            perms = values.get("permissions", [])
+            user_groups = values.get("groups", [])
+            if not config.validate(user_name) or not all([config.validate_permission_string(perm) for perm in perms]):
+                skipped.append("user '" + user_name + "' contains illegal characters")
+                continue
+            missing = [group_name for group_name in user_groups if store.get_group(group_name) == None]
+            if len(missing) > 0:
+                skipped.append("user '" + user_name + "' is in unknown group(s) '" + config.list_to_csv(missing) + "'")
+                continue
+            record = store.get_user(user_name)
+            if record == None:
+                record = storage.user_record()
+            merge_values(record["permissions"], perms)
+            merge_values(record["groups"], user_groups)
+            store.put_user(user_name, record)
+            imported_users += 1
+
+    return imported_groups, imported_users, skipped
@@ -3,13 +3,19 @@ This script handles the processing of all core WSSB commands from clients
 Help for all functionality of this script is available in the documentation
 """
 
-import logging
-import json
+import asyncio
+import os
 
 from wssb.events import Events
 from wssb import plugins
 from wssb import users
 from wssb import config
+from wssb import outbound
+from wssb import codec
+from wssb import log
+from wssb import metrics
+from wssb import profiling
+from wssb import ratelimit
 
 class Target():
     """
@@ -54,27 +60,38 @@ class Target():
         if type(group) == str:
             group_obj = users.find_group(group)
             return Target(groups=[group_obj]) if group_obj != None else None
-        return Target(groups=[group_obj])
+        return Target(groups=[group])
 
 
-def format_packet(x):
+def format_packet(x, packet_codec=None):
     """
-    Formats a dictionary or list of dictionaries into a packet string in JSON format to be sent
+    Formats a dictionary or list of dictionaries into a packet to be sent
+    Uses the JSON codec unless another codec is given
     """
     if type(x) in (list, dict):
-        return json.dumps(x)
+        if packet_codec == None:
+            packet_codec = codec.default()
+        return packet_codec.encode(x)
     return None
 
-def parse_packet(x):
+def parse_packet(x, packet_codec=None):
     """
-    Parses a JSON packet string into a dictionary object or list of dictionary objects
+    Parses a packet into a list of dictionary objects
+    Uses the JSON codec unless another codec is given, text frames are always parsed as JSON
+    Returns None if the packet cannot be parsed
     TODO: Should validate contents and integrity in the future
     """
-    if type(x) == str:
-        parsed = json.loads(x)
+    if packet_codec == None or (packet_codec.binary and type(x) == str):
+        packet_codec = codec.default()
+    if type(x) == str or (packet_codec.binary and type(x) == bytes):
+        try:
+            parsed = packet_codec.decode(x)
+        except ValueError:
+            return None
         if type(parsed) == dict:
             return [parsed]
-        return parsed
+        if type(parsed) == list:
+            return parsed
     return None
 
 def resp(response, target, to_close=[], close_reason="You have been kicked from the server!", stop=False):
@@ -101,27 +118,21 @@ def info(info_code, message):
     """
     return { "type": "response", "status": "info", "code": info_code, "message": message }
 
-def process(session_user, request, socket, quiet):
+async def process(session_user, request, socket, quiet):
     """
     Process a core request from client
     Return None if no request matches are found
     """
     if request["code"] == "auth":
-        return view_auth(session_user, request, socket, quiet)
-    elif request["code"] == "reloadcfg":
-        return view_reloadcfg(session_user, request, quiet)
-    elif request["code"] == "reloadusers":
-        return view_reloadusers(session_user, request, quiet)
-    elif request["code"] == "reloadplugins":
-        return view_reloadplugins(session_user, request, quiet)
-    elif request["code"] == "reload":
-        return view_reload(session_user, request, quiet)
-    elif request["code"] == "stop":
-        return view_stop(session_user, request, quiet)
-
+        return await view_auth(session_user, request, socket, quiet)
+    if request["code"] == "profile":
+        return await view_profile(session_user, request, socket, quiet)
+    view = core_routes.get(request["code"])
+    if view != None:
+        return await view(session_user, request, quiet)
     return None
 
-def view_auth(session_user, request, socket, quiet):
+async def view_auth(session_user, request, socket, quiet):
     """
     Identifies and authenticates a user
     """
@@ -130,20 +141,23 @@ def view_auth(session_user, request, socket, quiet):
     if "user_name" in request:
         user = users.find_user(request["user_name"])
         if user != None:
-            if plugins.trigger_conditional_handlers(Events.USER_AUTH_ATTEMPT, { "request": request, "user": user, "socket": socket }):
-                plugin_responses = plugins.trigger_handlers(Events.USER_AUTHENTICATED, { "user": user, "socket": socket })
-                logging.info("[SERVER] User '" + request["user_name"] + "' has been added to the list of connected users.")
-                if not quiet:
-                    print("[SERVER] User '" + request["user_name"] + "' has been added to the list of connected users.")
-                return { "wssb_authenticated": True, "user": user, "plugin_responses": plugin_responses }
-            else:
-                return error("WSSB_AUTH_FAILED", "User authentication failed!")
+            # The user must stay loaded while the handlers await, so its socket is registered to this same object
+            users.pin_user(user)
+            try:
+                if await plugins.trigger_conditional_handlers(Events.USER_AUTH_ATTEMPT, { "request": request, "user": user, "socket": socket }):
+                    plugin_responses = await plugins.trigger_handlers(Events.USER_AUTHENTICATED, { "request": request, "user": user, "socket": socket })
+                    log.info("SERVER", "User '" + request["user_name"] + "' has been added to the list of connected users.", event="user_authenticated", user=request["user_name"])
+                    return { "wssb_authenticated": True, "user": user, "plugin_responses": plugin_responses, "codec": codec.find(request["codec"]) if "codec" in request else None, "batch": request.get("batch") == True }
+                else:
+                    return error("WSSB_AUTH_FAILED", "User authentication failed!")
+            finally:
+                users.unpin_user(user)
         else:
             return error("WSSB_AUTH_USER_NOT_FOUND", "The user name specified does not exist on the server.")
     else:
         return error("WSSB_AUTH_INVALID_SYNTAX", "Invalid packet syntax.")
 
-def view_stop(session_user, request, quiet):
+async def view_stop(session_user, request, quiet):
     """
     Stops the server cleanly
     """
@@ -151,62 +165,159 @@ def view_stop(session_user, request, quiet):
         return resp(success("WSSB_STOPPING_SERVER", "Shutting down server now..."), Target.source(), stop=True)
     return resp(error("WSSB_ACCESS_DENIED", "You do not have permission to stop the server!"), Target.source())
 
-def view_reload(session_user, request, quiet):
+async def view_reload(session_user, request, quiet):
     """
     Reloads the global server config and the user services module
     """
     if session_user.has_permission("wssb.reload"):
-        cfg_resp = view_reloadcfg(session_user, request, quiet)
-        users_resp = view_reloadusers(session_user, request, quiet)
-        plugins_resp = view_reloadplugins(session_user, request, quiet)
-        logging.info("[SERVER] The server has been reloaded by \'" + session_user.name + "\'")
-        if not quiet:
-            print("[SERVER] The server has been reloaded by \'" + session_user.name + "\'")
+        cfg_resp = await view_reloadcfg(session_user, request, quiet)
+        users_resp = await view_reloadusers(session_user, request, quiet)
+        plugins_resp = await view_reloadplugins(session_user, request, quiet)
+        log.info("SERVER", "The server has been reloaded by \'" + session_user.name + "\'")
         return resp(success("WSSB_RELOADED", "The server has been reloaded successfully!"), Target.source(), to_close=users_resp["to_close"], stop=plugins_resp["stop"])
 
     return resp(error("WSSB_ACCESS_DENIED", "You do not have permission to reload the server!"), Target.source())
 
 
-def view_reloadplugins(session_user, request, quiet):
+async def view_reloadplugins(session_user, request, quiet):
     """
-    Reloads all plugins
+    Reloads all plugins, or only the plugin named in the request
     """
     if session_user.has_permission("wssb.reload.plugins"):
-        plugins.trigger_handlers(Events.SERVER_STOP, None)
-        if plugins.reload_all(quiet):
-            logging.info("[SERVER] The server plugins have been reloaded by \'" + session_user.name + "\'")
-            if not quiet:
-                print("[SERVER] The server plugins have been reloaded by \'" + session_user.name + "\'")
+        if request.get("plugin") != None:
+            if plugins.find(request["plugin"]) == None:
+                return resp(error("WSSB_PLUGIN_NOT_FOUND", "The plugin specified does not exist on the server."), Target.source())
+            if await plugins.reload_plugin(request["plugin"], quiet):
+                log.info("SERVER", "Plugin \'" + request["plugin"] + "\' has been reloaded by \'" + session_user.name + "\'")
+                return resp(success("WSSB_PLUGINS_RELOADED", "Plugin '" + request["plugin"] + "' has been reloaded successfully!"), Target.source())
+            return resp(error("WSSB_PLUGIN_RELOAD_FAILURE", "Could not reload plugin '" + request["plugin"] + "'"), Target.source())
+        await plugins.trigger_handlers(Events.SERVER_STOP, None)
+        if await plugins.reload_all(quiet):
+            log.info("SERVER", "The server plugins have been reloaded by \'" + session_user.name + "\'")
             return resp(success("WSSB_PLUGINS_RELOADED", "Server plugins have been reloaded successfully!"), Target.source())
         else:
             return resp(error("WSSB_PLUGIN_RELOAD_FAILURE", "Could not reload server plugins"), None, stop=True)
     return resp(error("WSSB_ACCESS_DENIED", "You do not have permission to reload the server plugins!"), Target.source())
 
 
-def view_reloadcfg(session_user, request, quiet):
+async def view_reloadcfg(session_user, request, quiet):
     """
     Reloads the global server config
     """
     if session_user.has_permission("wssb.reload.cfg"):
         config.global_config().reload()
-        logging.info("[SERVER] The global config has been reloaded by \'" + session_user.name + "\'")
-        if not quiet:
-            print("[SERVER] The global config has been reloaded by \'" + session_user.name + "\'")
+        outbound.load_config()
+        log.load_config()
+        ratelimit.load_config()
+        log.info("SERVER", "The global config has been reloaded by \'" + session_user.name + "\'")
         return resp(success("WSSB_CONFIG_RELOADED", "Global config has been reloaded successfully!"), Target.source())
     return resp(error("WSSB_ACCESS_DENIED", "You do not have permission to reload the global config!"), Target.source())
 
-def view_reloadusers(session_user, request, quiet):
+async def view_reloadusers(session_user, request, quiet):
     """
     Reloads the user services module (including groups)
     """
     if session_user.has_permission("wssb.reload.users"):
-        users.reload_all()
         sockets_to_close = []
-        for socket in users.connected_sockets:
-            if not users.socket_is_registered(socket):
-                sockets_to_close.append(socket)
-        logging.info("[SERVER] User services have been reloaded by \'" + session_user.name + "\'")
-        if not quiet:
-            print("[SERVER] User services have been reloaded by \'" + session_user.name + "\'")
+        users.reload_all(sockets_to_close)
+        ratelimit.invalidate()
+        log.info("SERVER", "User services have been reloaded by \'" + session_user.name + "\'")
         return resp(success("WSSB_USERS_RELOADED", "User services have been reloaded successfully!"), Target.source(), to_close=sockets_to_close)
     return resp(error("WSSB_ACCESS_DENIED", "You do not have permission to reload user services!"), Target.source())
+
+async def view_stats(session_user, request, quiet):
+    """
+    Returns the server metrics and outbound queue statistics
+    """
+    if session_user.has_permission("wssb.stats"):
+        response = success("WSSB_STATS", "Server statistics collected successfully!")
+        response["stats"] = metrics.snapshot()
+        return resp(response, Target.source())
+    return resp(error("WSSB_ACCESS_DENIED", "You do not have permission to view server statistics!"), Target.source())
+
+MAX_PROFILE_DURATION = 300 # Longest profiling window in seconds a single profile request may ask for
+profile_timer = None # Stops a timed profile once its window ends, None when no timed profile is running
+
+async def view_profile(session_user, request, socket, quiet):
+    """
+    Profiles the server at runtime
+    The start action starts a cProfile, and if a duration is given the result is sent to the requesting socket once it ends
+    The stop action stops the cProfile and returns the slowest functions, saving the profile if save is set
+    The handlers action returns the plugin views and event handlers that took the most time
+    """
+    global profile_timer
+
+    if not session_user.has_permission("wssb.profile"):
+        return resp(error("WSSB_ACCESS_DENIED", "You do not have permission to profile the server!"), Target.source())
+    action = request.get("action")
+    limit = request.get("limit", 30)
+    if type(limit) != int or limit < 1:
+        return resp(error("WSSB_PROFILE_INVALID_REQUEST", "The profile limit must be a positive integer."), Target.source())
+
+    if action == "handlers":
+        response = success("WSSB_PROFILE_HANDLERS", "Slowest plugin handlers collected successfully!")
+        response["handlers"] = profiling.slowest_handlers(limit)
+        if request.get("reset") == True:
+            profiling.reset_handlers()
+        return resp(response, Target.source())
+
+    if action == "start":
+        duration = request.get("duration")
+        if duration != None and (type(duration) not in (int, float) or duration <= 0 or duration > MAX_PROFILE_DURATION):
+            return resp(error("WSSB_PROFILE_INVALID_REQUEST", "The profile duration must be between 0 and " + str(MAX_PROFILE_DURATION) + " seconds."), Target.source())
+        if not profiling.start_profiler():
+            return resp(error("WSSB_PROFILE_RUNNING", "The server is already being profiled."), Target.source())
+        log.info("SERVER", "Profiling has been started by \'" + session_user.name + "\'")
+        response = success("WSSB_PROFILE_STARTED", "Profiling started successfully!")
+        if duration != None:
+            profile_timer = asyncio.get_running_loop().call_later(duration, finish_profile, socket, request.get("save") == True, limit)
+            response["duration"] = duration
+        return resp(response, Target.source())
+
+    if action == "stop":
+        if profile_timer != None:
+            profile_timer.cancel()
+            profile_timer = None
+        return resp(collect_profile(request.get("save") == True, limit), Target.source())
+
+    return resp(error("WSSB_PROFILE_INVALID_REQUEST", "The profile action must be start, stop or handlers."), Target.source())
+
+def collect_profile(save, limit):
+    """
+    Stops the running cProfile and returns a response with its slowest functions
+    """
+    path = profiling.profile_path() if save else None
+    stopped = profiling.stop_profiler(path)
+    if stopped == None:
+        return error("WSSB_PROFILE_NOT_RUNNING", "The server is not being profiled.")
+    profile, seconds = stopped
+    response = success("WSSB_PROFILE_COLLECTED", "Profile collected successfully!")
+    response["seconds"] = round(seconds, 3)
+    response["functions"] = profiling.summarize(profile, limit)
+    response["file"] = os.path.basename(path) if path != None else None
+    return response
+
+def finish_profile(socket, save, limit):
+    """
+    Ends a timed profile and sends its result to the socket that started it
+    """
+    global profile_timer
+
+    profile_timer = None
+    outbound.send(socket, format_packet(collect_profile(save, limit), codec.of(socket)))
+
+# Maps core request codes (other than auth) to their views
+core_routes = {
+    "reloadcfg": view_reloadcfg,
+    "reloadusers": view_reloadusers,
+    "reloadplugins": view_reloadplugins,
+    "reload": view_reload,
+    "stop": view_stop,
+    "stats": view_stats,
+    "profile": view_profile,
+}
+
+# Core request codes that are repeated on the other nodes of the backplane when they succeed
+repeated_routes = ("reloadcfg", "reloadusers", "reloadplugins", "reload")
+
+plugins.reserve_routes(["auth"] + list(core_routes.keys()))
@@ -0,0 +1,127 @@
+"""
+This script handles running the server as several worker processes sharing one port
+Help for all functionality of this script is available in the documentation
+"""
+
+import asyncio
+import os
+import pathlib
+import signal
+import sys
+import tempfile
+import time
+
+from wssb import config
+from wssb import backplane
+from wssb import log
+
+STARTUP_GRACE = 5 # Workers failing sooner than this many seconds after starting are not restarted
+
+count = 1 # Number of worker processes sharing the listening port, set in every worker
+
+class Supervisor():
+    """
+    Defines a supervisor that starts worker processes and restarts crashed ones
+    Unless a backplane is configured, the supervisor runs a local broker that connects its workers
+    """
+    def __init__(self, count, quiet, profile=False, profile_path=None):
+        """
+        Constructor for Supervisor
+        """
+        self.count, self.quiet = count, quiet
+        self.profile, self.profile_path = profile, profile_path
+        self.ipc_path = os.path.join(tempfile.mkdtemp(prefix="wssb-"), "ipc.sock")
+        self.broker = None
+        self.processes = {}
+        self.started = {}
+        self.stopping = False
+        self.done = None
+
+    def log(self, s):
+        """
+        Logs a supervisor message
+        """
+        log.info("SUPERVISOR", s)
+
+    async def spawn(self, index):
+        """
+        Starts a single worker process
+        """
+        env_root = str(pathlib.Path(__file__).parent.parent.absolute())
+        command = [sys.executable, env_root + "/manage.py", "runserver", "--worker-id", str(index), "--ipc", self.ipc_path, "--workers", str(self.count)]
+        if self.quiet:
+            command.append("-q")
+        if self.profile:
+            command.append("--profile-startup")
+        if self.profile_path != None:
+            command += ["--profile-file", os.path.abspath(self.profile_path)]
+        self.processes[index] = await asyncio.create_subprocess_exec(*command, cwd=env_root)
+        self.started[index] = time.monotonic()
+        self.log("Started worker " + str(index) + " with pid " + str(self.processes[index].pid))
+
+    async def monitor(self, index):
+        """
+        Waits for a worker to exit and restarts it if it crashed
+        A worker exiting cleanly means the server was stopped, so all workers are stopped
+        """
+        while not self.stopping:
+            code = await self.processes[index].wait()
+            if self.stopping:
+                return
+            if code == 0:
+                self.log("Worker " + str(index) + " stopped the server")
+                self.stop()
+                return
+            if time.monotonic() - self.started[index] < STARTUP_GRACE:
+                self.log("Worker " + str(index) + " failed to start with code " + str(code) + ", stopping the server")
+                self.stop()
+                return
+            self.log("Worker " + str(index) + " exited with code " + str(code) + ", restarting")
+            await asyncio.sleep(1)
+            if not self.stopping:
+                await self.spawn(index)
+
+    def stop(self):
+        """
+        Stops all worker processes
+        """
+        if self.stopping:
+            return
+        self.stopping = True
+        for process in self.processes.values():
+            if process.returncode == None:
+                process.send_signal(signal.SIGTERM)
+        self.done.set_result(None)
+
+    async def run(self):
+        """
+        Runs the relay and all workers until the server is stopped
+        """
+        loop = asyncio.get_running_loop()
+        self.done = loop.create_future()
+        loop.add_signal_handler(signal.SIGTERM, self.stop)
+        loop.add_signal_handler(signal.SIGINT, self.stop)
+
+        config.load_global_config()
+        if config.global_config()["GENERAL"]["backplane"] == "":
+            self.broker = backplane.Broker("unix://" + self.ipc_path)
+            await self.broker.start()
+        for index in range(self.count):
+            await self.spawn(index)
+        monitors = [asyncio.create_task(self.monitor(index)) for index in range(self.count)]
+
+        await self.done
+        await asyncio.gather(*[process.wait() for process in self.processes.values()])
+        for task in monitors:
+            task.cancel()
+        if self.broker != None:
+            self.broker.close()
+        os.rmdir(os.path.dirname(self.ipc_path))
+        self.log("All workers stopped")
+
+def supervise(count, quiet, profile=False, profile_path=None):
+    """
+    Starts the server as the given number of worker processes sharing the listening port
+    Startup profiling options are passed on to every worker
+    """
+    asyncio.run(Supervisor(count, quiet, profile, profile_path).run())